@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Asyncio Runtime for Raspberry Pi Audio Server
+Runs serial I/O, USB device events and playback tracking as tasks on one
+event loop instead of a daemon thread per subsystem
+"""
+
+import time
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import serial
+from config import *
+from wakeups import wakeups
+from usb_manager import open_uevent_socket
+
+logger = logging.getLogger(__name__)
+
+class AsyncRuntime:
+    def __init__(self, server):
+        self.server = server
+        self.loop = None
+        self.thread = None
+        self.stop_event = None
+        self.ready = threading.Event()
+        # Mounts, lsblk and sample decoding run here so they never stall the loop
+        self.executor = ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_WORKERS,
+                                           thread_name_prefix="runtime-io")
+
+    def start(self):
+        """Start the event loop thread and wait until it is running"""
+        self.thread = threading.Thread(target=self.run_loop, name="runtime-loop", daemon=True)
+        self.thread.start()
+        self.ready.wait(timeout=5)
+        logger.info(f"Asyncio runtime started ({ASYNC_EXECUTOR_WORKERS} executor workers)")
+
+    def run_loop(self):
+        """Thread body: own the event loop until stop() is called"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.main())
+        finally:
+            self.loop.close()
+
+    async def main(self):
+        """Run every subsystem task until stopped"""
+        self.stop_event = asyncio.Event()
+        tasks = [asyncio.create_task(self.serial_task(), name="serial")]
+        if USB_MOUNT_ENABLED:
+            tasks.append(asyncio.create_task(self.usb_task(), name="usb"))
+        self.ready.set()
+
+        await self.stop_event.wait()
+        # Playback tasks submitted from other threads are cancelled too
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def submit(self, coro):
+        """Schedule a coroutine on the loop from any thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run_blocking(self, func, *args):
+        """Await a blocking call on the bounded executor"""
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    async def serial_task(self):
+        """Read the XIAO receiver through an fd reader instead of a polling thread"""
+        reader = self.server.serial_reader
+        while True:
+            if not (reader.serial_conn and reader.serial_conn.is_open):
+                if not await self.run_blocking(reader.connect):
+                    await asyncio.sleep(5)  # Wait before retry
+                    continue
+            conn = reader.serial_conn
+            conn.timeout = 0  # Non-blocking reads, readiness comes from the loop
+            lost = self.loop.create_future()
+            buffer = bytearray()
+
+            def on_readable():
+                wakeups.record("serial")
+                try:
+                    data = conn.read(conn.in_waiting or 1)
+                except (serial.SerialException, OSError) as e:
+                    if not lost.done():
+                        lost.set_result(e)
+                    return
+                received_at = time.perf_counter()
+                if reader.capture:
+                    reader.capture.write(data)
+                buffer.extend(data)
+                while b'\n' in buffer:
+                    line, _, rest = buffer.partition(b'\n')
+                    buffer[:] = rest
+                    try:
+                        reader.handle_line(line.decode('utf-8', errors='ignore'), received_at)
+                    except Exception as e:
+                        logger.error(f"Error handling serial line: {e}")
+
+            self.loop.add_reader(conn.fileno(), on_readable)
+            try:
+                error = await lost
+            finally:
+                self.loop.remove_reader(conn.fileno())
+            logger.error(f"Serial connection lost: {error}")
+            reader.disconnect()
+            reader.notify("serial_lost", port=reader.port, error=str(error))
+            await asyncio.sleep(1)
+
+    async def usb_task(self):
+        """Check USB devices when the kernel reports a disk event, with mounts offloaded to the executor"""
+        usb_manager = self.server.usb_manager
+        usb_manager.led_blink_pattern("system_ready")
+        sock = usb_manager.uevent_socket = open_uevent_socket()
+        changed = asyncio.Event()
+
+        def on_uevent():
+            wakeups.record("usb")
+            if usb_manager.read_uevents():
+                changed.set()
+
+        if sock:
+            self.loop.add_reader(sock.fileno(), on_uevent)
+        try:
+            while True:
+                try:
+                    await self.run_blocking(usb_manager.check_usb_devices)
+                except Exception as e:
+                    logger.error(f"USB monitoring error: {e}")
+                    usb_manager.led_blink_pattern("system_error")
+                if not sock:
+                    await asyncio.sleep(USB_CHECK_INTERVAL)
+                    wakeups.record("usb")
+                    continue
+                await changed.wait()
+                # Let the burst of events for one device settle before rescanning
+                while changed.is_set():
+                    changed.clear()
+                    try:
+                        await asyncio.wait_for(changed.wait(), USB_UEVENT_SETTLE)
+                    except asyncio.TimeoutError:
+                        break
+        finally:
+            if sock:
+                self.loop.remove_reader(sock.fileno())
+                sock.close()
+                usb_manager.uevent_socket = None
+
+    def stop(self):
+        """Stop all tasks and the loop"""
+        if self.loop and self.stop_event:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+        if self.thread:
+            self.thread.join(timeout=5)
+        self.executor.shutdown(wait=False)
+        logger.info("Asyncio runtime stopped")
@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+Audio Engine for Raspberry Pi Audio Server
+Owns the playback backend (pygame or the NumPy software mixer), either in the
+server process or in a supervised child process that takes commands over a
+shared-memory ring
+"""
+
+import os
+import time
+import signal
+import struct
+import threading
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+from collections import deque
+from config import *
+from shm_ring import SharedRing
+from wakeups import wakeups, timers
+
+logger = logging.getLogger(__name__)
+
+# Command ring (server -> engine): opcode, sequence, sent_at (monotonic), value, then path
+COMMAND = struct.Struct('<BIdf')
+CMD_PLAY = 1
+CMD_STREAM = 2
+CMD_STOP = 3
+CMD_VOLUME = 4
+CMD_PRELOAD = 5
+CMD_UNLOAD = 6
+
+# State ring (engine -> server): opcode, sequence, echoed sent_at, engine time, then path
+STATE = struct.Struct('<BIdd')
+STATE_ACK = 1
+STATE_STARTED = 2
+STATE_FINISHED = 3
+STATE_ERROR = 4
+STATE_LOADED = 5
+
+def init_mixer():
+    """Initialize the pygame mixer for the USB audio card"""
+    import pygame
+    os.environ.setdefault("SDL_AUDIODRIVER", "alsa")
+    os.environ.setdefault("AUDIODEV", "plughw:0,0")
+    # Calibrated sizes are measured on the numpy mixer and don't carry over to SDL
+    pygame.mixer.pre_init(frequency=SAMPLE_RATE, size=-16, channels=CHANNELS, buffer=BUFFER_SIZE)
+    pygame.mixer.init()
+    pygame.mixer.set_reserved(2)  # Channels 0 and 1 take turns playing preloaded samples
+    return pygame
+
+class AudioEngine:
+    """In-process playback on the pygame mixer"""
+
+    def __init__(self):
+        self.pygame = init_mixer()
+        # An interrupted sample fades out on its channel while the next one
+        # starts on the other, so the fade never delays the new sound
+        self.sample_channels = [self.pygame.mixer.Channel(0), self.pygame.mixer.Channel(1)]
+        self.sample_channel = self.sample_channels[0]
+        self.volume = DEFAULT_VOLUME
+        # SDL end events need the pygame event queue, so the end of a sound is
+        # found with one timer at its expected length instead
+        self.on_finished = None
+        self.end_timer = None
+
+    def start(self):
+        return True
+
+    def load(self, path):
+        """Decode a file into a playable sample"""
+        return self.pygame.mixer.Sound(path)
+
+    def play(self, sample=None, path=None):
+        """Fade out the current voice and start a preloaded sample or stream a file"""
+        music = self.pygame.mixer.music
+        if music.get_busy():
+            # music.fadeout() blocks for the whole fade, so streams are still cut
+            music.stop()
+        self.fade_sample()
+        if sample is not None:
+            self.sample_channel = self.sample_channels[self.sample_channel is self.sample_channels[0]]
+            self.sample_channel.stop()
+            self.sample_channel.set_volume(self.volume)
+            self.sample_channel.play(sample)
+            self.watch_end(sample.get_length())
+        else:
+            music.set_volume(self.volume)
+            music.load(path)
+            music.play()
+            self.watch_end(AUDIO_END_RECHECK)
+
+    def watch_end(self, delay):
+        """Check for the end of playback after delay seconds"""
+        if self.end_timer:
+            self.end_timer.cancel()
+        self.end_timer = timers.call_later(delay, self.check_end)
+
+    def check_end(self):
+        self.end_timer = None
+        if self.is_busy():
+            self.watch_end(AUDIO_END_RECHECK)
+        elif self.on_finished:
+            self.on_finished()
+
+    def fade_sample(self):
+        if not self.sample_channel.get_busy():
+            return
+        if MIXER_FADE_MS > 0:
+            self.sample_channel.fadeout(MIXER_FADE_MS)
+        else:
+            self.sample_channel.stop()
+
+    def stop(self):
+        self.pygame.mixer.music.stop()
+        self.fade_sample()
+        self.watch_end(MIXER_FADE_MS / 1000)
+
+    def set_volume(self, volume):
+        self.volume = volume
+        self.pygame.mixer.music.set_volume(volume)
+        self.sample_channel.set_volume(volume)
+
+    def is_busy(self):
+        """Check if a sample or streamed file is playing"""
+        return self.sample_channel.get_busy() or self.pygame.mixer.music.get_busy()
+
+    def active_sounds(self):
+        """Samples that are currently playing, including one still fading out"""
+        return {channel.get_sound() for channel in self.sample_channels}
+
+    def voice_count(self):
+        """Busy sample channels plus a playing stream"""
+        return sum(channel.get_busy() for channel in self.sample_channels) + self.pygame.mixer.music.get_busy()
+
+    def get_status(self):
+        return {'mode': 'in_process', 'backend': 'pygame', 'buffer_size': BUFFER_SIZE}
+
+    def shutdown(self):
+        pass
+
+def create_backend():
+    """Build the playback backend selected by AUDIO_BACKEND"""
+    if AUDIO_BACKEND == "numpy":
+        from mixer import MixerBackend
+        return MixerBackend()
+    return AudioEngine()
+
+class EngineSample:
+    """Handle to a sample decoded inside the engine process"""
+
+    def __init__(self, engine, path):
+        self.engine = engine
+        self.path = path
+        self.size_bytes = os.path.getsize(path)
+
+    def release(self):
+        self.engine.release(self.path)
+
+class AudioEngineProcess:
+    """Proxy for an AudioEngine running in a supervised child process"""
+
+    def __init__(self, event_callback=None):
+        self.event_callback = event_callback
+        self.context = multiprocessing.get_context('spawn')
+        self.process = None
+        self.command_ring = None
+        self.state_ring = None
+        self.command_doorbell = None
+        self.state_doorbell = None
+        # Guards the rings and doorbells, which are replaced on restart
+        self.send_lock = threading.Lock()
+        self.available = False
+        self.sequence = 0
+        self.volume = DEFAULT_VOLUME
+        self.preloaded = {}
+        self.preload_lock = threading.Lock()
+        self.current_sample = None
+        self.current_seq = None
+        self.busy = False
+        self.on_finished = None
+        self.running = False
+        self.supervisor_thread = None
+        self.restarts = 0
+        self.commands_dropped = 0
+        self.round_trips = deque(maxlen=AUDIO_ENGINE_RTT_WINDOW)
+
+    def start(self):
+        """Start the engine process and its supervisor thread"""
+        self.running = True
+        self.spawn()
+        self.supervisor_thread = threading.Thread(target=self.supervisor_loop, daemon=True)
+        self.supervisor_thread.start()
+        return True
+
+    def spawn(self):
+        """Create fresh rings and launch the engine process
+
+        Commands sent while the rings are rebuilt are dropped, as they would
+        be with a full ring.
+        """
+        with self.send_lock:
+            self.available = False
+            self.close_rings()
+            self.command_ring = SharedRing.create(AUDIO_ENGINE_RING_SLOTS, AUDIO_ENGINE_SLOT_SIZE)
+            self.state_ring = SharedRing.create(AUDIO_ENGINE_RING_SLOTS, AUDIO_ENGINE_SLOT_SIZE)
+            command_wait, self.command_doorbell = self.context.Pipe(duplex=False)
+            self.state_doorbell, state_notify = self.context.Pipe(duplex=False)
+            self.process = self.context.Process(
+                target=engine_process_main,
+                args=(self.command_ring.name, self.state_ring.name, command_wait, state_notify),
+                name="audio-engine",
+                daemon=True
+            )
+            self.process.start()
+            self.available = True
+        logger.info(f"Audio engine process started (pid {self.process.pid})")
+
+        # Restore state lost with a previous process
+        self.send(CMD_VOLUME, value=self.volume, wait=True)
+        with self.preload_lock:
+            preloaded = list(self.preloaded.items())
+        for path, count in preloaded:
+            self.send(CMD_PRELOAD, value=count, path=path, wait=True)
+
+    def close_rings(self):
+        """Close the rings and doorbells; called with send_lock held"""
+        for ring in (self.command_ring, self.state_ring):
+            if ring:
+                ring.close()
+        for doorbell in (self.command_doorbell, self.state_doorbell):
+            if doorbell:
+                doorbell.close()
+        self.command_ring = self.state_ring = None
+        self.command_doorbell = self.state_doorbell = None
+
+    def send(self, opcode, value=0.0, path="", wait=False):
+        """Push a command onto the ring and ring the doorbell
+
+        With wait=True a full ring is retried until AUDIO_ENGINE_SEND_TIMEOUT;
+        otherwise the command is dropped so callers on the trigger path never block.
+        """
+        with self.send_lock:
+            if not self.available:
+                self.commands_dropped += 1
+                logger.warning("Audio engine restarting, dropping command")
+                return None
+            self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+            payload = COMMAND.pack(opcode, self.sequence, time.monotonic(), value) + path.encode('utf-8')
+            deadline = time.monotonic() + AUDIO_ENGINE_SEND_TIMEOUT
+            while not self.command_ring.push(payload):
+                if not wait or time.monotonic() > deadline:
+                    self.commands_dropped += 1
+                    logger.error("Audio engine command ring full, dropping command")
+                    return None
+                self.ring_doorbell()
+                time.sleep(0.001)
+            self.ring_doorbell()
+            return self.sequence
+
+    def ring_doorbell(self):
+        """Wake the engine process"""
+        try:
+            self.command_doorbell.send_bytes(b'\x01')
+        except Exception as e:
+            logger.debug(f"Audio engine doorbell failed: {e}")
+
+    def load(self, path):
+        """Ask the engine to decode a file and return a handle to it"""
+        with self.preload_lock:
+            self.preloaded[path] = self.preloaded.get(path, 0) + 1
+        self.send(CMD_PRELOAD, value=1, path=path, wait=True)
+        return EngineSample(self, path)
+
+    def release(self, path):
+        """Drop one reference to a sample decoded in the engine"""
+        with self.preload_lock:
+            count = self.preloaded.get(path, 0) - 1
+            if count > 0:
+                self.preloaded[path] = count
+            else:
+                self.preloaded.pop(path, None)
+        self.send(CMD_UNLOAD, path=path, wait=True)
+
+    def play(self, sample=None, path=None):
+        """Start a preloaded sample or stream a file in the engine"""
+        if sample is not None:
+            seq = self.send(CMD_PLAY, path=sample.path)
+        else:
+            seq = self.send(CMD_STREAM, path=path)
+        if seq is not None:
+            self.current_seq = seq
+            self.current_sample = sample
+            self.busy = True
+
+    def stop(self):
+        self.send(CMD_STOP)
+
+    def set_volume(self, volume):
+        self.volume = volume
+        self.send(CMD_VOLUME, value=volume)
+
+    def is_busy(self):
+        return self.busy
+
+    def active_sounds(self):
+        return {self.current_sample} if self.busy else set()
+
+    def voice_count(self):
+        """The engine process reports only its current voice, not ones fading out"""
+        return int(self.busy)
+
+    def supervisor_loop(self):
+        """Drain engine state messages and restart the engine if it dies
+
+        Sleeps until the engine rings the state doorbell or its process exits.
+        """
+        while self.running:
+            try:
+                wait([self.state_doorbell, self.process.sentinel])
+                wakeups.record("engine_supervisor")
+                while self.state_doorbell.poll(0):
+                    self.state_doorbell.recv_bytes()
+            except (EOFError, OSError):
+                time.sleep(AUDIO_ENGINE_SUPERVISOR_INTERVAL)
+
+            while self.running:
+                message = self.state_ring.pop()
+                if message is None:
+                    break
+                self.handle_state(message)
+
+            if self.running and not self.process.is_alive():
+                logger.error(f"Audio engine process exited with code {self.process.exitcode}, restarting")
+                self.busy = False
+                self.notify_finished()
+                self.restarts += 1
+                if self.event_callback:
+                    self.event_callback("engine_restarted", exitcode=self.process.exitcode, restarts=self.restarts)
+                time.sleep(AUDIO_ENGINE_RESTART_DELAY)
+                self.spawn()
+
+    def handle_state(self, message):
+        """Apply one state message from the engine"""
+        opcode, seq, sent_at, engine_time = STATE.unpack_from(message)
+        detail = message[STATE.size:].decode('utf-8', errors='replace')
+        if opcode == STATE_ACK:
+            # Library work (STATE_LOADED) includes decode time, so only
+            # immediate commands count towards the round-trip figures
+            self.round_trips.append(time.monotonic() - sent_at)
+        elif opcode == STATE_FINISHED:
+            if seq == self.current_seq:
+                self.busy = False
+                self.current_sample = None
+                self.notify_finished()
+        elif opcode == STATE_ERROR:
+            logger.error(f"Audio engine error: {detail}")
+            if seq == self.current_seq:
+                self.busy = False
+                self.notify_finished()
+
+    def notify_finished(self):
+        if self.on_finished:
+            self.on_finished()
+
+    def get_status(self):
+        """Get engine process status and command round-trip times"""
+        samples = sorted(self.round_trips)
+        rtt = None
+        if samples:
+            rtt = {
+                'count': len(samples),
+                'p50_us': round(samples[len(samples) // 2] * 1e6, 1),
+                'p99_us': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6, 1),
+                'max_us': round(samples[-1] * 1e6, 1)
+            }
+        with self.send_lock:
+            depth = self.command_ring.depth() if self.available else 0
+        return {
+            'mode': 'process',
+            'backend': AUDIO_BACKEND,
+            'pid': self.process.pid if self.process else None,
+            'alive': bool(self.process and self.process.is_alive()),
+            'restarts': self.restarts,
+            'commands_dropped': self.commands_dropped,
+            'command_ring_depth': depth,
+            'round_trip': rtt
+        }
+
+    def shutdown(self):
+        """Stop the engine process"""
+        self.running = False
+        if self.process and self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=2)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+        if self.supervisor_thread:
+            self.supervisor_thread.join(timeout=2)
+        with self.send_lock:
+            self.available = False
+            self.close_rings()
+
+def engine_process_main(command_name, state_name, command_wait, state_notify):
+    """Entry point of the engine process"""
+    logging.basicConfig(level=getattr(logging, LOG_LEVEL),
+                        format='%(asctime)s - audio_engine[child] - %(levelname)s - %(message)s')
+    engine = create_backend()
+    # The backend reports finished voices through a pipe, so the loop below
+    # sleeps until a command arrives or a voice ends
+    end_wait, end_notify = os.pipe()
+    engine.on_finished = lambda: os.write(end_notify, b'\x01')
+    engine.start()
+    # SDL traps SIGINT/SIGTERM for its event queue; restore the defaults so the
+    # supervisor can stop this process
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    commands = SharedRing.attach(command_name, AUDIO_ENGINE_RING_SLOTS, AUDIO_ENGINE_SLOT_SIZE)
+    states = SharedRing.attach(state_name, AUDIO_ENGINE_RING_SLOTS, AUDIO_ENGINE_SLOT_SIZE)
+    samples = {}
+    refcounts = {}
+    # Preloads and unloads are deferred so a decode never delays a queued play
+    library_work = deque()
+    voice_seq = None
+    voice_path = ""
+
+    def publish(opcode, seq, sent_at, detail=""):
+        if states.push(STATE.pack(opcode, seq, sent_at, time.monotonic()) + detail.encode('utf-8')):
+            state_notify.send_bytes(b'\x01')
+
+    while True:
+        # Sleep until a command arrives or a voice ends
+        ready = wait([command_wait, end_wait], 0 if library_work else None)
+        if command_wait in ready:
+            while command_wait.poll(0):
+                command_wait.recv_bytes()
+        if end_wait in ready:
+            os.read(end_wait, 4096)
+
+        while True:
+            message = commands.pop()
+            if message is None:
+                break
+            opcode, seq, sent_at, value = COMMAND.unpack_from(message)
+            path = message[COMMAND.size:].decode('utf-8')
+            if opcode in (CMD_PRELOAD, CMD_UNLOAD):
+                library_work.append((opcode, seq, sent_at, value, path))
+                continue
+            try:
+                if opcode in (CMD_PLAY, CMD_STREAM):
+                    if voice_seq is not None:
+                        publish(STATE_FINISHED, voice_seq, sent_at, voice_path)
+                    sample = samples.get(path) if opcode == CMD_PLAY else None
+                    if opcode == CMD_PLAY and sample is None:
+                        sample = samples[path] = engine.load(path)
+                    engine.play(sample=sample, path=path)
+                    voice_seq, voice_path = seq, path
+                    publish(STATE_STARTED, seq, sent_at, path)
+                elif opcode == CMD_STOP:
+                    engine.stop()
+                elif opcode == CMD_VOLUME:
+                    engine.set_volume(value)
+                publish(STATE_ACK, seq, sent_at)
+            except Exception as e:
+                publish(STATE_ERROR, seq, sent_at, f"{path}: {e}")
+
+        if voice_seq is not None and not engine.is_busy():
+            publish(STATE_FINISHED, voice_seq, 0.0, voice_path)
+            voice_seq = None
+
+        if library_work:
+            opcode, seq, sent_at, value, path = library_work.popleft()
+            try:
+                if opcode == CMD_PRELOAD:
+                    refcounts[path] = refcounts.get(path, 0) + max(1, int(value))
+                    if path not in samples:
+                        samples[path] = engine.load(path)
+                else:
+                    refcounts[path] = refcounts.get(path, 1) - 1
+                    if refcounts[path] <= 0:
+                        refcounts.pop(path, None)
+                        samples.pop(path, None)
+                publish(STATE_LOADED, seq, sent_at, path)
+            except Exception as e:
+                publish(STATE_ERROR, seq, sent_at, f"{path}: {e}")
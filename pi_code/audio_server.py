@@ -4,47 +4,102 @@ Raspberry Pi Audio Server
 Handles audio playback triggered by Seeed XIAO controllers
 """
 
-import pygame
 import threading
+import asyncio
 import time
 import logging
 import os
+import hmac
 import json
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from config import *
 from usb_manager import USBManager
 from status_led import StatusLED
 from serial_reader import SerialReader
+from event_stream import EventBroadcaster
+from status_snapshot import StatusSnapshot
+from sample_cache import SampleCache
+from routing import Router
+from scenes import SceneManager
+from prefetch import Prefetcher
+from audio_engine import AudioEngineProcess, create_backend
+from async_runtime import AsyncRuntime
+from trigger_scheduler import TriggerScheduler, priority_for
+from cluster import ClusterNode, ROLE_LEADER
+from trigger_intake import TriggerIntake, parse_trigger
+from log_pipeline import setup_logging
+from journal import TriggerJournal
+from profiler import SamplingProfiler
+from tracing import tracer
+from resource_monitor import ResourceMonitor
+from wakeups import wakeups, timers, Signal
 
-# Initialize pygame mixer for audio playback with ALSA configuration
-os.environ.setdefault("SDL_AUDIODRIVER", "alsa")
-os.environ.setdefault("AUDIODEV", "plughw:0,0")
-
-pygame.mixer.pre_init(frequency=SAMPLE_RATE, size=-16, channels=CHANNELS, buffer=BUFFER_SIZE)
-pygame.mixer.init()
-
-# Setup logging
-logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
 class AudioServer:
-    def __init__(self):
+    def __init__(self, log_pipeline=None):
+        """log_pipeline is the running LogPipeline that serves GET /logs"""
         self.app = Flask(__name__)
+        self.log_pipeline = log_pipeline
         self.audio_queue = []
         self.current_audio = None
+        self.playback_id = 0
+        self.triggers_handled = 0
         self.volume = DEFAULT_VOLUME
-        self.usb_manager = USBManager()
+        self.events = EventBroadcaster()
+        self.usb_manager = USBManager(event_callback=self.events.publish)
         self.status_led = StatusLED()
-        self.serial_reader = SerialReader()
+        self.serial_reader = SerialReader(event_callback=self.events.publish)
+        self.runtime = None
+        if RUNTIME_MODE == "asyncio":
+            self.runtime = AsyncRuntime(self)
+            # Serial commands skip the HTTP hop back to this server
+            self.serial_reader.trigger_callback = lambda button_id, is_hold: self.handle_trigger(
+                button_id, is_hold, "xiao_receiver_serial")
+        if AUDIO_ENGINE_PROCESS:
+            self.engine = AudioEngineProcess(event_callback=self.events.publish)
+        else:
+            self.engine = create_backend()
+        # Playback trackers sleep until the engine reports a finished sound
+        self.playback_ended = Signal()
+        self.engine.on_finished = self.playback_ended.notify
+        self.engine.start()
+        default_cache = SampleCache(self.engine.load)
+        if self.runtime:
+            default_cache.executor = self.runtime.executor
+        self.scenes = SceneManager(
+            Router(default_cache, self.usb_manager, event_callback=self.events.publish),
+            default_cache,
+            self.usb_manager,
+            active_sounds=self.engine.active_sounds,
+            event_callback=self.events.publish
+        )
+        self.prefetcher = Prefetcher(lambda: self.router)
+        self.scheduler = TriggerScheduler(self.is_playing, event_callback=self.events.publish)
+        self.cluster = ClusterNode(event_callback=self.events.publish)
+        self.intake = TriggerIntake(self.handle_trigger)
+        self.journal = TriggerJournal() if JOURNAL_ENABLED else None
+        self.profiler = SamplingProfiler()
+        self.monitor = ResourceMonitor()
+        self.setup_monitor()
+        self.status_snapshot = StatusSnapshot(self.build_status)
+        # State events are coalesced and applied on the refresher thread
+        self.state_changed = Signal()
+        self.pending_state = set()
+        self.pending_lock = threading.Lock()
+        self.events.add_listener(self.on_state_event)
         self.setup_routes()
         self.setup_audio_directory()
+        self.router.reload()
+        
+    def setup_monitor(self):
+        """Register the server's gauges and rates with the resource monitor"""
+        self.monitor.add_gauge("voices", self.engine.voice_count, "Voices playing or fading out")
+        self.monitor.add_gauge("scheduler_queue", lambda: len(self.scheduler.heap), "Triggers waiting for dispatch")
+        self.monitor.add_gauge("intake_queue", self.intake.queue.qsize, "Fast-acked triggers waiting for routing")
+        self.monitor.add_counter("triggers", lambda: self.triggers_handled, "Triggers handled")
+        self.monitor.add_counter("serial_lines", lambda: self.serial_reader.lines_read, "Lines read from the receiver")
+        self.monitor.add_counter("wakeups", wakeups.total, "Thread wakeups across all subsystems")
         
     def setup_audio_directory(self):
         """Create audio directory if it doesn't exist"""
@@ -53,70 +108,455 @@ class AudioServer:
             logger.info(f"Created audio directory: {AUDIO_DIR}")
             
         # Create placeholder audio files if they don't exist
-        for audio_file in AUDIO_MAPPINGS.values():
+        for audio_file in self.router.table.audio_files():
             file_path = os.path.join(AUDIO_DIR, audio_file)
             if not os.path.exists(file_path):
                 logger.warning(f"Audio file not found: {file_path}")
                 
+    @property
+    def router(self):
+        """Router of the active scene"""
+        return self.scenes.active.router
+        
+    @property
+    def sample_cache(self):
+        """Sample cache of the active scene"""
+        return self.scenes.active.sample_cache
+        
+    def build_status(self):
+        """Build the cacheable part of the /status document from live state"""
+        return {
+            'status': 'running',
+            'current_audio': self.current_audio,
+            'volume': self.volume,
+            'audio_files': self.router.table.names,
+            'scene': self.scenes.active.name,
+            'esp_now_enabled': ESP_NOW_ENABLED,
+            'usb_status': self.usb_manager.get_status()
+        }
+        
+    def on_state_event(self, event):
+        """Note an event that changes reported state for the refresher thread
+
+        Listeners run on the publisher's thread (the trigger path, the USB
+        monitor), so this only records the event; a burst of events is folded
+        into one rebuild.
+        """
+        if event['type'] in STATUS_SNAPSHOT_EVENTS:
+            with self.pending_lock:
+                self.pending_state.add(event['type'])
+            self.state_changed.notify()
+            
+    def state_refresh_loop(self):
+        """Apply pending state events: reload routes on USB changes, rebuild the snapshot"""
+        while True:
+            generation = self.state_changed.generation
+            with self.pending_lock:
+                pending, self.pending_state = self.pending_state, set()
+            if pending:
+                try:
+                    if pending & {"usb_mounted", "usb_removed"}:
+                        # Re-resolve routes that point at USB files and preload what changed
+                        self.router.reload()
+                    self.status_snapshot.refresh()
+                except Exception as e:
+                    logger.error(f"Error refreshing server state: {e}")
+            self.state_changed.wait(generation)
+            
+    def handle_trigger(self, button_id, is_hold=False, source='direct', transmitter_id=TRANSMITTER_ID,
+                       play_at=None, trigger_id=None):
+        """Resolve a button event and start its sound
+
+        Returns a (response body, HTTP status) pair so both the HTTP route and
+        in-process callers such as the serial reader can use it. play_at is a
+        local monotonic start time for cluster-synchronized playback.
+        """
+        start = time.perf_counter()
+        self.triggers_handled += 1
+        with tracer.span("process_trigger", source=source) as span:
+            body, status_code = self.process_trigger(button_id, is_hold, source, transmitter_id, play_at, trigger_id)
+            span.set(status=status_code)
+        if self.journal:
+            self.journal.record(source, transmitter_id, button_id, "hold" if is_hold else "press",
+                                body.get('audio_file'), status_code, (time.perf_counter() - start) * 1000)
+        return body, status_code
+        
+    def process_trigger(self, button_id, is_hold, source, transmitter_id, play_at, trigger_id):
+        """Route, admit and queue one trigger for handle_trigger"""
+        if not button_id:
+            return {'error': 'Missing button_id'}, 400
+        
+        # Resolve audio file based on transmitter, button and hold state
+        route_event = "hold" if is_hold and HOLD_DETECTION_ENABLED else "press"
+        with tracer.span("resolve", transmitter=transmitter_id, button=button_id, event=route_event):
+            route = self.router.resolve(transmitter_id, button_id, route_event)
+        
+        if not route:
+            logger.error(f"No audio mapping found for transmitter {transmitter_id} button {button_id} {route_event}")
+            return {'error': 'No audio file mapped'}, 404
+            
+        audio_file = route.audio_file
+        priority = priority_for(route, route_event)
+        throttled = self.scheduler.admit(source, transmitter_id, button_id, priority)
+        if throttled:
+            self.events.publish("trigger_throttled", transmitter_id=transmitter_id, button_id=button_id,
+                                source=source, reason=throttled)
+            return {'error': 'Trigger rate limited', 'reason': throttled}, 429
+            
+        sample = route.sample
+        if sample is None and route.path:
+            # Not preloaded - it may still be cached by a prefetch
+            with tracer.span("cache_lookup", path=route.path) as span:
+                sample = self.sample_cache.lookup(route.path)
+            span.set(hit=sample is not None)
+            self.prefetcher.record_play(route_event, route.path, sample is not None)
+        
+        if self.cluster.role == ROLE_LEADER and play_at is None:
+            # Every node, this one included, starts at the same leader clock time
+            trigger_id, play_at = self.cluster.broadcast(button_id, is_hold, transmitter_id, source)
+        
+        if play_at is not None:
+            rejected = self.scheduler.submit(priority, tracer.bind(self.cluster.schedule, "scheduler_queue"), play_at,
+                                             trigger_id, tracer.bind(self.play_scheduled, "play_at_wait"),
+                                             audio_file, sample)
+        else:
+            rejected = self.scheduler.submit(priority, tracer.bind(self.dispatch_playback, "scheduler_queue"),
+                                             audio_file, sample)
+        if rejected == "priority":
+            self.events.publish("trigger_dropped", transmitter_id=transmitter_id, button_id=button_id,
+                                source=source, reason=rejected)
+            return {'error': 'Higher priority sound playing', 'reason': rejected}, 409
+        if rejected:
+            return {'error': 'Trigger queue full'}, 503
+        
+        # A press is usually followed by its hold, so decode that while the press plays
+        if PREFETCH_ENABLED and route_event == "press":
+            self.prefetcher.on_press(transmitter_id, button_id, route)
+        
+        # Indicate button received on status LED
+        if hasattr(self, 'status_led'):
+            with tracer.span("led"):
+                self.status_led.indicate_button_received()
+        
+        event_type = "hold" if is_hold else "press"
+        self.events.publish("trigger_accepted", transmitter_id=transmitter_id, button_id=button_id,
+                            event_type=event_type, audio_file=audio_file, source=source)
+        logger.info(f"Triggered audio: {audio_file} from Button{button_id} {event_type} (source: {source})")
+        return {'status': 'success', 'audio_file': audio_file, 'source': source, 'event_type': event_type}, 200
+        
+    def dispatch_playback(self, audio_file, sample):
+        """Play audio in a separate thread, or as a task on the asyncio runtime"""
+        if self.runtime:
+            self.runtime.submit(self.play_audio_async(audio_file, sample))
+        else:
+            threading.Thread(
+                target=tracer.bind(self.play_audio, "thread_start"),
+                args=(audio_file, sample),
+                daemon=True
+            ).start()
+            
     def setup_routes(self):
         """Setup Flask routes for XIAO communication"""
         
         @self.app.route('/trigger_audio', methods=['POST'])
         def trigger_audio():
             """Handle audio trigger requests from XIAO controllers"""
-            try:
-                data = request.get_json()
-                button_id = data.get('button_id')
-                is_hold = data.get('is_hold', False)  # New: indicates if this is a hold event
-                source = data.get('source', 'direct')  # 'direct', 'xiao_to_xiao', or 'xiao_transmitter'
-                
-                if not button_id:
-                    return jsonify({'error': 'Missing button_id'}), 400
-                
-                # Determine audio file based on button and hold state
-                if is_hold and HOLD_DETECTION_ENABLED:
-                    audio_key = f"hold{button_id}"
-                else:
-                    audio_key = f"button{button_id}"
+            with tracer.trace(request.headers.get('X-Trace-Id')), tracer.span("trigger_audio"):
+                try:
+                    data = request.get_json(silent=True)
+                    # source is 'direct', 'xiao_to_xiao' or 'xiao_transmitter'; is_hold marks a hold event
+                    try:
+                        trigger = parse_trigger(data)
+                    except ValueError as e:
+                        return jsonify({'error': str(e)}), 400
                     
-                audio_file = AUDIO_MAPPINGS.get(audio_key)
+                    # Optional: event_id makes retries idempotent, "ack": "fast" replies once queued
+                    fast_ack = data.get('ack', 'fast' if TRIGGER_FAST_ACK else 'full') == 'fast'
+                    body, status_code = self.intake.submit(trigger, data.get('event_id'), fast_ack)
+                    return jsonify(body), status_code
                 
-                if not audio_file:
-                    logger.error(f"No audio mapping found for {audio_key}")
-                    return jsonify({'error': 'No audio file mapped'}), 404
-                    
-                # Play audio in separate thread
-                threading.Thread(
-                    target=self.play_audio, 
-                    args=(audio_file,),
-                    daemon=True
-                ).start()
-                
-                # Indicate button received on status LED
-                if hasattr(self, 'status_led'):
-                    self.status_led.indicate_button_received()
+                except Exception as e:
+                    logger.error(f"Error handling audio trigger: {e}")
+                    return jsonify({'error': str(e)}), 500
                 
-                event_type = "hold" if is_hold else "press"
-                logger.info(f"Triggered audio: {audio_file} from Button{button_id} {event_type} (source: {source})")
-                return jsonify({'status': 'success', 'audio_file': audio_file, 'source': source, 'event_type': event_type})
+        @self.app.route('/status', methods=['GET'])
+        def get_status():
+            """Get server status
+
+            The base document comes from a pre-serialized snapshot and supports
+            If-None-Match. Heavier sections are opt-in via
+            ?include=usb_files,samples,events,engine,scheduler,peers,intake,wakeups
+            """
+            snapshot = self.status_snapshot.get()
+            include = {name for name in request.args.get('include', '').split(',') if name}
+            
+            if not include:
+                response = Response(snapshot.body, mimetype='application/json')
+                response.set_etag(snapshot.etag)
+            else:
+                status = dict(snapshot.data)
+                if 'usb_files' in include:
+                    status['usb_files'] = self.usb_manager.get_audio_files_from_usb()
+                if 'samples' in include:
+                    # Cache loads and evictions publish no event, so never snapshot these
+                    status['samples'] = self.sample_cache.content.get_status()
+                if 'events' in include:
+                    status['event_stream'] = self.events.get_status()
+                if 'engine' in include:
+                    status['engine'] = self.engine.get_status()
+                if 'scheduler' in include:
+                    status['scheduler'] = self.scheduler.get_status()
+                if 'intake' in include:
+                    status['intake'] = self.intake.get_status()
+                if 'wakeups' in include:
+                    status['wakeups'] = wakeups.get_status()
+                if 'peers' in include and self.serial_reader.forwarder:
+                    status['peers'] = self.serial_reader.forwarder.get_status()
+                response = jsonify(status)
+                response.add_etag()
                 
+            response.headers['Cache-Control'] = 'no-cache'
+            return response.make_conditional(request)
+            
+        @self.app.route('/journal/stats', methods=['GET'])
+        def journal_stats():
+            """Aggregate trigger usage (?since=&until= epoch seconds, or ?hours=24; &transmitter=&button=)"""
+            if not self.journal:
+                return jsonify({'error': 'Journal disabled'}), 404
+            try:
+                since = request.args.get('since', type=float)
+                until = request.args.get('until', type=float)
+                hours = request.args.get('hours', type=float)
+                if hours:
+                    since = time.time() - hours * 3600
+                stats = self.journal.query(since, until, request.args.get('transmitter'), request.args.get('button'))
+                stats['journal'] = self.journal.get_status()
+                return jsonify(stats)
             except Exception as e:
-                logger.error(f"Error handling audio trigger: {e}")
+                logger.error(f"Error querying trigger journal: {e}")
                 return jsonify({'error': str(e)}), 500
                 
-        @self.app.route('/status', methods=['GET'])
-        def get_status():
-            """Get server status"""
-            usb_status = self.usb_manager.get_status()
+        @self.app.route('/receiver/telemetry', methods=['GET'])
+        def receiver_telemetry():
+            """Per-transmitter activity and receiver status parsed from serial output"""
+            return jsonify(self.serial_reader.telemetry.get_status())
+            
+        @self.app.route('/metrics/history', methods=['GET'])
+        def metrics_history():
+            """Sampled resource history as columns (?seconds=3600&step=12 averages 12 samples per point)"""
+            history = self.monitor.get_history(request.args.get('seconds', type=float),
+                                               request.args.get('step', 1, type=int))
+            history['monitor'] = self.monitor.get_status()
+            return jsonify(history)
+            
+        @self.app.route('/metrics', methods=['GET'])
+        def metrics():
+            """Latest resource sample in Prometheus text format"""
+            return Response(self.monitor.prometheus(), mimetype='text/plain; version=0.0.4')
+            
+        @self.app.route('/wakeups', methods=['GET'])
+        def wakeup_counts():
+            """Thread wakeups per second per subsystem, to confirm the server sleeps when idle"""
+            status = wakeups.get_status()
+            status['timers'] = timers.get_status()
+            return jsonify(status)
+            
+        @self.app.route('/logs', methods=['GET'])
+        def get_logs():
+            """Recent log records from memory (?limit=100&level=WARNING&logger=serial_reader)"""
+            try:
+                limit = int(request.args.get('limit', 100))
+            except ValueError:
+                return jsonify({'error': 'Invalid limit'}), 400
+            limit = min(max(limit, 1), LOG_RING_SIZE)
+            if not self.log_pipeline:
+                return jsonify({'error': 'Log pipeline not running'}), 404
             return jsonify({
-                'status': 'running',
-                'current_audio': self.current_audio,
-                'volume': self.volume,
-                'audio_files': list(AUDIO_MAPPINGS.keys()),
-                'esp_now_enabled': ESP_NOW_ENABLED,
-                'usb_status': usb_status
+                'records': self.log_pipeline.get_records(limit, request.args.get('level'), request.args.get('logger')),
+                'pipeline': self.log_pipeline.get_status()
             })
             
+        @self.app.route('/debug/profile', methods=['GET'])
+        def profile_window():
+            """Profile all threads for ?seconds=10 (&interval_ms=5&format=collapsed)"""
+            denied = self.check_debug_token()
+            if denied:
+                return denied
+            report = self.profiler.profile(request.args.get('seconds', 10.0, type=float),
+                                           self.profile_interval())
+            if report is None:
+                return jsonify({'error': 'Profiler already running'}), 409
+            return self.profile_response(report)
+            
+        @self.app.route('/debug/profile/start', methods=['POST'])
+        def profile_start():
+            """Start sampling all threads until /debug/profile/stop (?interval_ms=5)"""
+            denied = self.check_debug_token()
+            if denied:
+                return denied
+            if not self.profiler.start(self.profile_interval()):
+                return jsonify({'error': 'Profiler already running'}), 409
+            return jsonify({'status': 'started', 'profiler': self.profiler.get_status()}), 202
+            
+        @self.app.route('/debug/profile/stop', methods=['POST'])
+        def profile_stop():
+            """Stop sampling and return the report (?format=collapsed for flamegraph input)"""
+            denied = self.check_debug_token()
+            if denied:
+                return denied
+            report = self.profiler.stop()
+            if report is None:
+                return jsonify({'error': 'Profiler not running'}), 409
+            return self.profile_response(report)
+            
+        @self.app.route('/debug/profile/status', methods=['GET'])
+        def profile_status():
+            """Whether a profiling session is running"""
+            denied = self.check_debug_token()
+            if denied:
+                return denied
+            return jsonify(self.profiler.get_status())
+            
+        @self.app.route('/debug/trace', methods=['GET'])
+        def trace_export():
+            """Buffered trigger spans as Chrome trace JSON (?trace_id= or ?last=10)"""
+            denied = self.check_debug_token()
+            if denied:
+                return denied
+            trace = tracer.export(request.args.get('trace_id', type=int), request.args.get('last', type=int))
+            response = jsonify(trace)
+            if request.args.get('download') == '1':
+                response.headers['Content-Disposition'] = 'attachment; filename=wrb-trace.json'
+            return response
+            
+        @self.app.route('/debug/trace', methods=['POST'])
+        def trace_configure():
+            """Change tracing at runtime: {"enabled": true, "sample_rate": 0.1, "max_per_second": 20, "clear": true}"""
+            denied = self.check_debug_token()
+            if denied:
+                return denied
+            try:
+                data = request.get_json() or {}
+                tracer.configure(data.get('enabled'), data.get('sample_rate'), data.get('max_per_second'))
+                if data.get('clear'):
+                    tracer.clear()
+                return jsonify(tracer.get_status())
+            except (TypeError, ValueError) as e:
+                return jsonify({'error': str(e)}), 400
+                
+        @self.app.route('/debug/trace/status', methods=['GET'])
+        def trace_status():
+            """Tracing settings and buffer usage"""
+            denied = self.check_debug_token()
+            if denied:
+                return denied
+            return jsonify(tracer.get_status())
+            
+        @self.app.route('/events', methods=['GET'])
+        def event_stream():
+            """Stream playback and device state changes as Server-Sent Events"""
+            subscriber = self.events.subscribe()
+            return Response(
+                stream_with_context(self.events.stream(subscriber)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+            
+        @self.app.route('/reload_mappings', methods=['POST'])
+        def reload_mappings():
+            """Recompile the mapping file and swap it in after preloading changed sounds"""
+            if self.router.reload() is None:
+                return jsonify({'error': 'Failed to load mapping file'}), 400
+            return jsonify({'status': 'reloading', 'routing': self.router.get_status()}), 202
+            
+        @self.app.route('/routes', methods=['GET'])
+        def get_routes():
+            """List the active routes"""
+            table = self.router.table
+            return jsonify({
+                'routes': [route.to_dict() for route in table.routes],
+                'routing': self.router.get_status(),
+                'sample_cache': self.sample_cache.get_status(),
+                'prefetch': self.prefetcher.get_status()
+            })
+            
+        @self.app.route('/cluster/trigger', methods=['POST'])
+        def cluster_trigger():
+            """Accept a trigger forwarded by the cluster leader
+
+            The leader retries on timeout, so triggers are deduplicated by
+            trigger_id, and ones arriving after their start time are dropped.
+            """
+            try:
+                data = request.get_json(silent=True)
+                try:
+                    trigger = parse_trigger(data, default_source='cluster')
+                    trigger_id = str(data['trigger_id'])
+                    leader_play_at = float(data['play_at'])
+                except (ValueError, KeyError, TypeError) as e:
+                    return jsonify({'error': f"Invalid cluster trigger: {e}"}), 400
+                play_at = self.cluster.clock.to_local(leader_play_at)
+                if play_at is None:
+                    return jsonify({'error': 'Clock not synced with leader'}), 503
+                if time.monotonic() - play_at > CLUSTER_MAX_LATE:
+                    logger.warning(f"Dropped cluster trigger {trigger_id} arriving after its start time")
+                    return jsonify({'error': 'Play-at time has passed', 'trigger_id': trigger_id}), 410
+                key = f"cluster:{trigger_id}"
+                previous = self.intake.event_ids.claim(key)
+                if previous:
+                    body, status_code = previous
+                    return jsonify(dict(body, duplicate=True)), status_code
+                try:
+                    body, status_code = self.handle_trigger(
+                        trigger['button_id'],
+                        trigger['is_hold'],
+                        trigger['source'],
+                        trigger['transmitter_id'],
+                        play_at,
+                        trigger_id
+                    )
+                except Exception:
+                    self.intake.event_ids.release(key)
+                    raise
+                self.intake.event_ids.complete(key, body, status_code)
+                return jsonify(body), status_code
+                
+            except Exception as e:
+                logger.error(f"Error handling cluster trigger: {e}")
+                return jsonify({'error': str(e)}), 500
+                
+        @self.app.route('/cluster/status', methods=['GET'])
+        def cluster_status():
+            """Clock sync state and recent start errors; the leader adds inter-node skew"""
+            return jsonify(self.cluster.get_status(include_skew=request.args.get('skew') == '1'))
+            
+        @self.app.route('/scenes', methods=['GET'])
+        def get_scenes():
+            """List scenes and their load state"""
+            return jsonify(self.scenes.get_status())
+            
+        @self.app.route('/scenes/<name>/prepare', methods=['POST'])
+        def prepare_scene(name):
+            """Preload a scene in the background while the current one keeps playing"""
+            try:
+                scene = self.scenes.prepare(name)
+                return jsonify({'status': scene.state, 'scene': scene.to_dict()}), 202
+            except KeyError as e:
+                return jsonify({'error': str(e)}), 404
+            except Exception as e:
+                return jsonify({'error': str(e)}), 400
+                
+        @self.app.route('/scenes/<name>/activate', methods=['POST'])
+        def activate_scene(name):
+            """Switch to a scene, preloading it first if it is not ready yet"""
+            try:
+                scene, switch_us = self.scenes.activate(name)
+                return jsonify({'status': 'success', 'scene': scene.to_dict(), 'switch_us': switch_us})
+            except KeyError as e:
+                return jsonify({'error': str(e)}), 404
+            except Exception as e:
+                return jsonify({'error': str(e)}), 400
+                
         @self.app.route('/set_volume', methods=['POST'])
         def set_volume():
             """Set audio volume"""
@@ -125,80 +565,195 @@ class AudioServer:
                 volume = float(data.get('volume', DEFAULT_VOLUME))
                 volume = max(0.0, min(1.0, volume))  # Clamp between 0 and 1
                 self.volume = volume
-                pygame.mixer.music.set_volume(volume)
+                self.engine.set_volume(volume)
+                self.events.publish("volume_changed", volume=volume)
                 return jsonify({'status': 'success', 'volume': volume})
             except Exception as e:
                 return jsonify({'error': str(e)}), 400
                 
-    def play_audio(self, audio_file):
-        """Play audio file"""
-        try:
-            # First try local audio directory
-            file_path = os.path.join(AUDIO_DIR, audio_file)
-            
-            # If not found locally, check USB drives
-            if not os.path.exists(file_path):
-                usb_audio_files = self.usb_manager.get_audio_files_from_usb()
-                if audio_file in usb_audio_files:
-                    file_path = usb_audio_files[audio_file]
-                    logger.info(f"Playing audio from USB: {file_path}")
-                else:
-                    logger.error(f"Audio file not found: {audio_file}")
-                    return
-            
-            # Stop any currently playing audio
-            if pygame.mixer.music.get_busy():
-                pygame.mixer.music.stop()
+    def check_debug_token(self):
+        """Return an error response unless the request carries DEBUG_TOKEN"""
+        if not DEBUG_TOKEN:
+            return jsonify({'error': 'Debug endpoints disabled'}), 404
+        token = request.headers.get('X-Debug-Token', '')
+        authorization = request.headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            token = authorization[len('Bearer '):]
+        if not hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode()):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return None
+        
+    def profile_interval(self):
+        interval_ms = request.args.get('interval_ms', type=float)
+        return interval_ms / 1000 if interval_ms else None
+        
+    def profile_response(self, report):
+        if request.args.get('format') == 'collapsed':
+            return Response(report['collapsed'], mimetype='text/plain')
+        return jsonify(report)
+        
+    def is_playing(self):
+        """Check if a sample or streamed file is playing"""
+        return self.engine.is_busy()
+        
+    def start_audio(self, audio_file, sample=None):
+        """Start playback, returning its playback id or None if the file is missing"""
+        file_path = None
+        if sample is None:
+            with tracer.span("file_lookup", audio_file=audio_file):
+                # First try local audio directory
+                file_path = os.path.join(AUDIO_DIR, audio_file)
                 
-            # Set volume and play
-            pygame.mixer.music.set_volume(self.volume)
-            pygame.mixer.music.load(file_path)
-            pygame.mixer.music.play()
-            
-            self.current_audio = audio_file
-            logger.info(f"Playing audio: {audio_file}")
-            
+                # If not found locally, check USB drives
+                if not os.path.exists(file_path):
+                    usb_audio_files = self.usb_manager.get_audio_files_from_usb()
+                    if audio_file in usb_audio_files:
+                        file_path = usb_audio_files[audio_file]
+                        logger.info(f"Playing audio from USB: {file_path}")
+                    else:
+                        logger.error(f"Audio file not found: {audio_file}")
+                        return None
+        
+        # Replace any currently playing audio
+        with tracer.span("mixer_start", preloaded=sample is not None):
+            self.engine.play(sample=sample, path=file_path)
+        
+        self.playback_id += 1
+        playback_id = self.playback_id
+        self.playback_ended.notify()  # The tracker of a replaced sound reports it interrupted
+        self.current_audio = audio_file
+        self.events.publish("playback_started", audio_file=audio_file, file_path=file_path)
+        logger.info(f"Playing audio: {audio_file}")
+        
+        with tracer.span("led"):
             # LED indication while playing
             if USB_MOUNT_ENABLED:
                 self.usb_manager.led_on()
             
             # Status LED indication while playing
             self.status_led.indicate_audio_playing()
+        return playback_id
+        
+    def finish_audio(self, audio_file, playback_id):
+        """Report the end of a playback and turn off the LEDs"""
+        if playback_id != self.playback_id:
+            self.events.publish("playback_finished", audio_file=audio_file, interrupted=True)
+            logger.info(f"Interrupted: {audio_file}")
+            return
+            
+        self.current_audio = None
+        self.events.publish("playback_finished", audio_file=audio_file, interrupted=False)
+        logger.info(f"Finished playing: {audio_file}")
+        
+        # Turn off LEDs after playing
+        if USB_MOUNT_ENABLED:
+            self.usb_manager.led_off()
+            
+    def playback_failed(self, audio_file, error):
+        """Reset playback state after an error"""
+        logger.error(f"Error playing audio {audio_file}: {error}")
+        self.current_audio = None
+        self.events.publish("playback_finished", audio_file=audio_file, interrupted=False, error=str(error))
+        if USB_MOUNT_ENABLED:
+            self.usb_manager.led_off()
+            
+    def play_audio(self, audio_file, sample=None):
+        """Play audio file, using the preloaded sample when one is available"""
+        try:
+            playback_id = self.start_audio(audio_file, sample)
+            if playback_id is None:
+                return
+            self.track_playback(audio_file, playback_id)
+            
+        except Exception as e:
+            self.playback_failed(audio_file, e)
             
-            # Wait for playback to complete
-            while pygame.mixer.music.get_busy():
-                time.sleep(0.1)
+    def track_playback(self, audio_file, playback_id):
+        """Wait for playback to complete or be replaced by a newer trigger"""
+        try:
+            generation = self.playback_ended.generation
+            while self.is_playing() and playback_id == self.playback_id:
+                generation = self.playback_ended.wait(generation, PLAYBACK_END_TIMEOUT)
+                wakeups.record("playback")
                 
-            self.current_audio = None
-            logger.info(f"Finished playing: {audio_file}")
+            self.finish_audio(audio_file, playback_id)
             
-            # Turn off LEDs after playing
-            if USB_MOUNT_ENABLED:
-                self.usb_manager.led_off()
+        except Exception as e:
+            self.playback_failed(audio_file, e)
             
+    def play_scheduled(self, audio_file, sample=None):
+        """Start playback on the calling (cluster timer) thread, then track it in the background"""
+        try:
+            playback_id = self.start_audio(audio_file, sample)
+            if playback_id is None:
+                return
+            if self.runtime:
+                self.runtime.submit(self.track_playback_async(audio_file, playback_id))
+            else:
+                threading.Thread(
+                    target=self.track_playback,
+                    args=(audio_file, playback_id),
+                    daemon=True
+                ).start()
+                
         except Exception as e:
-            logger.error(f"Error playing audio {audio_file}: {e}")
-            self.current_audio = None
-            if USB_MOUNT_ENABLED:
-                self.usb_manager.led_off()
+            self.playback_failed(audio_file, e)
+            
+    async def play_audio_async(self, audio_file, sample=None):
+        """Coroutine version of play_audio for the asyncio runtime"""
+        try:
+            playback_id = self.start_audio(audio_file, sample)
+            if playback_id is None:
+                return
+            await self.track_playback_async(audio_file, playback_id)
+            
+        except Exception as e:
+            self.playback_failed(audio_file, e)
+            
+    async def track_playback_async(self, audio_file, playback_id):
+        """Coroutine version of track_playback"""
+        try:
+            generation = self.playback_ended.generation
+            while self.is_playing() and playback_id == self.playback_id:
+                generation = await self.playback_ended.wait_async(generation, PLAYBACK_END_TIMEOUT)
+                wakeups.record("playback")
+                
+            self.finish_audio(audio_file, playback_id)
+            
+        except Exception as e:
+            self.playback_failed(audio_file, e)
             
     def run(self):
         """Start the audio server"""
         logger.info("Starting Audio Server...")
         logger.info(f"Audio directory: {AUDIO_DIR}")
-        logger.info(f"Available audio files: {list(AUDIO_MAPPINGS.keys())}")
-        
-        # Start USB monitoring
-        if USB_MOUNT_ENABLED:
-            logger.info("Starting USB auto-mounting...")
-            self.usb_manager.start_monitoring()
+        logger.info(f"Available audio files: {self.router.table.names}")
         
-        # Start serial reader for XIAO receiver
-        logger.info("Starting serial reader for XIAO receiver...")
-        if self.serial_reader.start():
-            logger.info("Serial reader started successfully")
+        if self.runtime:
+            # Serial, USB device events and playback tracking share one loop
+            logger.info("Starting asyncio runtime...")
+            self.runtime.start()
         else:
-            logger.warning("Failed to start serial reader - XIAO receiver not connected")
+            # Start USB monitoring
+            if USB_MOUNT_ENABLED:
+                logger.info("Starting USB auto-mounting...")
+                self.usb_manager.start_monitoring()
+            
+            # Start serial reader for XIAO receiver
+            logger.info("Starting serial reader for XIAO receiver...")
+            if self.serial_reader.start():
+                logger.info("Serial reader started successfully")
+            else:
+                logger.warning("Failed to start serial reader - XIAO receiver not connected")
+        
+        threading.Thread(target=self.state_refresh_loop, name="state-refresh", daemon=True).start()
+        self.scheduler.start()
+        self.intake.start()
+        self.cluster.start()
+        if MONITOR_ENABLED:
+            self.monitor.start()
+        if PREFETCH_ENABLED:
+            self.prefetcher.start()
         
         # Set status LED to ready state
         self.status_led.set_ready_state(True)
@@ -206,7 +761,7 @@ class AudioServer:
         
         # Test audio system
         try:
-            pygame.mixer.music.set_volume(self.volume)
+            self.engine.set_volume(self.volume)
             logger.info("Audio system initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize audio system: {e}")
@@ -218,15 +773,25 @@ class AudioServer:
         except KeyboardInterrupt:
             logger.info("Server stopped by user")
         finally:
+            if self.runtime:
+                self.runtime.stop()
+            self.cluster.stop()
+            self.monitor.stop()
+            if self.journal:
+                self.journal.close()
             if USB_MOUNT_ENABLED:
                 self.usb_manager.cleanup()
             self.serial_reader.stop()
             self.status_led.cleanup()
+            self.engine.shutdown()
 
 def main():
     """Main function"""
+    # Set up here rather than at import: the engine process re-imports this
+    # module, and must not start a second writer on the same log file
+    log_pipeline = setup_logging()
     try:
-        server = AudioServer()
+        server = AudioServer(log_pipeline)
         server.run()
     except KeyboardInterrupt:
         logger.info("Server stopped by user")
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Audio Buffer Calibration for Raspberry Pi Audio Server
+Finds the smallest mixer buffer that plays without underruns on this Pi and
+output device under load, and stores it for the numpy backend to use
+"""
+
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+import logging
+import numpy as np
+from config import *
+
+logger = logging.getLogger(__name__)
+
+def device_key(sink=MIXER_SINK, device=MIXER_ALSA_DEVICE, backend="numpy"):
+    """Identify what a calibration applies to: Pi model, audio backend and output device"""
+    try:
+        with open("/proc/device-tree/model") as f:
+            model = f.read().strip('\x00\n ')
+    except OSError:
+        model = socket.gethostname()
+    return f"{model}|{backend}|{device if sink == 'alsa' else sink}"
+
+def load_calibrations(path=CALIBRATION_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f"Failed to read buffer calibration: {e}")
+        return {}
+
+def save_calibration(key, result, path=CALIBRATION_FILE):
+    calibrations = load_calibrations(path)
+    calibrations[key] = result
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(calibrations, f, indent=2)
+    os.replace(temp_path, path)
+
+def calibrated_buffer_size(default, backend="numpy"):
+    """The stored buffer size for this backend and device, or default if none is stored"""
+    if not CALIBRATION_APPLY:
+        return default
+    entry = load_calibrations().get(device_key(backend=backend))
+    return entry['buffer_size'] if entry else default
+
+class SyntheticLoad:
+    """Threads that keep the CPU and the GIL busy, like a server under traffic"""
+
+    def __init__(self, threads=CALIBRATION_LOAD_THREADS):
+        self.threads = threads
+        self.running = False
+        self.workers = []
+
+    def work(self):
+        matrix = np.random.default_rng(0).standard_normal((64, 64))
+        while self.running:
+            sum(index * index for index in range(5000))  # Holds the GIL
+            matrix @ matrix
+
+    def __enter__(self):
+        self.running = True
+        self.workers = [threading.Thread(target=self.work, daemon=True) for _ in range(self.threads)]
+        for worker in self.workers:
+            worker.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.running = False
+        for worker in self.workers:
+            worker.join()
+
+def run_size(block_size, seconds, voices, sink_kind):
+    """Play noise through the mixer at one buffer size and count glitches"""
+    from mixer import SoftwareMixer, MixerSample, NullSink, create_sink
+
+    sink = NullSink(realtime=True) if sink_kind == "null" else create_sink(sink_kind, block_size)
+    mixer = SoftwareMixer(sink, block_size=block_size, max_voices=voices)
+    frames = int(SAMPLE_RATE * (seconds + 1))
+    rng = np.random.default_rng(block_size)
+    for index in range(voices):
+        data = (rng.standard_normal((frames, CHANNELS)) * 0.01).astype(np.float32)
+        mixer.add_voice(MixerSample(f"noise{index}", data), gain=1 / voices)
+    mixer.start()
+    time.sleep(seconds)
+    mixer.stop()
+    status = mixer.get_status()
+    return {
+        'buffer_size': block_size,
+        'latency_ms': status['latency_ms'],
+        'underruns': status['underruns'],
+        'underrun_ms': status['underrun_ms'],
+        'xruns': status['sink_xruns'],
+        'render_us_max': status['render_us_max'],
+        'load_percent': status['load_percent'],
+        'glitch_free': status['underruns'] == 0 and status['sink_xruns'] == 0
+    }
+
+def calibrate(sizes=CALIBRATION_SIZES, seconds=CALIBRATION_SECONDS, voices=CALIBRATION_VOICES,
+              load_threads=CALIBRATION_LOAD_THREADS, sink_kind=MIXER_SINK):
+    """Step down through sizes until one glitches; returns the report"""
+    results = []
+    chosen = None
+    with SyntheticLoad(load_threads):
+        for size in sorted(sizes, reverse=True):
+            result = run_size(size, seconds, voices, sink_kind)
+            results.append(result)
+            logger.info(f"Buffer {size}: {result['underruns']} underruns, {result['xruns']} xruns")
+            if not result['glitch_free']:
+                break
+            chosen = size
+    if chosen is None:
+        chosen = max(sizes)
+        logger.warning(f"Every buffer size glitched; falling back to {chosen}")
+    return {
+        'buffer_size': chosen,
+        'sink': sink_kind,
+        'calibrated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'load_threads': load_threads,
+        'voices': voices,
+        'results': results
+    }
+
+def main():
+    """Calibrate the buffer size for this device, or show stored calibrations"""
+    parser = argparse.ArgumentParser(description="Find the smallest glitch-free audio buffer size")
+    parser.add_argument("--sink", default=MIXER_SINK, choices=["alsa", "null"])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(CALIBRATION_SIZES))
+    parser.add_argument("--seconds", type=float, default=CALIBRATION_SECONDS)
+    parser.add_argument("--voices", type=int, default=CALIBRATION_VOICES)
+    parser.add_argument("--load-threads", type=int, default=CALIBRATION_LOAD_THREADS)
+    parser.add_argument("--dry-run", action="store_true", help="do not store the result")
+    parser.add_argument("--show", action="store_true", help="print stored calibrations and exit")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.show:
+        print(json.dumps(load_calibrations(), indent=2))
+        return
+
+    key = device_key(args.sink)
+    report = calibrate(args.sizes, args.seconds, args.voices, args.load_threads, args.sink)
+    print(f"Device: {key}")
+    print(f"{'buffer':>7} {'latency ms':>10} {'underruns':>9} {'xruns':>5} {'render us max':>13} {'load %':>7}")
+    for result in report['results']:
+        print(f"{result['buffer_size']:>7} {result['latency_ms']:>10} {result['underruns']:>9} "
+              f"{result['xruns']:>5} {result['render_us_max']:>13} {result['load_percent']:>7}")
+    print(f"Selected buffer size: {report['buffer_size']}")
+    if not args.dry_run:
+        save_calibration(key, report)
+        print(f"Saved to {CALIBRATION_FILE}")
+
+if __name__ == "__main__":
+    main()
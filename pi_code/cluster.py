@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Cluster Sync for Raspberry Pi Audio Server
+Lets several Pis play the same trigger at the same moment: the leader forwards
+triggers with a play-at time and followers convert it through an estimated
+clock offset
+"""
+
+import time
+import json
+import heapq
+import socket
+import struct
+import threading
+import itertools
+import logging
+from collections import deque
+import requests
+from config import *
+from peer_forwarder import PeerForwarder
+
+logger = logging.getLogger(__name__)
+
+ROLE_STANDALONE = "standalone"
+ROLE_LEADER = "leader"
+ROLE_FOLLOWER = "follower"
+
+# Sync ping: sequence number and follower send time; the reply appends the
+# leader's receive and send times. All times are monotonic seconds.
+PING = struct.Struct('<Id')
+PONG = struct.Struct('<Iddd')
+
+def wait_until(target):
+    """Sleep until a monotonic time, spinning for the last few milliseconds"""
+    while True:
+        remaining = target - time.monotonic()
+        if remaining <= 0:
+            return
+        if remaining > CLUSTER_SPIN_SECONDS:
+            time.sleep(remaining - CLUSTER_SPIN_SECONDS)
+
+class ClockEstimator:
+    """Estimate leader clock offset and drift from ping round trips
+
+    offset is leader_time - local_time. Only the lowest-delay samples are used,
+    since queueing delay is asymmetric and biases the estimate.
+    """
+
+    def __init__(self, window=CLUSTER_PING_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.offset = None
+        self.drift = 0.0
+        self.reference = 0.0
+        self.rtt = None
+
+    def add_sample(self, t0, t1, t2, t3):
+        """Add one exchange: t0/t3 local send/receive, t1/t2 leader receive/send"""
+        rtt = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        with self.lock:
+            self.samples.append(((t0 + t3) / 2, offset, rtt))
+            self.update()
+
+    def update(self):
+        """Refit offset and drift over the best samples
+
+        Must be called with the lock held.
+        """
+        best_rtt = min(sample[2] for sample in self.samples)
+        good = [sample for sample in self.samples if sample[2] <= best_rtt * 2 + 0.0005]
+        self.rtt = best_rtt
+        self.reference = sum(sample[0] for sample in good) / len(good)
+        mean_offset = sum(sample[1] for sample in good) / len(good)
+        spread = sum((sample[0] - self.reference) ** 2 for sample in good)
+        if len(good) >= 4 and spread > 0:
+            self.drift = sum((sample[0] - self.reference) * (sample[1] - mean_offset) for sample in good) / spread
+        self.offset = mean_offset
+
+    def offset_at(self, local_time):
+        """Leader minus local clock at a local time, or None before the first sample"""
+        with self.lock:
+            if self.offset is None:
+                return None
+            return self.offset + self.drift * (local_time - self.reference)
+
+    def to_local(self, leader_time):
+        """Convert a leader clock time to the local clock"""
+        offset = self.offset_at(time.monotonic())
+        return None if offset is None else leader_time - offset
+
+    def to_leader(self, local_time):
+        """Convert a local clock time to the leader clock"""
+        offset = self.offset_at(local_time)
+        return None if offset is None else local_time + offset
+
+    def get_status(self):
+        with self.lock:
+            return {
+                'synced': self.offset is not None,
+                'offset_us': round(self.offset * 1e6) if self.offset is not None else None,
+                'drift_ppm': round(self.drift * 1e6, 2),
+                'rtt_us': round(self.rtt * 1e6) if self.rtt is not None else None,
+                'samples': len(self.samples)
+            }
+
+class ClusterNode:
+    def __init__(self, role=CLUSTER_ROLE, node_id=CLUSTER_NODE_ID, followers=CLUSTER_FOLLOWERS,
+                 leader_host=CLUSTER_LEADER_HOST, sync_port=CLUSTER_SYNC_PORT, event_callback=None):
+        self.role = role
+        self.node_id = node_id
+        self.followers = list(followers)
+        self.leader_host = leader_host
+        self.sync_port = sync_port
+        self.event_callback = event_callback
+        self.clock = ClockEstimator()
+        self.trigger_ids = itertools.count(1)
+        self.timers = []
+        self.timer_lock = threading.Condition()
+        self.timer_sequence = itertools.count()
+        self.plays = deque(maxlen=CLUSTER_HISTORY)
+        # A forwarded trigger is useless after its play-at time, so no retries past it
+        self.forwarder = None
+        if role == ROLE_LEADER and self.followers:
+            self.forwarder = PeerForwarder(self.followers, path="/cluster/trigger", timeout=CLUSTER_PLAY_DELAY,
+                                           event_callback=event_callback)
+        self.running = False
+        self.sock = None
+
+    @property
+    def enabled(self):
+        return self.role in (ROLE_LEADER, ROLE_FOLLOWER)
+
+    def notify(self, event_type, **data):
+        """Send a cluster event to the event callback if one is set"""
+        if self.event_callback:
+            try:
+                self.event_callback(event_type, **data)
+            except Exception as e:
+                logger.error(f"Error sending cluster event: {e}")
+
+    def start(self):
+        """Start the sync socket and the playback timer"""
+        if not self.enabled:
+            return
+        self.running = True
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.role == ROLE_LEADER:
+            self.sock.bind(('0.0.0.0', self.sync_port))
+            threading.Thread(target=self.responder_loop, daemon=True).start()
+        else:
+            self.sock.settimeout(CLUSTER_PING_TIMEOUT)
+            threading.Thread(target=self.ping_loop, daemon=True).start()
+        threading.Thread(target=self.timer_loop, daemon=True).start()
+        logger.info(f"Cluster node {self.node_id} started as {self.role}")
+
+    def stop(self):
+        self.running = False
+        if self.forwarder:
+            self.forwarder.stop()
+        if self.sock:
+            self.sock.close()
+
+    def responder_loop(self):
+        """Leader side: timestamp and echo sync pings"""
+        while self.running:
+            try:
+                data, address = self.sock.recvfrom(64)
+                received = time.monotonic()
+                sequence, sent = PING.unpack(data[:PING.size])
+                self.sock.sendto(PONG.pack(sequence, sent, received, time.monotonic()), address)
+            except OSError:
+                if self.running:
+                    logger.error("Cluster sync socket error")
+                    time.sleep(1)
+            except struct.error:
+                continue
+
+    def ping_loop(self):
+        """Follower side: exchange pings with the leader to track its clock"""
+        address = (self.leader_host, self.sync_port)
+        for sequence in itertools.count():
+            if not self.running:
+                break
+            try:
+                t0 = time.monotonic()
+                self.sock.sendto(PING.pack(sequence & 0xFFFFFFFF, t0), address)
+                while True:
+                    data = self.sock.recv(64)
+                    t3 = time.monotonic()
+                    reply_sequence, sent, t1, t2 = PONG.unpack(data[:PONG.size])
+                    if reply_sequence == sequence & 0xFFFFFFFF and sent == t0:
+                        break
+                was_synced = self.clock.offset is not None
+                self.clock.add_sample(t0, t1, t2, t3)
+                if not was_synced:
+                    logger.info(f"Cluster clock synced to leader {self.leader_host}: {self.clock.get_status()}")
+                    self.notify("cluster_synced", **self.clock.get_status())
+            except socket.timeout:
+                logger.debug("Cluster sync ping timed out")
+            except (OSError, struct.error) as e:
+                logger.debug(f"Cluster sync ping failed: {e}")
+            time.sleep(CLUSTER_PING_INTERVAL if self.clock.offset is not None else 0.1)
+
+    def broadcast(self, button_id, is_hold, transmitter_id, source):
+        """Leader side: forward a trigger to followers and return (trigger_id, local play time)"""
+        trigger_id = f"{self.node_id}-{next(self.trigger_ids)}"
+        play_at = time.monotonic() + CLUSTER_PLAY_DELAY
+        payload = {
+            'button_id': button_id,
+            'is_hold': is_hold,
+            'transmitter_id': transmitter_id,
+            'source': source,
+            'trigger_id': trigger_id,
+            'play_at': play_at
+        }
+        if self.forwarder:
+            self.forwarder.send(payload, deadline=play_at)
+        return trigger_id, play_at
+
+    def schedule(self, play_at, trigger_id, callback, *args):
+        """Run callback at a local monotonic time and record how late it started"""
+        with self.timer_lock:
+            heapq.heappush(self.timers, (play_at, next(self.timer_sequence), trigger_id, callback, args))
+            self.timer_lock.notify()
+
+    def timer_loop(self):
+        """Fire scheduled playbacks as close to their target time as possible"""
+        while self.running:
+            with self.timer_lock:
+                while not self.timers:
+                    self.timer_lock.wait()
+                play_at = self.timers[0][0]
+                if play_at - time.monotonic() > CLUSTER_SPIN_SECONDS:
+                    self.timer_lock.wait(play_at - time.monotonic() - CLUSTER_SPIN_SECONDS)
+                    continue
+                play_at, _, trigger_id, callback, args = heapq.heappop(self.timers)
+            wait_until(play_at)
+            started = time.monotonic()
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Error running scheduled playback: {e}")
+            self.record_play(trigger_id, play_at, started)
+
+    def record_play(self, trigger_id, play_at, started):
+        """Keep the start error of a scheduled playback for skew reporting"""
+        self.plays.append({
+            'trigger_id': trigger_id,
+            'error_us': round((started - play_at) * 1e6)
+        })
+
+    def collect_skew(self):
+        """Leader side: compare start errors across nodes for recent triggers
+
+        Each node's error is measured against the shared play-at time, so the
+        spread between nodes for one trigger is the inter-node skew (plus the
+        followers' clock estimate uncertainty, reported as their rtt).
+        """
+        errors = {}
+        for play in list(self.plays):
+            errors.setdefault(play['trigger_id'], {})[self.node_id] = play['error_us']
+        followers = {}
+        for follower in self.followers:
+            try:
+                status = requests.get(f"http://{follower}/cluster/status", timeout=1).json()
+                followers[follower] = status.get('clock')
+                for play in status.get('plays', []):
+                    errors.setdefault(play['trigger_id'], {})[status.get('node_id', follower)] = play['error_us']
+            except Exception as e:
+                followers[follower] = {'error': str(e)}
+
+        skews = sorted(max(nodes.values()) - min(nodes.values()) for nodes in errors.values() if len(nodes) > 1)
+        return {
+            'followers': followers,
+            'triggers': len(skews),
+            'skew_p50_us': skews[len(skews) // 2] if skews else None,
+            'skew_max_us': skews[-1] if skews else None
+        }
+
+    def get_status(self, include_skew=False):
+        status = {
+            'node_id': self.node_id,
+            'role': self.role,
+            'clock': self.clock.get_status() if self.role == ROLE_FOLLOWER else None,
+            'pending': len(self.timers),
+            'forwarding': self.forwarder.get_status() if self.forwarder else None,
+            'plays': list(self.plays)
+        }
+        if include_skew and self.role == ROLE_LEADER:
+            status['skew'] = self.collect_skew()
+        return status
+
+def main():
+    """Test clock estimation against a local leader"""
+    leader = ClusterNode(role=ROLE_LEADER, node_id="leader", followers=())
+    follower = ClusterNode(role=ROLE_FOLLOWER, node_id="follower", leader_host="127.0.0.1")
+    leader.start()
+    follower.start()
+    time.sleep(3)
+    print(json.dumps(follower.clock.get_status(), indent=2))
+    leader.stop()
+    follower.stop()
+
+if __name__ == "__main__":
+    main()
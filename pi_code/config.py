@@ -13,11 +13,13 @@ BUFFER_SIZE = 1024
 
 # Network settings
 PI_IP = "192.168.1.100"  # Change to your Pi's IP address
-PI_PORT = 8080
+PI_PORT = int(os.environ.get("WRB_PI_PORT", 8080))  # Override to run several servers on one host
+# Servers started with WRB_PI_PORT get their own journal and log file
+INSTANCE_SUFFIX = f"-{PI_PORT}" if "WRB_PI_PORT" in os.environ else ""
 
 # ESP-NOW Communication settings (XIAOs use MAC addresses, not IP)
 ESP_NOW_ENABLED = True  # Enable ESP-NOW communication
-TRANSMITTER_ID = 1      # Transmitter ID for audio mapping
+TRANSMITTER_ID = 1      # Default transmitter ID for triggers that do not carry one
 RECEIVER_ID = 1         # Receiver ID for logging
 
 # Audio file mappings
@@ -28,6 +30,39 @@ AUDIO_MAPPINGS = {
     "hold2": "hold2.wav"
 }
 
+# Trigger routing settings
+# Optional JSON mapping file, reloadable at runtime via POST /reload_mappings.
+# Format: {"routes": [{"transmitter": "*", "button": 1, "event": "press", "file": "button1.wav"}]}
+# "*" (or omitting a field) matches any transmitter or button. Without the file,
+# AUDIO_MAPPINGS above is used and applies to every transmitter.
+ROUTING_FILE = "audio_mappings.json"
+ROUTING_MAX_TRANSMITTERS = 16   # Transmitter ids precompiled into the lookup table
+ROUTING_MAX_BUTTONS = 8         # Button ids precompiled into the lookup table
+ROUTING_HOLD_FALLBACK = False   # Play the press sound when a hold has no mapping
+
+# Sample cache settings
+# Events whose sounds are decoded up front. Libraries too big to preload can set
+# this to ("press",) and let the prefetcher decode hold sounds on demand.
+PRELOAD_EVENTS = ("press", "hold")
+SAMPLE_CACHE_MAX_MB = 0         # Budget for prefetched samples, 0 = unlimited
+SAMPLE_DEDUP = True             # Files with identical content share one decoded sample
+
+# Predictive prefetch settings
+# On a press, decode the matching hold sound (and any route "prefetch" files)
+# during the HOLD_DELAY_MS window before the hold can arrive
+PREFETCH_ENABLED = True
+PREFETCH_QUEUE_SIZE = 16
+PREFETCH_TTL = 5.0              # Seconds a prefetch stays useful before counting as unused
+PREFETCH_NICE = 10              # Nice increment for the prefetch thread
+
+# Scene settings
+# Each scene is a directory scenes/<name>/ holding a mappings.json (same format
+# as ROUTING_FILE) and its audio files. Files not found there fall back to AUDIO_DIR.
+SCENES_DIR = "scenes"
+SCENE_MAPPING_FILE = "mappings.json"
+SCENE_MIN_FREE_MB = 32              # Unload idle prepared scenes below this much free memory
+SCENE_RETIRE_CHECK_INTERVAL = 0.5   # Seconds between checks for a retired scene's voices
+
 # Button hold settings
 HOLD_DETECTION_ENABLED = True
 HOLD_DELAY_MS = 500  # 500ms hold delay (matches XIAO transmitter)
@@ -42,7 +77,9 @@ USB_MOUNT_ENABLED = True
 USB_MOUNT_POINT = "/media/usb"  # Where USB drives will be mounted
 USB_AUDIO_DIR = "audio_files"   # Audio directory on USB drive
 USB_LED_PIN = 21                # GPIO pin for USB status LED
-USB_CHECK_INTERVAL = 5          # Check for USB every 5 seconds
+USB_CHECK_INTERVAL = 5          # Check for USB every 5 seconds when uevents are unavailable
+USB_UEVENTS = True              # Rescan on kernel block device events instead of polling lsblk
+USB_UEVENT_SETTLE = 1.0         # Seconds to let a burst of device events settle before rescanning
 USB_MOUNT_TIMEOUT = 10          # Timeout for mount operations in seconds
 
 # System Status LED settings
@@ -59,6 +96,198 @@ LED_PATTERNS = {
     "system_error": (5, 0.1),      # 5 blinks, 0.1s interval
 }
 
+# Event stream settings (Server-Sent Events on /events)
+EVENT_STREAM_BUFFER_SIZE = 256  # Max queued events per client before it is dropped
+EVENT_STREAM_KEEPALIVE = 15     # Seconds between keepalive comments on idle streams
+
+# Status snapshot settings
+# Events that change the /status document and trigger a snapshot rebuild
+STATUS_SNAPSHOT_EVENTS = {
+    "playback_started", "playback_finished", "volume_changed",
+    "usb_mounted", "usb_removed", "mappings_reloaded", "scene_switched",
+}
+
+# Audio engine settings
+# Run the pygame mixer in its own process, fed through a shared-memory command
+# ring, so HTTP, serial and USB work cannot cause late starts or underruns
+AUDIO_ENGINE_PROCESS = False
+AUDIO_ENGINE_RING_SLOTS = 64        # Messages each ring can hold
+AUDIO_ENGINE_SLOT_SIZE = 512        # Bytes per message (header + file path)
+AUDIO_ENGINE_SEND_TIMEOUT = 5.0     # Seconds a preload waits for room in a full ring
+AUDIO_ENGINE_SUPERVISOR_INTERVAL = 1.0  # Seconds to back off after a broken state doorbell
+AUDIO_ENGINE_RESTART_DELAY = 1.0    # Seconds to wait before restarting a crashed engine
+AUDIO_ENGINE_RTT_WINDOW = 256       # Command round trips kept for latency stats
+
+# Audio backend settings
+# "pygame" plays through the SDL mixer; "numpy" uses the software mixer in
+# mixer.py, which sums voices itself and writes to MIXER_SINK
+AUDIO_BACKEND = "pygame"
+MIXER_SINK = "alsa"                 # "alsa" (aplay), "wav" (offline render) or "null"
+MIXER_ALSA_DEVICE = "plughw:0,0"
+MIXER_WAV_FILE = "mixer_output.wav"
+MIXER_BLOCK_SIZE = BUFFER_SIZE      # Frames mixed per block
+MIXER_MAX_VOICES = 8                # Oldest voice is dropped beyond this
+MIXER_FADE_MS = 8                   # Fade-out of an interrupted voice; 0 cuts it dead
+MIXER_IDLE_SUSPEND = 2.0            # Seconds of silence before the mixer stops rendering; None never
+
+# Sample store settings (numpy backend)
+# "adpcm" keeps samples in RAM as IMA-ADPCM, about 2.6 MB per stereo minute
+# instead of 21 MB decoded. Only the first SAMPLE_STORE_HEAD_MS is kept decoded
+# so a trigger starts without decoding; the rest is decoded a chunk at a time
+# into pooled buffers while it plays. A longer head costs memory, a shorter one
+# moves a chunk decode into the first mixer block.
+SAMPLE_STORE = "pcm"                # "pcm" or "adpcm"
+SAMPLE_STORE_HEAD_MS = 100
+SAMPLE_STORE_CHUNK_FRAMES = 4096    # Rounded up to whole MIXER_BLOCK_SIZE blocks
+SAMPLE_STORE_POOL_BUFFERS = 16      # Decoded chunk buffers kept for reuse
+
+# Streaming settings (numpy backend)
+# WAV files longer than STREAM_MIN_SECONDS are not decoded into RAM: a prefetch
+# thread reads them in chunks into two buffers per playing voice. Any number of
+# streams can play next to preloaded samples, up to MIXER_MAX_VOICES.
+STREAM_MIN_SECONDS = 10.0
+STREAM_CHUNK_FRAMES = 16384         # Frames per read (~370 ms), rounded up to whole blocks
+
+# Buffer calibration settings
+# python3 buffer_calibration.py plays through the software mixer at each size in
+# CALIBRATION_SIZES, largest first, under synthetic CPU load, and stores the
+# smallest size without underruns for this Pi model and output device. When a
+# stored size exists it replaces MIXER_BLOCK_SIZE at startup; the pygame
+# backend's BUFFER_SIZE is not measured and is always used as set.
+CALIBRATION_FILE = "buffer_calibration.json"
+CALIBRATION_SIZES = (2048, 1024, 512, 256, 128, 64)
+CALIBRATION_SECONDS = 10.0          # Playback time per size
+CALIBRATION_VOICES = 4              # Voices mixed during the test
+CALIBRATION_LOAD_THREADS = 2        # Busy threads competing with the mixer
+CALIBRATION_APPLY = True            # Use the stored size at startup
+
+# Trigger scheduler settings
+# Lower numbers win. Routes may set "priority" to a class name to override the
+# default class of their event type.
+SCHEDULER_PRIORITIES = {
+    "emergency": 0,
+    "hold": 1,
+    "press": 2
+}
+SCHEDULER_QUEUE_SIZE = 32          # Accepted triggers waiting for dispatch
+SCHEDULER_SOURCE_RATE = 20.0       # Sustained triggers per second per source
+SCHEDULER_SOURCE_BURST = 20        # Burst allowance per source
+SCHEDULER_BUTTON_RATE = 5.0        # Sustained triggers per second per transmitter button
+SCHEDULER_BUTTON_BURST = 5         # Burst allowance per transmitter button
+SCHEDULER_FLOOD_WINDOW = 2.0       # Seconds of history used for flood detection
+SCHEDULER_FLOOD_THRESHOLD = 30     # Triggers within the window that mark a transmitter as flooding
+SCHEDULER_FLOOD_PENALTY = 10.0     # Seconds a flooding transmitter stays throttled
+SCHEDULER_MAX_TRACKED = 1024       # Sources, buttons or transmitters tracked before idle ones are pruned
+# Opt-in: when True, a trigger of a lower class than the sound still playing
+# (e.g. a press during a long hold bed) gets HTTP 409 instead of replacing it
+SCHEDULER_PROTECT_PRIORITY = False
+
+# Trigger intake settings
+# Controllers may send an "event_id" with each trigger; retries carrying an ID
+# seen within DEDUP_TTL seconds get the original reply instead of replaying.
+# With fast ack, /trigger_audio replies 202 once the trigger is queued.
+TRIGGER_FAST_ACK = False
+TRIGGER_INTAKE_QUEUE_SIZE = 64
+DEDUP_MAX_IDS = 1024
+DEDUP_TTL = 30.0
+
+# Trigger journal settings
+# Every trigger outcome is appended to fixed-size binary records for usage
+# statistics via GET /journal/stats
+JOURNAL_ENABLED = True
+JOURNAL_DIR = f"journal{INSTANCE_SUFFIX}"
+JOURNAL_SEGMENT_RECORDS = 100000   # Records per segment file (24 bytes each)
+JOURNAL_SEGMENT_SECONDS = 86400    # Start a new segment at least daily
+JOURNAL_RETENTION_DAYS = 365       # Delete segments older than this
+JOURNAL_BUFFER_BYTES = 8192        # Write buffer, flushed every JOURNAL_FLUSH_INTERVAL
+JOURNAL_FLUSH_INTERVAL = 5.0
+
+# Serial receiver settings
+SERIAL_PORT = os.environ.get("WRB_SERIAL_PORT", "/dev/ttyUSB0")  # Tried first, then the usual ports
+# Record the raw receiver byte stream for replay with serial_capture.py
+SERIAL_CAPTURE_FILE = os.environ.get("WRB_SERIAL_CAPTURE") or None
+SERIAL_READ_TIMEOUT = None      # Seconds a threaded readline waits; None blocks until a line arrives
+TELEMETRY_RATE_WINDOW = 60.0    # Seconds of receiver RX lines used for per-transmitter event rates
+
+# Peer forwarding settings
+# Triggers read from the serial receiver are also sent to these peer audio
+# servers ("host:port" or base URL), each over its own keep-alive connection
+FORWARD_PEERS = [p for p in os.environ.get("WRB_FORWARD_PEERS", "").split(",") if p]
+FORWARD_TIMEOUT = 1.0           # Seconds per request to a peer
+FORWARD_RETRIES = 2             # Retries after a failed request
+FORWARD_BACKOFF = 0.05          # First retry delay in seconds, doubled per retry
+FORWARD_BACKOFF_MAX = 0.5
+FORWARD_MAX_AGE = 1.0           # Drop triggers that could not be delivered within this many seconds
+FORWARD_QUEUE_SIZE = 32         # Triggers waiting per peer before new ones are dropped
+FORWARD_BREAKER_THRESHOLD = 3   # Consecutive failures before a peer is skipped
+FORWARD_BREAKER_COOLDOWN = 10.0 # Seconds before a skipped peer is tried again
+FORWARD_LATENCY_WINDOW = 256    # Requests kept per peer for latency stats
+
+# Cluster settings
+# A leader forwards every trigger to its followers with a play-at time a little
+# in the future; followers track the leader's clock over UDP pings so all nodes
+# start together. The WRB_* environment variables allow several nodes on one host.
+CLUSTER_ROLE = os.environ.get("WRB_CLUSTER_ROLE", "standalone")  # "standalone", "leader" or "follower"
+CLUSTER_NODE_ID = os.environ.get("WRB_CLUSTER_NODE_ID", f"node-{PI_PORT}")
+CLUSTER_FOLLOWERS = [f for f in os.environ.get("WRB_CLUSTER_FOLLOWERS", "").split(",") if f]  # Leader only, "host:port"
+CLUSTER_LEADER_HOST = os.environ.get("WRB_CLUSTER_LEADER", PI_IP)  # Follower only
+CLUSTER_SYNC_PORT = int(os.environ.get("WRB_CLUSTER_SYNC_PORT", 8090))  # UDP clock sync port on the leader
+CLUSTER_PLAY_DELAY = 0.08       # Seconds between a trigger and its synchronized start
+CLUSTER_MAX_LATE = 0.02         # Followers drop triggers that arrive this far past their play-at time
+CLUSTER_PING_INTERVAL = 1.0     # Seconds between clock sync pings once synced
+CLUSTER_PING_TIMEOUT = 0.5
+CLUSTER_PING_WINDOW = 32        # Ping samples used for the offset and drift fit
+CLUSTER_SPIN_SECONDS = 0.002    # Busy-wait this close to a play-at time instead of sleeping
+CLUSTER_HISTORY = 64            # Recent scheduled plays kept for skew reporting
+
+# Wakeup settings
+# Subsystems block on device, playback and timer events rather than polling,
+# and count each wakeup; GET /wakeups reports wakeups per second per subsystem
+WAKEUP_WINDOW = 60.0                # Seconds the reported rates are averaged over
+TIMER_SLACK = 0.005                 # Timers due within this many seconds fire together
+PLAYBACK_END_TIMEOUT = 30.0         # Recheck a playing sound this often in case an end event is lost
+AUDIO_END_RECHECK = 0.1             # Seconds between end checks of pygame music, which has no known length
+
+# Resource monitor settings
+# A background thread samples CPU, RSS, threads, voices, queue depths and
+# trigger/serial rates every MONITOR_INTERVAL seconds into a ring of
+# MONITOR_HISTORY samples (6 hours by default), served by /metrics/history
+# and, for Prometheus, /metrics
+MONITOR_ENABLED = True
+MONITOR_INTERVAL = 5.0
+MONITOR_HISTORY = 4320
+
+# Tracing settings
+# Sampled triggers record timed spans (serial read, HTTP hop, routing, sample
+# lookup, mixer start, LEDs) into a ring of TRACE_BUFFER_EVENTS spans, exported
+# as Chrome trace JSON from /debug/trace. Adjustable at runtime.
+TRACE_ENABLED = False
+TRACE_SAMPLE_RATE = 0.1             # Fraction of triggers traced
+TRACE_MAX_PER_SECOND = 20           # Cap on new traces per second under load
+TRACE_BUFFER_EVENTS = 4096
+
+# Profiler settings
+# /debug/profile endpoints sample every thread's stack on demand. They are
+# disabled unless WRB_DEBUG_TOKEN is set; requests must send it as
+# "Authorization: Bearer <token>" or an X-Debug-Token header.
+DEBUG_TOKEN = os.environ.get("WRB_DEBUG_TOKEN") or None
+PROFILER_INTERVAL = 0.005           # Seconds between stack samples
+PROFILER_MAX_SECONDS = 300          # A forgotten session stops itself after this
+
+# Runtime settings
+RUNTIME_MODE = "threaded"  # "threaded" (thread per subsystem) or "asyncio" (single event loop)
+ASYNC_EXECUTOR_WORKERS = 2  # Threads for blocking work (mounts, sample decoding) in asyncio mode
+
 # Logging
 LOG_LEVEL = "INFO"
-LOG_FILE = "audio_server.log"
+LOG_FILE = f"audio_server{INSTANCE_SUFFIX}.log"
+# Log records are written by a background thread in batches so hot paths never
+# wait on the SD card. Rotated files are gzipped when LOG_COMPRESS is set.
+LOG_MAX_BYTES = 1024 * 1024     # Rotate the log file at this size, 0 = never
+LOG_BACKUP_COUNT = 5            # Rotated files kept
+LOG_COMPRESS = True
+LOG_BATCH_SIZE = 128            # Records per write
+LOG_FLUSH_INTERVAL = 1.0        # Seconds a partial batch waits before being written
+LOG_QUEUE_SIZE = 4096           # Records waiting for the writer before new ones are dropped
+LOG_RING_SIZE = 500             # Recent records kept in memory for GET /logs
+LOG_CONSOLE = True              # Also write records to stderr
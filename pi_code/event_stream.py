@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Event Stream for Raspberry Pi Audio Server
+Pushes playback and device state changes to dashboards via Server-Sent Events
+"""
+
+import json
+import queue
+import threading
+import time
+import logging
+from config import *
+
+logger = logging.getLogger(__name__)
+
+class EventSubscriber:
+    """A single connected client with its own bounded event buffer"""
+
+    def __init__(self, client_id, buffer_size):
+        self.client_id = client_id
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.dropped = False
+        self.connected_at = time.monotonic()
+
+class EventBroadcaster:
+    def __init__(self, buffer_size=EVENT_STREAM_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self.subscribers = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.next_client_id = 1
+        self.sequence = 0
+        self.events_published = 0
+        self.clients_dropped = 0
+
+    def subscribe(self):
+        """Register a new stream client and return its subscriber"""
+        with self.lock:
+            subscriber = EventSubscriber(self.next_client_id, self.buffer_size)
+            self.next_client_id += 1
+            self.subscribers[subscriber.client_id] = subscriber
+        logger.info(f"Event stream client {subscriber.client_id} connected")
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """Remove a stream client"""
+        with self.lock:
+            self.subscribers.pop(subscriber.client_id, None)
+        logger.info(f"Event stream client {subscriber.client_id} disconnected")
+
+    def add_listener(self, callback):
+        """Register an in-process callback invoked synchronously for every event
+
+        Callbacks run on the publisher's thread, so they must not block; hand
+        slow work off to another thread.
+        """
+        self.listeners.append(callback)
+
+    def publish(self, name, **data):
+        """Publish an event to every listener and stream client
+
+        Never blocks: a client whose buffer is full is dropped instead of
+        holding up the publisher.
+        """
+        with self.lock:
+            self.sequence += 1
+            event = {
+                'id': self.sequence,
+                'type': name,
+                'timestamp': time.monotonic(),
+                'data': data
+            }
+            self.events_published += 1
+            slow_clients = []
+            for subscriber in self.subscribers.values():
+                try:
+                    subscriber.queue.put_nowait(event)
+                except queue.Full:
+                    slow_clients.append(subscriber)
+            for subscriber in slow_clients:
+                subscriber.dropped = True
+                del self.subscribers[subscriber.client_id]
+                self.clients_dropped += 1
+
+        for subscriber in slow_clients:
+            logger.warning(f"Dropped slow event stream client {subscriber.client_id}")
+
+        for callback in self.listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"Event listener error: {e}")
+
+        return event
+
+    def stream(self, subscriber, keepalive=EVENT_STREAM_KEEPALIVE):
+        """Yield Server-Sent Events for a subscriber until it disconnects or is dropped"""
+        try:
+            yield "retry: 2000\n\n"
+            while not subscriber.dropped:
+                try:
+                    event = subscriber.queue.get(timeout=keepalive)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            self.unsubscribe(subscriber)
+
+    def get_status(self):
+        """Get event stream statistics"""
+        with self.lock:
+            return {
+                'clients': len(self.subscribers),
+                'events_published': self.events_published,
+                'clients_dropped': self.clients_dropped,
+                'buffer_size': self.buffer_size
+            }
+
+def format_sse(event):
+    """Format an event dict as a Server-Sent Events message"""
+    payload = json.dumps(event, separators=(',', ':'))
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+def main():
+    """Test the event broadcaster"""
+    logging.basicConfig(level=logging.INFO)
+
+    broadcaster = EventBroadcaster(buffer_size=4)
+    subscriber = broadcaster.subscribe()
+
+    broadcaster.publish("trigger_accepted", button_id=1, event_type="press")
+    broadcaster.publish("playback_started", audio_file="button1.wav")
+    broadcaster.publish("playback_finished", audio_file="button1.wav")
+
+    while not subscriber.queue.empty():
+        print(format_sse(subscriber.queue.get_nowait()), end="")
+
+    # Overflow the buffer to show slow-consumer dropping
+    for i in range(10):
+        broadcaster.publish("volume_changed", volume=i / 10)
+    print(f"Broadcaster status: {broadcaster.get_status()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Trigger Journal for Raspberry Pi Audio Server
+Append-only binary log of every trigger, with segment rotation, retention and
+aggregate queries over memory-mapped segments
+"""
+
+import os
+import time
+import json
+import mmap
+import struct
+import threading
+import logging
+import numpy as np
+from config import *
+from wakeups import wakeups
+
+logger = logging.getLogger(__name__)
+
+# timestamp, file id, transmitter, button, source id, event, HTTP status, latency ms
+RECORD = struct.Struct('<dIHHBBHf')
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('file', '<u4'),
+    ('transmitter', '<u2'),
+    ('button', '<u2'),
+    ('source', 'u1'),
+    ('event', 'u1'),
+    ('status', '<u2'),
+    ('latency_ms', '<f4')
+])
+EVENT_CODES = {"press": 0, "hold": 1}
+EVENT_NAMES = {code: name for name, code in EVENT_CODES.items()}
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".bin"
+SOURCES_FILE = "sources.json"
+FILES_FILE = "files.json"
+OTHER_NAME = "(other)"
+
+def segment_start(path):
+    """Timestamp of a segment's first record, from its file name"""
+    return int(os.path.basename(path)[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) / 1000
+
+def parse_id(value):
+    """Transmitter and button ids are stored as u16; anything else becomes 0"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return 0
+    return value if 0 <= value <= 0xFFFF else 0
+
+class StringTable:
+    """Interns source names and file names as small integers, persisted as JSON
+
+    With a capacity, names past it share the id `capacity`, reported as
+    OTHER_NAME. New names are saved by save() on the journal's flush
+    interval, not on the trigger path.
+    """
+
+    def __init__(self, path, capacity=None):
+        self.path = path
+        self.capacity = capacity
+        self.names = [""]
+        try:
+            with open(path) as f:
+                self.names = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Failed to read journal string table: {e}")
+        if capacity:
+            self.names = self.names[:capacity]
+        self.ids = {name: index for index, name in enumerate(self.names)}
+        self.dirty = False
+        self.overflows = 0
+        self.save_lock = threading.Lock()
+
+    def intern(self, name):
+        """Return the id of a name, adding it if it is new and there is room"""
+        name = name or ""
+        index = self.ids.get(name)
+        if index is None:
+            if self.capacity and len(self.names) >= self.capacity:
+                self.overflows += 1
+                return self.capacity
+            index = len(self.names)
+            self.names.append(name)
+            self.ids[name] = index
+            self.dirty = True
+        return index
+
+    def snapshot(self):
+        """Names to save if any were added since the last snapshot
+
+        Must be called with the journal lock held.
+        """
+        if not self.dirty:
+            return None
+        self.dirty = False
+        return list(self.names)
+
+    def save(self, names):
+        with self.save_lock:
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(names, f)
+            os.replace(temp_path, self.path)
+
+    def name(self, index):
+        if self.capacity and index == self.capacity:
+            return OTHER_NAME
+        return self.names[index] if index < len(self.names) else f"#{index}"
+
+class TriggerJournal:
+    def __init__(self, directory=JOURNAL_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.stream = None
+        self.segment_path = None
+        self.segment_records = 0
+        self.segment_started = 0.0
+        self.records_written = 0
+        self.write_errors = 0
+        self.unflushed = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        # Source ids are stored as u8; id 0xFF collects names past the first 255
+        self.sources = StringTable(os.path.join(directory, SOURCES_FILE), capacity=0xFF)
+        self.files = StringTable(os.path.join(directory, FILES_FILE))
+        self.flush_thread = threading.Thread(target=self.flush_loop, daemon=True)
+        self.flush_thread.start()
+
+    def segments(self):
+        """Segment paths, oldest first"""
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def open_segment(self, now):
+        """Start a new segment named after its first timestamp
+
+        Must be called with the lock held.
+        """
+        if self.stream:
+            self.stream.close()
+        self.segment_path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{int(now * 1000):015d}{SEGMENT_SUFFIX}")
+        self.stream = open(self.segment_path, 'ab', buffering=JOURNAL_BUFFER_BYTES)
+        self.segment_records = 0
+        self.segment_started = now
+        self.apply_retention(now)
+
+    def apply_retention(self, now):
+        """Delete segments whose newest possible record is past the retention window"""
+        segments = self.segments()
+        # A segment ends where the next one starts
+        for path, next_path in zip(segments, segments[1:]):
+            if path == self.segment_path:
+                continue
+            if now - segment_start(next_path) > JOURNAL_RETENTION_DAYS * 86400:
+                os.remove(path)
+                logger.info(f"Removed expired journal segment {path}")
+
+    def record(self, source, transmitter, button, event, audio_file, status_code, latency_ms):
+        """Append one trigger outcome; cheap enough for the trigger path"""
+        now = time.time()
+        try:
+            with self.lock:
+                if (self.stream is None or self.segment_records >= JOURNAL_SEGMENT_RECORDS or
+                        now - self.segment_started >= JOURNAL_SEGMENT_SECONDS):
+                    self.open_segment(now)
+                self.stream.write(RECORD.pack(
+                    now,
+                    self.files.intern(audio_file),
+                    parse_id(transmitter),
+                    parse_id(button),
+                    self.sources.intern(source),
+                    EVENT_CODES.get(event, 0),
+                    status_code,
+                    latency_ms
+                ))
+                self.segment_records += 1
+                self.records_written += 1
+            self.unflushed.set()
+        except Exception as e:
+            self.write_errors += 1
+            logger.error(f"Failed to write trigger journal: {e}")
+
+    def flush(self):
+        """Write buffered records and any new string table names"""
+        with self.lock:
+            if self.stream:
+                self.stream.flush()
+            pending = [(table, table.snapshot()) for table in (self.sources, self.files)]
+        for table, names in pending:
+            if names is not None:
+                try:
+                    table.save(names)
+                except Exception as e:
+                    table.dirty = True
+                    logger.error(f"Failed to save journal string table {table.path}: {e}")
+
+    def flush_loop(self):
+        """Flush buffered records periodically so queries and crashes lose little
+
+        Sleeps without a timeout while no records are waiting.
+        """
+        while True:
+            self.unflushed.wait()
+            time.sleep(JOURNAL_FLUSH_INTERVAL)
+            self.unflushed.clear()
+            wakeups.record("journal")
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush trigger journal: {e}")
+
+    def load_segment(self, path):
+        """Map a segment and view it as a record array"""
+        size = os.path.getsize(path)
+        size -= size % RECORD.size  # Ignore a torn final record
+        if size == 0:
+            return None
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        return np.frombuffer(mapped, dtype=RECORD_DTYPE)
+
+    def query(self, since=None, until=None, transmitter=None, button=None):
+        """Aggregate usage statistics over a time range"""
+        start = time.perf_counter()
+        self.flush()
+        since = since or 0.0
+        until = until or time.time()
+
+        segments = self.segments()
+        selected = []
+        for index, path in enumerate(segments):
+            if segment_start(path) > until:
+                break
+            if index + 1 < len(segments) and segment_start(segments[index + 1]) < since:
+                continue
+            records = self.load_segment(path)
+            if records is None:
+                continue
+            if (transmitter is None and button is None and
+                    records[0]['timestamp'] >= since and records[-1]['timestamp'] <= until):
+                # Whole segment in range: use the mapping without a filtered copy
+                selected.append(records)
+                continue
+            mask = (records['timestamp'] >= since) & (records['timestamp'] <= until)
+            if transmitter is not None:
+                mask &= records['transmitter'] == parse_id(transmitter)
+            if button is not None:
+                mask &= records['button'] == parse_id(button)
+            selected.append(records[mask])
+
+        records = np.concatenate(selected) if selected else np.zeros(0, dtype=RECORD_DTYPE)
+        result = self.aggregate(records)
+        result['segments_scanned'] = len(selected)
+        result['query_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        return result
+
+    def aggregate(self, records):
+        """Summarize a record array into per-button, per-source and hourly counts"""
+        played = records[records['status'] == 200]
+        by_button = {}
+        # Pack (transmitter, button, event) into one integer so a flat unique() does the grouping
+        packed = (played['transmitter'].astype(np.int64) << 24) | (played['button'].astype(np.int64) << 8) | played['event']
+        keys, counts = np.unique(packed, return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            transmitter, button, event = key >> 24, (key >> 8) & 0xFFFF, key & 0xFF
+            entry = by_button.setdefault(f"tx{transmitter}/btn{button}", {'press': 0, 'hold': 0})
+            entry[EVENT_NAMES.get(event, str(event))] = count
+        for entry in by_button.values():
+            entry['hold_ratio'] = round(entry['hold'] / (entry['press'] + entry['hold']), 3)
+
+        def count_by(values, name_of=str):
+            # Ids, statuses and hours span small ranges, where bincount beats sorting
+            if not len(values):
+                return {}
+            values = values.astype(np.int64)
+            low = int(values.min())
+            counts = np.bincount(values - low)
+            return {name_of(int(key) + low): int(counts[key]) for key in np.flatnonzero(counts)}
+
+        hours = (played['timestamp'] // 3600)
+        per_hour = count_by(hours, lambda hour: time.strftime('%Y-%m-%dT%H:00', time.localtime(hour * 3600)))
+        latency = records['latency_ms']
+        return {
+            'total': int(len(records)),
+            'played': int(len(played)),
+            'by_status': count_by(records['status']),
+            'by_button': by_button,
+            'by_source': count_by(records['source'], self.sources.name),
+            'by_file': count_by(played['file'], self.files.name),
+            'per_hour': per_hour,
+            'presses_per_hour': round(len(played) / len(per_hour), 2) if per_hour else 0,
+            'latency_ms': {
+                'mean': round(float(latency.mean()), 3),
+                'p99': round(float(np.percentile(latency, 99)), 3),
+                'max': round(float(latency.max()), 3)
+            } if len(latency) else None
+        }
+
+    def get_status(self):
+        return {
+            'records_written': self.records_written,
+            'write_errors': self.write_errors,
+            'sources': len(self.sources.names),
+            'sources_overflowed': self.sources.overflows,
+            'segments': len(self.segments()),
+            'current_segment': os.path.basename(self.segment_path) if self.segment_path else None
+        }
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.stream:
+                self.stream.close()
+                self.stream = None
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Logging Pipeline for Raspberry Pi Audio Server
+Hands log records to a writer thread that batches file writes, rotates and
+compresses old logs, and keeps recent records in memory for /logs
+"""
+
+import os
+import sys
+import gzip
+import time
+import queue
+import shutil
+import atexit
+import threading
+import logging
+import logging.handlers
+from collections import deque
+from config import *
+from wakeups import wakeups
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class LogPipeline:
+    def __init__(self, log_file=LOG_FILE, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+                 compress=LOG_COMPRESS, console=LOG_CONSOLE):
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self.console = console
+        self.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        self.handler = DroppingQueueHandler(self.queue)
+        # The handler only merges args and tracebacks into the message; the writer adds the rest
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        self.formatter = logging.Formatter(LOG_FORMAT)
+        self.records = deque(maxlen=LOG_RING_SIZE)
+        self.records_lock = threading.Lock()
+        self.stream = None
+        self.file_bytes = 0
+        self.written = 0
+        self.batches = 0
+        self.rotations = 0
+        self.write_errors = 0
+        self.running = False
+        self.writer_thread = None
+
+    def start(self):
+        """Open the log file and start the writer thread"""
+        if self.running:
+            return
+        self.open_file()
+        self.running = True
+        self.writer_thread = threading.Thread(target=self.writer_loop, name="log-writer", daemon=True)
+        self.writer_thread.start()
+        atexit.register(self.stop)
+
+    def open_file(self):
+        self.stream = open(self.log_file, 'a', encoding='utf-8')
+        self.file_bytes = self.stream.tell()
+
+    def writer_loop(self):
+        """Collect records into batches and write each batch at once"""
+        while self.running or not self.queue.empty():
+            # stop() queues None, so an idle writer can sleep without a timeout
+            batch = [self.queue.get()]
+            wakeups.record("log_writer")
+            # Wait briefly for more records so bursts turn into one write
+            deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+            while len(batch) < LOG_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            stop = None in batch
+            self.write_batch([record for record in batch if record is not None])
+            if stop:
+                break
+
+    def write_batch(self, batch):
+        """Format, remember and write one batch of records"""
+        lines = []
+        with self.records_lock:
+            for record in batch:
+                line = self.formatter.format(record)
+                lines.append(line)
+                self.records.append({
+                    'time': record.created,
+                    'logger': record.name,
+                    'level': record.levelname,
+                    'message': record.getMessage()
+                })
+        if not lines:
+            return
+        text = '\n'.join(lines) + '\n'
+        try:
+            self.stream.write(text)
+            self.stream.flush()
+            self.file_bytes += len(text.encode('utf-8'))
+            self.written += len(lines)
+            self.batches += 1
+            if self.max_bytes and self.file_bytes >= self.max_bytes:
+                self.rotate()
+        except Exception as e:
+            self.write_errors += 1
+            sys.stderr.write(f"Log write failed: {e}\n")
+        if self.console:
+            sys.stderr.write(text)
+            sys.stderr.flush()
+
+    def rotate(self):
+        """Shift log.N(.gz) files up and start a new log file"""
+        self.stream.close()
+        suffix = '.gz' if self.compress else ''
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.log_file}.{index}{suffix}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.log_file}.{index + 1}{suffix}")
+        if self.backup_count > 0:
+            if self.compress:
+                with open(self.log_file, 'rb') as source, gzip.open(f"{self.log_file}.1.gz", 'wb') as target:
+                    shutil.copyfileobj(source, target)
+                os.remove(self.log_file)
+            else:
+                os.replace(self.log_file, f"{self.log_file}.1")
+        else:
+            os.remove(self.log_file)
+        self.rotations += 1
+        self.open_file()
+
+    def stop(self):
+        """Flush queued records and close the log file"""
+        if not self.running:
+            return
+        self.running = False
+        try:
+            self.queue.put(None, timeout=1)
+        except queue.Full:
+            pass
+        self.writer_thread.join(timeout=5)
+        if self.stream:
+            self.stream.close()
+
+    def get_records(self, limit=100, level=None, name=None):
+        """Most recent records, optionally filtered by minimum level and logger name"""
+        minimum = logging.getLevelName(level.upper()) if level else 0
+        if not isinstance(minimum, int):
+            minimum = 0
+        with self.records_lock:
+            records = list(self.records)
+        records = [record for record in records
+                   if logging.getLevelName(record['level']) >= minimum
+                   and (not name or record['logger'] == name)]
+        # A limit below 1 would slice from the front, or return everything for 0
+        return records[-max(1, limit):]
+
+    def get_status(self):
+        return {
+            'queued': self.queue.qsize(),
+            'dropped': self.handler.dropped,
+            'written': self.written,
+            'batches': self.batches,
+            'rotations': self.rotations,
+            'write_errors': self.write_errors,
+            'file_bytes': self.file_bytes
+        }
+
+def setup_logging(log_file=LOG_FILE, level=LOG_LEVEL):
+    """Route the root logger through a started LogPipeline and return it"""
+    pipeline = LogPipeline(log_file)
+    pipeline.start()
+    logging.basicConfig(level=getattr(logging, level), handlers=[pipeline.handler])
+    return pipeline
@@ -0,0 +1,606 @@
+#!/usr/bin/env python3
+"""
+Software Mixer for Raspberry Pi Audio Server
+Sums active voices block by block with NumPy and writes the result to a
+pluggable sink (ALSA via aplay, a WAV file, or nowhere)
+"""
+
+import os
+import time
+import wave
+import argparse
+import threading
+import fcntl
+import subprocess
+import logging
+import numpy as np
+from config import *
+from streaming import Streamer
+from tracing import tracer
+from wakeups import wakeups
+from buffer_calibration import calibrated_buffer_size, load_calibrations, device_key
+
+logger = logging.getLogger(__name__)
+
+# ---------- Decoding ----------
+
+def pcm_to_float(frames, sample_width, channels):
+    """Convert interleaved PCM bytes to a float32 (frames, channels) array in [-1, 1]"""
+    if sample_width == 1:
+        data = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 2:
+        data = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 32768
+    elif sample_width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+        ints = (raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8) |
+                (raw[:, 2].astype(np.int32) << 16))
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        data = ints.astype(np.float32) / 8388608
+    elif sample_width == 4:
+        data = np.frombuffer(frames, dtype='<i4').astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"Unsupported sample width: {sample_width}")
+    return data.reshape(-1, channels)
+
+def conform(data, rate, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    """Resample and remix a float array to the mixer's rate and channel count"""
+    if data.shape[1] != channels:
+        if data.shape[1] == 1:
+            data = np.repeat(data, channels, axis=1)
+        else:
+            data = data.mean(axis=1, keepdims=True)
+            if channels > 1:
+                data = np.repeat(data, channels, axis=1)
+    if rate != sample_rate and len(data):
+        # Linear interpolation is enough for trigger sounds and avoids a SciPy dependency
+        frames = int(round(len(data) * sample_rate / rate))
+        source = np.arange(len(data))
+        target = np.linspace(0, len(data) - 1, frames)
+        data = np.stack([np.interp(target, source, data[:, channel]) for channel in range(channels)], axis=1)
+    return np.ascontiguousarray(data, dtype=np.float32)
+
+def decode_file(path, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    """Decode an audio file to a float32 (frames, channels) array
+
+    WAV is decoded directly; other formats go through pygame, which is
+    initialized on the dummy driver if nothing else has opened the mixer.
+    """
+    if path.lower().endswith('.wav'):
+        with wave.open(path, 'rb') as f:
+            data = pcm_to_float(f.readframes(f.getnframes()), f.getsampwidth(), f.getnchannels())
+            return conform(data, f.getframerate(), sample_rate, channels)
+
+    import pygame
+    if not pygame.mixer.get_init():
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+        pygame.mixer.init(frequency=sample_rate, size=-16, channels=channels)
+    frequency, _, mixer_channels = pygame.mixer.get_init()
+    array = pygame.sndarray.array(pygame.mixer.Sound(path))
+    if array.ndim == 1:
+        array = array.reshape(-1, 1)
+    data = array.astype(np.float32) / 32768
+    return conform(data, frequency, sample_rate, channels)
+
+class MixerSample:
+    """A decoded sample ready for mixing"""
+
+    def __init__(self, path, data, sample_rate=SAMPLE_RATE):
+        self.path = path
+        self.data = data
+        self.sample_rate = sample_rate
+        self.frames = len(data)
+        self.size_bytes = data.nbytes
+
+    def get_length(self):
+        return self.frames / self.sample_rate
+
+    def make_voice(self, gain=1.0):
+        return Voice(self, gain)
+
+# ---------- Sinks ----------
+
+class NullSink:
+    """Discards audio; with realtime=True it paces writes like a sound card
+
+    The emulated card buffers `periods` blocks, as AlsaSink asks aplay to.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, realtime=False, periods=4):
+        self.sample_rate = sample_rate
+        self.realtime = realtime
+        self.periods = periods
+        self.played_until = None
+
+    def write(self, block):
+        if not self.realtime:
+            return
+        now = time.monotonic()
+        duration = len(block) / self.sample_rate
+        if self.played_until is None or self.played_until < now:
+            self.played_until = now  # Ran dry; playback restarts from here
+        self.played_until += duration
+        # Block until the buffer has room for another period
+        delay = self.played_until - now - duration * self.periods
+        if delay > 0:
+            time.sleep(delay)
+
+    def resume(self):
+        pass
+
+    def close(self):
+        pass
+
+class WavSink:
+    """Renders the mix to a 16-bit WAV file"""
+
+    def __init__(self, path=MIXER_WAV_FILE, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        self.file = wave.open(path, 'wb')
+        self.file.setnchannels(channels)
+        self.file.setsampwidth(2)
+        self.file.setframerate(sample_rate)
+
+    def write(self, block):
+        self.file.writeframes(block.tobytes())
+
+    def resume(self):
+        pass
+
+    def close(self):
+        self.file.close()
+
+F_SETPIPE_SZ = 1031  # Linux fcntl, not exported by the fcntl module
+
+class AlsaSink:
+    """Plays the mix on an ALSA device through aplay
+
+    The pipe into aplay blocks once its buffer is full, which paces the mixer
+    to the sound card clock. The pipe is shrunk to one page so it does not add
+    its default 64 KB (~370 ms) of latency. aplay reports xruns on stderr,
+    which are counted; the one that follows an idle suspend of the mixer is
+    expected and counted separately.
+    """
+
+    def __init__(self, device=MIXER_ALSA_DEVICE, sample_rate=SAMPLE_RATE, channels=CHANNELS,
+                 block_size=MIXER_BLOCK_SIZE):
+        self.xruns = 0
+        self.idle_xruns = 0
+        self.resumed_at = None
+        self.process = subprocess.Popen(
+            ["aplay", "-D", device, "-t", "raw", "-f", "S16_LE", "-r", str(sample_rate),
+             "-c", str(channels), "--period-size", str(block_size), "--buffer-size", str(block_size * 4)],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        try:
+            fcntl.fcntl(self.process.stdin.fileno(), F_SETPIPE_SZ, 4096)
+        except OSError as e:
+            logger.debug(f"Could not shrink aplay pipe: {e}")
+        threading.Thread(target=self.stderr_loop, name="aplay-stderr", daemon=True).start()
+
+    def stderr_loop(self):
+        for line in self.process.stderr:
+            line = line.decode('utf-8', errors='ignore').strip()
+            if "underrun" in line:
+                if self.resumed_at is not None and time.monotonic() - self.resumed_at < 0.5:
+                    self.idle_xruns += 1
+                    self.resumed_at = None
+                else:
+                    self.xruns += 1
+            elif line and not line.startswith("Playing raw data"):
+                logger.warning(f"aplay: {line}")
+
+    def write(self, block):
+        self.process.stdin.write(block.tobytes())
+
+    def resume(self):
+        """Called when the mixer writes again after an idle suspend"""
+        self.resumed_at = time.monotonic()
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=2)
+        except Exception:
+            self.process.kill()
+
+def create_sink(kind=MIXER_SINK, block_size=MIXER_BLOCK_SIZE):
+    if kind == "alsa":
+        return AlsaSink(block_size=block_size)
+    if kind == "wav":
+        return WavSink()
+    if kind == "null":
+        return NullSink(realtime=True)
+    raise ValueError(f"Unknown mixer sink: {kind}")
+
+# ---------- Mixer ----------
+
+class Voice:
+    """One playing sample with its own gain and position"""
+
+    def __init__(self, sample, gain=1.0):
+        self.sample = sample
+        self.data = sample.data
+        self.frames = sample.frames
+        self.position = 0
+        self.gain = gain
+        self.fade_block = None  # Index into the fade envelopes once fading out
+        self.faded = False
+
+    @property
+    def done(self):
+        return self.faded or self.position >= self.frames
+
+    def read(self, frames):
+        """Next block of up to frames frames; shorter at the end of the sample"""
+        block = self.data[self.position:self.position + frames]
+        self.position += frames
+        return block
+
+    def close(self):
+        pass
+
+def fade_envelopes(fade_ms, block_size, sample_rate=SAMPLE_RATE):
+    """Precompute a raised-cosine fade-out as one (block_size, 1) gain vector per block
+
+    The ramp is padded with zeros to a whole number of blocks, so a fading voice
+    only needs one multiply per block.
+    """
+    frames = int(sample_rate * fade_ms / 1000)
+    if frames <= 0:
+        return []
+    blocks = -(-frames // block_size)
+    ramp = np.zeros(blocks * block_size, dtype=np.float32)
+    ramp[:frames] = 0.5 * (1 + np.cos(np.pi * np.arange(frames) / frames))
+    return [ramp[index * block_size:(index + 1) * block_size].reshape(-1, 1) for index in range(blocks)]
+
+class SoftwareMixer:
+    def __init__(self, sink, block_size=MIXER_BLOCK_SIZE, channels=CHANNELS, sample_rate=SAMPLE_RATE,
+                 max_voices=MIXER_MAX_VOICES, fade_ms=MIXER_FADE_MS, idle_suspend=MIXER_IDLE_SUSPEND):
+        self.sink = sink
+        self.block_size = block_size
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.max_voices = max_voices
+        self.voices = []
+        self.volume = DEFAULT_VOLUME
+        self.lock = threading.Lock()
+        self.buffer = np.zeros((block_size, channels), dtype=np.float32)
+        self.fade_ms = fade_ms
+        self.fades = fade_envelopes(fade_ms, block_size, sample_rate)
+        self.idle_suspend = idle_suspend
+        self.voice_added = threading.Event()
+        self.on_voice_end = None  # Called from the render thread when voices finish
+        self.running = False
+        self.thread = None
+        self.suspended = False
+        self.suspends = 0
+        self.blocks = 0
+        self.voice_blocks = 0
+        self.render_seconds = 0.0
+        self.max_render_seconds = 0.0
+        self.underruns = 0
+        self.underrun_seconds = 0.0
+        self.voices_stolen = 0
+        self.fade_blocks = 0
+        self.fade_seconds = 0.0
+        self.fades_started = 0
+
+    def add_voice(self, sample, gain=1.0):
+        """Start a sample; if all voices are busy a fading one, else the oldest, is dropped"""
+        voice = sample.make_voice(gain)
+        with self.lock:
+            if len(self.voices) >= self.max_voices:
+                fading = [index for index, other in enumerate(self.voices) if other.fade_block is not None]
+                self.voices.pop(fading[0] if fading else 0).close()
+                self.voices_stolen += 1
+            self.voices.append(voice)
+        self.voice_added.set()
+        return voice
+
+    def fade_out(self, voices=None):
+        """Ramp voices (default: all) down to silence from the next block on"""
+        with self.lock:
+            for voice in self.voices if voices is None else voices:
+                if voice.fade_block is not None:
+                    continue
+                if self.fades:
+                    voice.fade_block = 0
+                    self.fades_started += 1
+                else:
+                    voice.faded = True
+
+    def clear(self):
+        with self.lock:
+            for voice in self.voices:
+                voice.close()
+            self.voices = []
+
+    def render_block(self):
+        """Mix one block of all active voices into int16 frames"""
+        start = time.perf_counter()
+        out = self.buffer
+        out.fill(0)
+        with self.lock:
+            voices = self.voices
+            for voice in voices:
+                if voice.faded:
+                    continue
+                block = voice.read(self.block_size)
+                frames = len(block)
+                if voice.fade_block is not None:
+                    fade_start = time.perf_counter()
+                    envelope = self.fades[voice.fade_block]
+                    if frames > 0:
+                        out[:frames] += block * (envelope[:frames] * voice.gain)
+                    voice.fade_block += 1
+                    voice.faded = voice.fade_block >= len(self.fades)
+                    self.fade_blocks += 1
+                    self.fade_seconds += time.perf_counter() - fade_start
+                elif frames > 0:
+                    out[:frames] += block * voice.gain
+            self.voice_blocks += len(voices)
+            ended = any(voice.done for voice in voices)
+            if ended:
+                for voice in voices:
+                    if voice.done:
+                        voice.close()
+                self.voices = [voice for voice in voices if not voice.done]
+            volume = self.volume
+        if ended and self.on_voice_end:
+            self.on_voice_end()
+        block = (np.clip(out * volume, -1.0, 1.0) * 32767).astype('<i2')
+        elapsed = time.perf_counter() - start
+        self.blocks += 1
+        self.render_seconds += elapsed
+        self.max_render_seconds = max(self.max_render_seconds, elapsed)
+        return block
+
+    def render_loop(self):
+        """Render and write blocks until stopped; the sink sets the pace
+
+        Playout is tracked against the clock: a block written after everything
+        before it has already played means the output ran dry. After
+        idle_suspend seconds without voices the loop stops rendering silence
+        and sleeps until a voice is added.
+        """
+        block_seconds = self.block_size / self.sample_rate
+        played_until = None
+        idle_since = None
+        while self.running:
+            if self.voices or self.idle_suspend is None:
+                idle_since = None
+            elif idle_since is None:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= self.idle_suspend:
+                self.suspend()
+                played_until = idle_since = None
+                continue
+            wakeups.record("mixer")
+            block = self.render_block()
+            now = time.monotonic()
+            if played_until is not None and now > played_until:
+                self.underruns += 1
+                self.underrun_seconds += now - played_until
+                played_until = now
+            played_until = (played_until or now) + block_seconds
+            self.sink.write(block)
+
+    def suspend(self):
+        """Wait for the next voice without writing to the sink"""
+        self.voice_added.clear()
+        if self.voices or not self.running:
+            return
+        self.suspended = True
+        self.suspends += 1
+        self.voice_added.wait()
+        self.suspended = False
+        self.sink.resume()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.render_loop, name="mixer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.voice_added.set()
+        if self.thread:
+            self.thread.join(timeout=2)
+        self.sink.close()
+
+    def is_busy(self):
+        """Any voice playing that is not already fading out"""
+        return any(voice.fade_block is None for voice in list(self.voices))
+
+    def get_status(self):
+        block_seconds = self.block_size / self.sample_rate
+        mean = self.render_seconds / self.blocks if self.blocks else 0.0
+        fade_mean = self.fade_seconds / self.fade_blocks if self.fade_blocks else 0.0
+        return {
+            'voices': len(self.voices),
+            'block_size': self.block_size,
+            'blocks': self.blocks,
+            'voice_blocks': self.voice_blocks,
+            'render_us_mean': round(mean * 1e6, 1),
+            'render_us_max': round(self.max_render_seconds * 1e6, 1),
+            'load_percent': round(mean / block_seconds * 100, 2),
+            'latency_ms': round(block_seconds * 1000, 2),
+            'underruns': self.underruns,
+            'underrun_ms': round(self.underrun_seconds * 1000, 1),
+            'sink_xruns': getattr(self.sink, 'xruns', 0),
+            'suspended': self.suspended,
+            'idle_suspends': self.suspends,
+            'voices_stolen': self.voices_stolen,
+            'fade_ms': self.fade_ms,
+            'fades_started': self.fades_started,
+            'fade_blocks': self.fade_blocks,
+            'fade_us_mean': round(fade_mean * 1e6, 1),
+            'fade_percent_of_render': round(self.fade_seconds / self.render_seconds * 100, 2) if self.render_seconds else 0.0
+        }
+
+class MixerBackend:
+    """Audio engine backend on the software mixer; same interface as AudioEngine"""
+
+    def __init__(self, sink=None, block_size=None):
+        block_size = block_size or calibrated_buffer_size(MIXER_BLOCK_SIZE)
+        self.mixer = SoftwareMixer(sink or create_sink(block_size=block_size), block_size=block_size)
+        self.store = None
+        if SAMPLE_STORE == "adpcm":
+            from sample_store import SampleStore
+            self.store = SampleStore(block_size=block_size)
+        self.streamer = Streamer(block_size=block_size)
+        self.calibration = load_calibrations().get(device_key())
+        self.volume = DEFAULT_VOLUME
+        self.on_finished = None
+        self.mixer.on_voice_end = self.voice_ended
+
+    def start(self):
+        self.streamer.start()
+        self.mixer.start()
+        return True
+
+    def load(self, path):
+        """Decode a file into a sample; long WAV files are streamed from disk instead"""
+        with tracer.span("decode", path=path):
+            sample = self.streamer.open(path)
+            if sample:
+                return sample
+            if self.store:
+                return self.store.encode(path, decode_file(path))
+            return MixerSample(path, decode_file(path))
+
+    def play(self, sample=None, path=None):
+        """Fade out whatever is playing and start a preloaded sample or a decoded file
+
+        The new voice starts on the next block; it does not wait for the fade.
+        """
+        if sample is None:
+            sample = self.load(path)
+        self.mixer.fade_out()
+        self.mixer.add_voice(sample)
+
+    def stop(self):
+        self.mixer.fade_out()
+
+    def set_volume(self, volume):
+        self.volume = volume
+        self.mixer.volume = volume
+
+    def is_busy(self):
+        return self.mixer.is_busy()
+
+    def voice_ended(self):
+        if self.on_finished:
+            self.on_finished()
+
+    def active_sounds(self):
+        return {voice.sample for voice in list(self.mixer.voices)}
+
+    def voice_count(self):
+        """Voices being mixed, including fading ones and repeats of one sample"""
+        return len(self.mixer.voices)
+
+    def get_status(self):
+        return {
+            'mode': 'in_process',
+            'backend': 'numpy',
+            'mixer': self.mixer.get_status(),
+            'store': self.store.get_status() if self.store else {'mode': 'pcm'},
+            'streaming': self.streamer.get_status(),
+            'calibration': self.calibration
+        }
+
+    def shutdown(self):
+        self.mixer.stop()
+        self.streamer.stop()
+
+def benchmark(voices, seconds, block_size=MIXER_BLOCK_SIZE, interrupt_every=0):
+    """Render offline into a NullSink and report mixer throughput
+
+    With interrupt_every, the oldest voice is faded out and replaced every
+    that many blocks, as a new trigger would.
+    """
+    rng = np.random.default_rng(0)
+    frames = int(SAMPLE_RATE * seconds)
+    mixer = SoftwareMixer(NullSink(), block_size=block_size, max_voices=max(voices, 1) * 2)
+    samples = [MixerSample(f"voice{index}", (rng.standard_normal((frames, CHANNELS)) * 0.1).astype(np.float32))
+               for index in range(voices)]
+    for sample in samples:
+        mixer.add_voice(sample, gain=0.5)
+    blocks = frames // block_size
+    start = time.perf_counter()
+    for index in range(blocks):
+        if interrupt_every and voices and index % interrupt_every == interrupt_every - 1:
+            playing = [voice for voice in mixer.voices if voice.fade_block is None]
+            mixer.fade_out(playing[:1])
+            mixer.add_voice(playing[0].sample if playing else samples[0], gain=0.5)
+        mixer.sink.write(mixer.render_block())
+    elapsed = time.perf_counter() - start
+    status = mixer.get_status()
+    return {
+        'voices': voices,
+        'block_size': block_size,
+        'blocks': blocks,
+        'seconds': round(elapsed, 3),
+        'blocks_per_second': round(blocks / elapsed),
+        'voice_blocks_per_second': round(blocks * voices / elapsed),
+        'realtime_factor': round(seconds / elapsed, 1),
+        'render_us_mean': round(elapsed / blocks * 1e6, 1),
+        'fade_blocks': status['fade_blocks'],
+        'fade_us_mean': status['fade_us_mean']
+    }
+
+def compare_backends(path, triggers=200):
+    """Time load and play() on both backends with silent output
+
+    pygame runs on SDL's dummy driver and the software mixer on a realtime
+    null sink, so both do the same work as on the Pi minus the sound card.
+    """
+    from audio_engine import AudioEngine
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    results = {}
+    for name, factory in (("pygame", AudioEngine), ("numpy", lambda: MixerBackend(NullSink(realtime=True)))):
+        engine = factory()
+        engine.start()
+        start = time.perf_counter()
+        sample = engine.load(path)
+        load_ms = (time.perf_counter() - start) * 1000
+        timings = []
+        for _ in range(triggers):
+            start = time.perf_counter()
+            engine.play(sample=sample)
+            timings.append(time.perf_counter() - start)
+            time.sleep(0.002)
+        engine.stop()
+        timings.sort()
+        results[name] = {
+            'load_ms': round(load_ms, 2),
+            'play_us_p50': round(timings[len(timings) // 2] * 1e6, 1),
+            'play_us_p99': round(timings[int(len(timings) * 0.99)] * 1e6, 1)
+        }
+        if name == "numpy":
+            results[name]['mixer'] = engine.mixer.get_status()
+        engine.shutdown()
+    return results
+
+def main():
+    """Benchmark the software mixer offline, or compare it with pygame"""
+    parser = argparse.ArgumentParser(description="Software mixer benchmark")
+    parser.add_argument("--voices", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seconds", type=float, default=10.0, help="audio seconds rendered per run")
+    parser.add_argument("--block-size", type=int, default=MIXER_BLOCK_SIZE)
+    parser.add_argument("--interrupt", type=int, default=0, metavar="BLOCKS",
+                        help="fade out and replace a voice every BLOCKS blocks")
+    parser.add_argument("--compare", metavar="FILE", help="time both backends playing this file")
+    args = parser.parse_args()
+    if args.compare:
+        for name, result in compare_backends(args.compare).items():
+            print(f"{name}: {result}")
+        return
+    for voices in args.voices:
+        result = benchmark(voices, args.seconds, args.block_size, args.interrupt)
+        print(", ".join(f"{key}={value}" for key, value in result.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Peer Forwarder for Raspberry Pi Audio Server
+Fans triggers out to several peer audio servers over keep-alive connections,
+with a worker, retry policy and circuit breaker per peer
+"""
+
+import time
+import uuid
+import queue
+import threading
+import logging
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from config import *
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+def peer_url(peer):
+    """Accept "host:port" or a full base URL"""
+    peer = peer.rstrip('/')
+    return peer if "://" in peer else f"http://{peer}"
+
+class Peer:
+    """One peer server: its own connection pool, queue, worker and metrics"""
+
+    def __init__(self, url, path, timeout, retries, event_callback=None):
+        self.url = url
+        self.endpoint = f"{url}{path}"
+        self.timeout = timeout
+        self.retries = retries
+        self.event_callback = event_callback
+        self.session = requests.Session()
+        # One worker per peer, so one pooled keep-alive connection is enough
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.queue = queue.Queue(maxsize=FORWARD_QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.circuit = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.latencies = deque(maxlen=FORWARD_LATENCY_WINDOW)
+        self.last_error = None
+        self.stats = {
+            'sent': 0,
+            'failed': 0,
+            'retries': 0,
+            'dropped_queue_full': 0,
+            'dropped_stale': 0,
+            'short_circuited': 0,
+            'circuit_opens': 0
+        }
+        self.worker_thread = threading.Thread(target=self.worker_loop, daemon=True)
+        self.worker_thread.start()
+
+    def notify(self, event_type, **data):
+        if self.event_callback:
+            try:
+                self.event_callback(event_type, **data)
+            except Exception as e:
+                logger.error(f"Error sending forwarder event: {e}")
+
+    def enqueue(self, payload, deadline):
+        """Queue a payload without ever blocking the caller"""
+        try:
+            self.queue.put_nowait((payload, deadline))
+        except queue.Full:
+            with self.lock:
+                self.stats['dropped_queue_full'] += 1
+
+    def allow_request(self, now):
+        """Circuit breaker gate: closed passes, open rejects, half-open lets one probe through"""
+        with self.lock:
+            if self.circuit == CIRCUIT_OPEN:
+                if now < self.open_until:
+                    self.stats['short_circuited'] += 1
+                    return False
+                self.circuit = CIRCUIT_HALF_OPEN
+            return True
+
+    def record_success(self, latency):
+        with self.lock:
+            self.stats['sent'] += 1
+            self.latencies.append(latency)
+            self.consecutive_failures = 0
+            recovered = self.circuit != CIRCUIT_CLOSED
+            self.circuit = CIRCUIT_CLOSED
+        if recovered:
+            logger.info(f"Peer {self.url} recovered")
+            self.notify("peer_recovered", peer=self.url)
+
+    def record_failure(self, error):
+        with self.lock:
+            self.stats['failed'] += 1
+            self.last_error = str(error)
+            self.consecutive_failures += 1
+            opened = (self.circuit == CIRCUIT_HALF_OPEN or
+                      self.consecutive_failures >= FORWARD_BREAKER_THRESHOLD) and self.circuit != CIRCUIT_OPEN
+            if opened:
+                self.circuit = CIRCUIT_OPEN
+                self.open_until = time.monotonic() + FORWARD_BREAKER_COOLDOWN
+                self.stats['circuit_opens'] += 1
+        if opened:
+            logger.warning(f"Peer {self.url} unreachable, pausing for {FORWARD_BREAKER_COOLDOWN}s: {error}")
+            self.notify("peer_down", peer=self.url, error=str(error))
+
+    def post(self, payload):
+        """Send one request; returns True on success, raises on a retryable failure"""
+        start = time.perf_counter()
+        response = self.session.post(self.endpoint, json=payload, timeout=self.timeout)
+        latency = time.perf_counter() - start
+        if response.status_code >= 500:
+            raise requests.HTTPError(f"HTTP {response.status_code}")
+        # A 4xx means the peer received the trigger and chose not to play it
+        self.record_success(latency)
+        if response.status_code >= 400:
+            logger.debug(f"Peer {self.url} rejected trigger: {response.status_code}")
+        return True
+
+    def deliver(self, payload, deadline):
+        """Send with retries and exponential backoff until the deadline
+
+        Every attempt sends the same payload, so a peer that already handled
+        it recognises the retry by its event_id instead of playing again.
+        """
+        for attempt in range(self.retries + 1):
+            now = time.monotonic()
+            if now > deadline:
+                with self.lock:
+                    self.stats['dropped_stale'] += 1
+                return
+            if not self.allow_request(now):
+                return
+            try:
+                self.post(payload)
+                return
+            except Exception as e:
+                self.record_failure(e)
+                if attempt == self.retries or self.circuit == CIRCUIT_OPEN:
+                    logger.error(f"Failed to forward to {self.url}: {e}")
+                    return
+                with self.lock:
+                    self.stats['retries'] += 1
+                time.sleep(min(FORWARD_BACKOFF_MAX, FORWARD_BACKOFF * (2 ** attempt)))
+
+    def worker_loop(self):
+        while True:
+            payload, deadline = self.queue.get()
+            if payload is None:
+                break
+            self.deliver(payload, deadline)
+
+    def stop(self):
+        try:
+            self.queue.put_nowait((None, 0))
+        except queue.Full:
+            pass
+        self.session.close()
+
+    def get_status(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            status = {
+                'circuit': self.circuit,
+                'queued': self.queue.qsize(),
+                'last_error': self.last_error,
+                **self.stats
+            }
+        if latencies:
+            status['latency_ms'] = {
+                'p50': round(latencies[len(latencies) // 2] * 1000, 2),
+                'p99': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+                'max': round(latencies[-1] * 1000, 2)
+            }
+        return status
+
+class PeerForwarder:
+    def __init__(self, peers, path="/trigger_audio", timeout=FORWARD_TIMEOUT, retries=FORWARD_RETRIES,
+                 max_age=FORWARD_MAX_AGE, event_callback=None):
+        self.path = path
+        self.max_age = max_age
+        self.peers = [Peer(peer_url(peer), path, timeout, retries, event_callback) for peer in peers]
+
+    def send(self, payload, deadline=None):
+        """Queue a payload for every peer; never blocks on the network"""
+        if 'event_id' not in payload:
+            # Retries must carry the id of the first attempt
+            payload = dict(payload, event_id=uuid.uuid4().hex)
+        if deadline is None:
+            deadline = time.monotonic() + self.max_age
+        for peer in self.peers:
+            peer.enqueue(payload, deadline)
+
+    def stop(self):
+        for peer in self.peers:
+            peer.stop()
+
+    def get_status(self):
+        """Per-peer delivery, latency and circuit breaker metrics"""
+        return {peer.url: peer.get_status() for peer in self.peers}
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Predictive Prefetcher for Raspberry Pi Audio Server
+Decodes the likely follow-up sample (usually hold<n>) while a press is in progress
+"""
+
+import os
+import time
+import queue
+import threading
+import logging
+from config import *
+from wakeups import wakeups
+
+logger = logging.getLogger(__name__)
+
+class Prefetcher:
+    def __init__(self, get_router):
+        """get_router is a callable returning the active Router"""
+        self.get_router = get_router
+        self.queue = queue.LifoQueue(maxsize=PREFETCH_QUEUE_SIZE)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.worker_thread = None
+        self.stats = {
+            'requested': 0,
+            'already_cached': 0,
+            'loaded': 0,
+            'dropped': 0,
+            'hits': 0,
+            'late': 0,
+            'misses': 0,
+            'unused': 0
+        }
+
+    def start(self):
+        """Start the low priority prefetch worker"""
+        if self.worker_thread and self.worker_thread.is_alive():
+            return
+        self.worker_thread = threading.Thread(target=self.worker_loop, daemon=True)
+        self.worker_thread.start()
+
+    def on_press(self, transmitter, button, route):
+        """Queue the follow-up samples for a press that just started playing"""
+        router = self.get_router()
+        paths = []
+        hold_route = router.resolve(transmitter, button, "hold")
+        if hold_route and hold_route is not route and hold_route.path:
+            paths.append(hold_route.path)
+        for audio_file in route.prefetch:
+            path = router.locate(audio_file)
+            if path:
+                paths.append(path)
+
+        now = time.monotonic()
+        with self.lock:
+            self.expire(now)
+            for path in paths:
+                self.stats['requested'] += 1
+                if path in self.pending:
+                    continue
+                if router.sample_cache.get(path) is not None:
+                    self.stats['already_cached'] += 1
+                    continue
+                try:
+                    self.queue.put_nowait((path, router.sample_cache, now))
+                    self.pending[path] = now
+                except queue.Full:
+                    self.stats['dropped'] += 1
+
+    def record_play(self, event, path, cached):
+        """Record whether a played sample was covered by a prefetch"""
+        with self.lock:
+            if path in self.pending:
+                del self.pending[path]
+                self.stats['hits' if cached else 'late'] += 1
+            elif event == "hold" and not cached:
+                self.stats['misses'] += 1
+
+    def expire(self, now):
+        """Forget prefetches that were never used within the TTL
+
+        Must be called with the lock held.
+        """
+        for path, requested_at in list(self.pending.items()):
+            if now - requested_at > PREFETCH_TTL:
+                del self.pending[path]
+                self.stats['unused'] += 1
+
+    def worker_loop(self):
+        """Decode queued samples at low CPU priority"""
+        try:
+            # On Linux this renices only the calling thread
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PREFETCH_NICE)
+        except Exception as e:
+            logger.debug(f"Could not lower prefetch thread priority: {e}")
+
+        while True:
+            path, sample_cache, requested_at = self.queue.get()
+            wakeups.record("prefetch")
+            # A prefetch that missed the press-to-hold window is no longer useful
+            if time.monotonic() - requested_at > PREFETCH_TTL:
+                continue
+            if sample_cache.get(path) is None and sample_cache.load(path) is not None:
+                with self.lock:
+                    self.stats['loaded'] += 1
+                logger.debug(f"Prefetched {path}")
+
+    def get_status(self):
+        """Get prefetch statistics"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['pending'] = len(self.pending)
+        used = stats['hits'] + stats['late'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / used, 3) if used else None
+        return stats
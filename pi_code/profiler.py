@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Sampling Profiler for Raspberry Pi Audio Server
+Samples the stacks of every thread on demand and reports collapsed stacks
+(flamegraph.pl / speedscope input) with per-thread CPU time. Nothing runs
+while the profiler is stopped.
+"""
+
+import os
+import sys
+import math
+import time
+import threading
+import logging
+from collections import Counter
+from config import *
+
+logger = logging.getLogger(__name__)
+
+def thread_cpu_times():
+    """CPU seconds used by each live thread, keyed by thread ident"""
+    times = {}
+    for thread in threading.enumerate():
+        try:
+            times[thread.ident] = time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+        except (OSError, AttributeError, TypeError):
+            # Thread exited, or the platform has no per-thread clocks
+            continue
+    return times
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+class SamplingProfiler:
+    def __init__(self, interval=PROFILER_INTERVAL, max_seconds=PROFILER_MAX_SECONDS):
+        self.default_interval = interval
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        self.reset()
+
+    def reset(self):
+        self.stacks = Counter()
+        self.thread_samples = Counter()
+        self.samples = 0
+        self.sample_seconds = 0.0
+        self.started = None
+        self.stopped = None
+        self.cpu_start = {}
+        self.cpu_end = {}
+        self.names = {}
+        self.process_cpu_start = 0.0
+        self.process_cpu_end = 0.0
+
+    def start(self, interval=None):
+        """Start sampling; returns False if a session is already running"""
+        with self.lock:
+            if self.running:
+                return False
+            self.reset()
+            self.interval = max(0.001, interval) if interval else self.default_interval
+            self.running = True
+            self.started = time.monotonic()
+            self.cpu_start = thread_cpu_times()
+            self.process_cpu_start = time.process_time()
+            self.thread = threading.Thread(target=self.sample_loop, name="profiler", daemon=True)
+            self.thread.start()
+        logger.info(f"Profiler started ({self.interval * 1000:.1f}ms interval)")
+        return True
+
+    def stop(self):
+        """Stop sampling and return the report, or None if nothing was running"""
+        with self.lock:
+            thread = self.thread
+            if thread is None:
+                return None
+            self.running = False
+            self.thread = None
+        thread.join()
+        logger.info(f"Profiler stopped after {self.samples} samples")
+        return self.report()
+
+    def profile(self, seconds, interval=None):
+        """Run a session for a fixed window and return its report"""
+        seconds = 0.0 if math.isnan(seconds) else min(max(seconds, 0.0), self.max_seconds)
+        if not self.start(interval):
+            return None
+        try:
+            time.sleep(seconds)
+        finally:
+            report = self.stop()
+        return report
+
+    def sample_loop(self):
+        me = threading.get_ident()
+        deadline = self.started + self.max_seconds
+        while self.running and time.monotonic() < deadline:
+            start = time.perf_counter()
+            self.names.update((thread.ident, thread.name) for thread in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame))
+                    frame = frame.f_back
+                name = self.names.get(ident, f"thread-{ident}")
+                labels.append(name)
+                self.stacks[";".join(reversed(labels))] += 1
+                self.thread_samples[ident] += 1
+            self.samples += 1
+            elapsed = time.perf_counter() - start
+            self.sample_seconds += elapsed
+            time.sleep(max(0.0, self.interval - elapsed))
+        # Taken here so a session that hit max_seconds still reports its window
+        self.stopped = time.monotonic()
+        self.cpu_end = thread_cpu_times()
+        self.process_cpu_end = time.process_time()
+        self.running = False
+
+    def collapsed(self):
+        """Collapsed stack lines: thread;outer;...;inner count"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def report(self):
+        window = (self.stopped or time.monotonic()) - self.started
+        threads = {}
+        for ident, end in self.cpu_end.items():
+            name = self.names.get(ident, f"thread-{ident}")
+            if name in threads:
+                name = f"{name} ({ident})"
+            threads[name] = {
+                'cpu_ms': round((end - self.cpu_start.get(ident, 0.0)) * 1000, 2),
+                'samples': self.thread_samples.get(ident, 0)
+            }
+        return {
+            'window_s': round(window, 3),
+            'interval_ms': round(self.interval * 1000, 2),
+            'samples': self.samples,
+            'process_cpu_ms': round((self.process_cpu_end - self.process_cpu_start) * 1000, 2),
+            'profiler_cpu_ms': round(self.sample_seconds * 1000, 2),
+            'threads': dict(sorted(threads.items(), key=lambda item: -item[1]['cpu_ms'])),
+            'collapsed': self.collapsed()
+        }
+
+    def get_status(self):
+        return {
+            'running': self.running,
+            'interval_ms': round(self.interval * 1000, 2),
+            'samples': self.samples,
+            'elapsed_s': round(time.monotonic() - self.started, 1) if self.running else None
+        }
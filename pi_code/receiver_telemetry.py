@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Receiver Telemetry for Raspberry Pi
+Turns the XIAO receiver's status and diagnostic lines into a per-transmitter
+table instead of discarding them as unknown commands
+"""
+
+import re
+import time
+import threading
+import logging
+from collections import deque
+from config import *
+
+logger = logging.getLogger(__name__)
+
+MAC = r'([0-9A-Fa-f]{2}(?::[0-9A-Fa-f]{2}){5})'
+RX_PATTERN = re.compile(rf'^RX: BTN(\d+)( HOLD)? from {MAC}$')
+CONNECTED_PATTERN = re.compile(rf'^Authorized transmitter connected: {MAC}$')
+REJECTED_PATTERN = re.compile(rf'^Rejected(?: message from unauthorized MAC(?:: {MAC})?|: Unauthorized transmitter)$')
+ACK_FAILED_PATTERN = re.compile(rf'^Failed to send ACK to {MAC}$')
+STATUS_PATTERN = re.compile(r'^Status: (\d+) transmitters, (\d+) linked, Pi forwards: (\d+)$')
+LINK_PATTERN = re.compile(rf'^Link \d+: {MAC} - (\w+)$')
+# Startup banner and other informational output
+INFO_PREFIXES = ("Receiver ", "LED Pin", "Allowed transmitters", "TX", "Serial communication",
+                 "ESP-NOW", "Initializing", "Waiting for", "Added peer", "Accepted:", "===")
+
+class TransmitterStats:
+    """Counters for one transmitter MAC"""
+
+    def __init__(self, mac, now):
+        self.mac = mac
+        self.first_seen = now
+        self.last_seen = now
+        self.presses = 0
+        self.holds = 0
+        self.connects = 0
+        self.ack_failures = 0
+        self.rejects = 0
+        self.linked = None
+        self.last_button = None
+        self.recent = deque()
+
+    def record_event(self, now):
+        self.last_seen = now
+        self.recent.append(now)
+        self.expire(now)
+
+    def expire(self, now):
+        while self.recent and now - self.recent[0] > TELEMETRY_RATE_WINDOW:
+            self.recent.popleft()
+
+    def to_dict(self, now):
+        self.expire(now)
+        return {
+            'mac': self.mac,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'seconds_since_seen': round(now - self.last_seen, 1),
+            'presses': self.presses,
+            'holds': self.holds,
+            'events_per_minute': round(len(self.recent) * 60 / TELEMETRY_RATE_WINDOW, 2),
+            'last_button': self.last_button,
+            'connects': self.connects,
+            'ack_failures': self.ack_failures,
+            'rejects': self.rejects,
+            'linked': self.linked
+        }
+
+class ReceiverTelemetry:
+    def __init__(self, event_callback=None):
+        self.event_callback = event_callback
+        self.lock = threading.Lock()
+        self.transmitters = {}
+        self.receiver = None
+        self.rejects = 0
+        self.info_lines = 0
+        self.unknown_lines = 0
+        self.handlers = [
+            (RX_PATTERN, self.on_rx),
+            (CONNECTED_PATTERN, self.on_connected),
+            (REJECTED_PATTERN, self.on_rejected),
+            (ACK_FAILED_PATTERN, self.on_ack_failed),
+            (STATUS_PATTERN, self.on_status),
+            (LINK_PATTERN, self.on_link)
+        ]
+
+    def notify(self, event_type, **data):
+        if self.event_callback:
+            try:
+                self.event_callback(event_type, **data)
+            except Exception as e:
+                logger.error(f"Error sending telemetry event: {e}")
+
+    def get_transmitter(self, mac, now):
+        """Get or create the stats for a MAC
+
+        Must be called with the lock held.
+        """
+        mac = mac.upper()
+        stats = self.transmitters.get(mac)
+        if stats is None:
+            stats = TransmitterStats(mac, now)
+            self.transmitters[mac] = stats
+        return stats
+
+    def ingest(self, line):
+        """Record a telemetry line; returns False if the line is not telemetry"""
+        now = time.time()
+        with self.lock:
+            for pattern, handler in self.handlers:
+                match = pattern.match(line)
+                if match:
+                    event = handler(now, *match.groups())
+                    break
+            else:
+                if not line.startswith(INFO_PREFIXES):
+                    return False
+                self.info_lines += 1
+                return True
+
+        if event:
+            event_type, data = event
+            self.notify(event_type, **data)
+        return True
+
+    def on_rx(self, now, button, hold, mac):
+        stats = self.get_transmitter(mac, now)
+        if hold:
+            stats.holds += 1
+        else:
+            stats.presses += 1
+        stats.last_button = int(button)
+        stats.record_event(now)
+
+    def on_connected(self, now, mac):
+        stats = self.get_transmitter(mac, now)
+        stats.connects += 1
+        stats.last_seen = now
+        return "transmitter_connected", {'mac': stats.mac}
+
+    def on_rejected(self, now, mac=None):
+        self.rejects += 1
+        if mac:
+            stats = self.get_transmitter(mac, now)
+            stats.rejects += 1
+            stats.last_seen = now
+
+    def on_ack_failed(self, now, mac):
+        self.get_transmitter(mac, now).ack_failures += 1
+
+    def on_status(self, now, transmitters, linked, forwards):
+        previous = self.receiver
+        self.receiver = {
+            'transmitters': int(transmitters),
+            'linked': int(linked),
+            'pi_forwards': int(forwards),
+            'updated': now
+        }
+        # A drop in the forward counter means the receiver rebooted
+        if previous and self.receiver['pi_forwards'] < previous['pi_forwards']:
+            return "receiver_restarted", {'pi_forwards': previous['pi_forwards']}
+
+    def on_link(self, now, mac, state):
+        self.get_transmitter(mac, now).linked = state.lower() == "linked"
+
+    def record_unknown(self):
+        with self.lock:
+            self.unknown_lines += 1
+
+    def get_status(self):
+        """Per-transmitter table and receiver-wide counters"""
+        now = time.time()
+        with self.lock:
+            return {
+                'receiver': dict(self.receiver) if self.receiver else None,
+                'transmitters': [stats.to_dict(now) for stats in self.transmitters.values()],
+                'unauthorized_rejects': self.rejects,
+                'info_lines': self.info_lines,
+                'unknown_lines': self.unknown_lines
+            }
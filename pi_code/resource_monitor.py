@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Resource Monitor for Raspberry Pi Audio Server
+Samples process CPU, memory and threads plus server gauges (voices, queue
+depths) and event rates into a fixed-size ring buffer, so capacity limits and
+leaks show up over hours without an external agent
+"""
+
+import time
+import threading
+import logging
+import numpy as np
+from config import *
+from wakeups import wakeups
+
+logger = logging.getLogger(__name__)
+
+def read_proc_status():
+    """RSS bytes and thread count of this process from /proc, or None off Linux"""
+    rss = threads = None
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("Threads:"):
+                    threads = int(line.split()[1])
+    except OSError:
+        pass
+    return rss, threads
+
+class Series:
+    """One recorded metric: a gauge read as is, or a counter recorded as a per-second rate"""
+
+    def __init__(self, name, read, kind, help_text):
+        self.name = name
+        self.read = read
+        self.kind = kind
+        self.help_text = help_text
+        self.last_total = None  # (time, count) at the previous sample
+
+class ResourceMonitor:
+    def __init__(self, interval=MONITOR_INTERVAL, history=MONITOR_HISTORY):
+        self.interval = interval
+        self.history = history
+        self.series = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+        self.times = np.zeros(history, dtype=np.float64)
+        self.values = None
+        self.count = 0  # Samples taken; the ring holds the last `history` of them
+        self.last_time = None
+        self.last_cpu = None
+        self.add_gauge("cpu_percent", self.read_cpu, "Process CPU use since the previous sample, percent of one core")
+        self.add_gauge("rss_bytes", lambda: read_proc_status()[0], "Resident set size")
+        self.add_gauge("threads", lambda: read_proc_status()[1] or threading.active_count(), "Threads in the process")
+
+    def add_gauge(self, name, read, help_text=""):
+        """Record read() each sample; series must be added before start()"""
+        self.series.append(Series(name, read, "gauge", help_text))
+
+    def add_counter(self, name, read, help_text=""):
+        """Record the per-second rate of a cumulative count returned by read()"""
+        self.series.append(Series(name, read, "counter", help_text))
+
+    def read_cpu(self):
+        now = time.monotonic()
+        cpu = time.process_time()
+        percent = None
+        if self.last_cpu is not None and now > self.last_time:
+            percent = (cpu - self.last_cpu) / (now - self.last_time) * 100
+        self.last_time, self.last_cpu = now, cpu
+        return percent
+
+    def sample(self):
+        """Take one sample of every series into the ring"""
+        if self.values is None:
+            self.values = np.full((self.history, len(self.series)), np.nan, dtype=np.float32)
+        now = time.time()
+        row = np.full(len(self.series), np.nan, dtype=np.float32)
+        for index, series in enumerate(self.series):
+            try:
+                value = series.read()
+            except Exception as e:
+                logger.debug(f"Failed to read {series.name}: {e}")
+                continue
+            if value is None:
+                continue
+            if series.kind == "counter":
+                previous, series.last_total = series.last_total, (now, value)
+                if previous is None or now <= previous[0]:
+                    continue
+                value = max(0.0, value - previous[1]) / (now - previous[0])
+            row[index] = value
+        with self.lock:
+            slot = self.count % self.history
+            self.times[slot] = now
+            self.values[slot] = row
+            self.count += 1
+
+    def sample_loop(self):
+        while self.running:
+            wakeups.record("resource_monitor")
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Resource sample failed: {e}")
+            self.wakeup.wait(self.interval)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.sample_loop, name="resource-monitor", daemon=True)
+        self.thread.start()
+        logger.info(f"Resource monitor started ({self.interval}s interval, {self.history} samples)")
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=2)
+
+    def rows(self, seconds=None):
+        """Sample times and values, oldest first"""
+        with self.lock:
+            stored = min(self.count, self.history)
+            order = (np.arange(stored) + self.count - stored) % self.history
+            times = self.times[order]
+            values = self.values[order] if self.values is not None else np.zeros((0, len(self.series)))
+        if seconds:
+            keep = times >= time.time() - seconds
+            times, values = times[keep], values[keep]
+        return times, values
+
+    def get_history(self, seconds=None, step=1):
+        """Compact columnar history: one array per series, null where unreadable
+
+        Counters listed under 'rates' are per-second. step > 1 averages each
+        run of step samples into one point.
+        """
+        times, values = self.rows(seconds)
+        step = max(1, int(step))
+        if step > 1 and len(times):
+            points = len(times) // step
+            times = times[:points * step].reshape(points, step)[:, -1]
+            runs = values[:points * step].reshape(points, step, -1)
+            counts = (~np.isnan(runs)).sum(axis=1)
+            values = np.where(counts, np.nansum(runs, axis=1) / np.maximum(counts, 1), np.nan)
+        start = float(times[0]) if len(times) else None
+        series = {}
+        for index, metric in enumerate(self.series):
+            column = values[:, index]
+            series[metric.name] = [None if np.isnan(value) else round(float(value), 2) for value in column]
+        return {
+            'start': round(start, 1) if start else None,
+            'interval_s': round(self.interval * step, 3),
+            'offsets_s': [round(float(t - start), 1) for t in times] if start else [],
+            'series': series,
+            'rates': [metric.name for metric in self.series if metric.kind == "counter"]
+        }
+
+    def latest(self):
+        """Most recent value of each series"""
+        times, values = self.rows()
+        if not len(times):
+            return {}
+        return {metric.name: None if np.isnan(value) else float(value)
+                for metric, value in zip(self.series, values[-1])}
+
+    def prometheus(self, prefix="wrb"):
+        """Latest sample in Prometheus text exposition format
+
+        Counters are read live as running totals; rates are left to PromQL.
+        """
+        lines = []
+        latest = self.latest()
+        for metric in self.series:
+            name = f"{prefix}_{metric.name}"
+            if metric.kind == "counter":
+                name = f"{name}_total"
+                try:
+                    value = metric.read()
+                except Exception:
+                    value = None
+            else:
+                value = latest.get(metric.name)
+            if value is None:
+                continue
+            if metric.help_text:
+                lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.append(f"{name} {value:.10g}")
+        return "\n".join(lines) + "\n"
+
+    def get_status(self):
+        with self.lock:
+            stored = min(self.count, self.history)
+        return {
+            'running': self.running,
+            'interval_s': self.interval,
+            'samples': stored,
+            'capacity': self.history,
+            'series': [metric.name for metric in self.series],
+            'bytes': self.times.nbytes + (self.values.nbytes if self.values is not None else 0)
+        }
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Trigger Routing for Raspberry Pi Audio Server
+Compiles (transmitter, button, event) routes to preloaded samples, with hot reload
+"""
+
+import os
+import re
+import json
+import threading
+import logging
+from config import *
+
+logger = logging.getLogger(__name__)
+
+WILDCARD = "*"
+EVENT_TYPES = ("press", "hold")
+
+LEGACY_KEY_PATTERN = re.compile(r'^(?:tx(\d+)_)?(button|hold)(\d+)$')
+
+class Route:
+    """A mapping rule resolved to a file and, once preloaded, a sample handle"""
+
+    def __init__(self, transmitter, button, event, audio_file, name=None, prefetch=(), priority=None):
+        self.transmitter = transmitter
+        self.button = button
+        self.event = event
+        self.audio_file = audio_file
+        self.name = name or f"tx{transmitter}/btn{button}/{event}"
+        self.prefetch = list(prefetch)
+        self.priority = priority
+        self.path = None
+        self.sample = None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'transmitter': self.transmitter,
+            'button': self.button,
+            'event': self.event,
+            'audio_file': self.audio_file,
+            'priority': self.priority or self.event,
+            'preloaded': self.sample is not None
+        }
+
+def normalize_id(value):
+    """Normalize a transmitter or button id to an int, or WILDCARD"""
+    if value is None or value == WILDCARD:
+        return WILDCARD
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+def parse_mappings(mappings):
+    """Parse a mapping document into a list of routes
+
+    Accepts either {"routes": [{"transmitter", "button", "event", "file", "prefetch", "priority"}, ...]}
+    or the legacy flat form used by AUDIO_MAPPINGS ("button1", "hold2",
+    optionally prefixed "tx3_" to target one transmitter).
+    """
+    routes = []
+    if 'routes' in mappings:
+        for rule in mappings['routes']:
+            event = rule.get('event', 'press')
+            if event not in EVENT_TYPES:
+                raise ValueError(f"Unknown event type in route: {event}")
+            priority = rule.get('priority')
+            if priority is not None and priority not in SCHEDULER_PRIORITIES:
+                raise ValueError(f"Unknown priority class in route: {priority}")
+            routes.append(Route(
+                normalize_id(rule.get('transmitter')),
+                normalize_id(rule.get('button')),
+                event,
+                rule['file'],
+                rule.get('name'),
+                rule.get('prefetch', ()),
+                priority
+            ))
+        return routes
+
+    for key, audio_file in mappings.items():
+        match = LEGACY_KEY_PATTERN.match(key)
+        if not match:
+            raise ValueError(f"Unknown mapping key: {key}")
+        transmitter, kind, button = match.groups()
+        event = "hold" if kind == "hold" else "press"
+        routes.append(Route(normalize_id(transmitter), int(button), event, audio_file, key))
+    return routes
+
+class RoutingTable:
+    """Immutable lookup table compiled from a list of routes"""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.names = [route.name for route in routes]
+        self.rules = {(route.transmitter, route.button, route.event): route for route in routes}
+
+        # Precompute every concrete (transmitter, button, event) in the configured
+        # range so the trigger path is a single dict lookup
+        self.resolved = {}
+        for transmitter in range(1, ROUTING_MAX_TRANSMITTERS + 1):
+            for button in range(1, ROUTING_MAX_BUTTONS + 1):
+                for event in EVENT_TYPES:
+                    route = self.match(transmitter, button, event)
+                    if route:
+                        self.resolved[(transmitter, button, event)] = route
+
+    def match(self, transmitter, button, event):
+        """Walk the wildcard and fallback chain for a trigger"""
+        events = [event]
+        if event == "hold" and ROUTING_HOLD_FALLBACK:
+            events.append("press")
+        for candidate_event in events:
+            for key in ((transmitter, button, candidate_event),
+                        (transmitter, WILDCARD, candidate_event),
+                        (WILDCARD, button, candidate_event),
+                        (WILDCARD, WILDCARD, candidate_event)):
+                route = self.rules.get(key)
+                if route:
+                    return route
+        return None
+
+    def resolve(self, transmitter, button, event):
+        """Resolve a trigger to its route, or None if nothing is mapped"""
+        route = self.resolved.get((transmitter, button, event))
+        if route is None:
+            route = self.match(normalize_id(transmitter), normalize_id(button), event)
+        return route
+
+    def audio_files(self):
+        return {route.audio_file for route in self.routes}
+
+class Router:
+    def __init__(self, sample_cache, usb_manager=None, mapping_file=ROUTING_FILE, event_callback=None,
+                 audio_dirs=(AUDIO_DIR,)):
+        self.sample_cache = sample_cache
+        self.usb_manager = usb_manager
+        self.mapping_file = mapping_file
+        self.audio_dirs = audio_dirs
+        self.event_callback = event_callback
+        self.reload_lock = threading.Lock()
+        self.reloads = 0
+        self.generation = 0
+        self.stale_reloads = 0
+        self.table = self.compile()
+
+    def load_mappings(self):
+        """Read the mapping file, falling back to AUDIO_MAPPINGS from config"""
+        if self.mapping_file and os.path.exists(self.mapping_file):
+            with open(self.mapping_file) as f:
+                logger.info(f"Loading audio mappings from {self.mapping_file}")
+                return json.load(f)
+        return AUDIO_MAPPINGS
+
+    def compile(self):
+        """Compile the current mapping source into a new table"""
+        return RoutingTable(parse_mappings(self.load_mappings()))
+
+    def locate(self, audio_file):
+        """Find an audio file in the audio directories or on a mounted USB drive"""
+        for audio_dir in self.audio_dirs:
+            file_path = os.path.join(audio_dir, audio_file)
+            if os.path.exists(file_path):
+                return file_path
+        if self.usb_manager:
+            return self.usb_manager.get_audio_files_from_usb().get(audio_file)
+        return None
+
+    def resolve(self, transmitter, button, event):
+        """Resolve a trigger against the active table"""
+        return self.table.resolve(transmitter, button, event)
+
+    def reload(self, wait=False):
+        """Recompile the mapping file and swap it in once changed sounds are preloaded
+
+        The current table keeps serving until the swap. Returns the preload
+        Future, or None if the mapping file could not be parsed.
+        """
+        try:
+            table = self.compile()
+        except Exception as e:
+            logger.error(f"Failed to reload audio mappings: {e}")
+            return None
+        return self.activate(table, wait=wait)
+
+    def activate(self, table, wait=False, on_active=None):
+        """Preload the sounds a table needs that are not already cached, then swap it in
+
+        Preloads run concurrently and can finish out of order, so only the most
+        recently activated table is swapped in; older completions are dropped.
+        """
+        with self.reload_lock:
+            self.generation += 1
+            generation = self.generation
+        for route in table.routes:
+            route.path = self.locate(route.audio_file)
+        paths = {route.path for route in table.routes if route.path}
+        # Routes for events outside PRELOAD_EVENTS are left to the prefetcher
+        preload_paths = {route.path for route in table.routes if route.path and route.event in PRELOAD_EVENTS}
+        changed = [path for path in preload_paths if not self.sample_cache.is_current(path)]
+
+        def swap():
+            with self.reload_lock:
+                if generation != self.generation:
+                    self.stale_reloads += 1
+                    logger.info(f"Discarded routing table {generation}, superseded by {self.generation}")
+                    return
+                self.sample_cache.pin(preload_paths)
+                for route in table.routes:
+                    route.sample = self.sample_cache.get(route.path) if route.path in preload_paths else None
+                self.table = table
+                self.reloads += 1
+                self.sample_cache.retain(paths)
+            logger.info(f"Routing table active: {len(table.routes)} routes, {len(changed)} samples preloaded")
+            if self.event_callback:
+                self.event_callback("mappings_reloaded", routes=len(table.routes), preloaded=len(changed))
+            if on_active:
+                on_active()
+
+        # Keep both tables' samples pinned until the swap so preloading cannot evict them
+        self.sample_cache.pin(self.sample_cache.pinned | preload_paths)
+        future = self.sample_cache.preload(changed, on_complete=swap)
+        if wait:
+            future.result()
+        return future
+
+    def get_status(self):
+        """Get routing statistics"""
+        table = self.table
+        return {
+            'routes': len(table.routes),
+            'compiled_keys': len(table.resolved),
+            'preloaded_routes': sum(1 for route in table.routes if route.sample is not None),
+            'reloads': self.reloads,
+            'stale_reloads': self.stale_reloads,
+            'mapping_file': self.mapping_file if self.mapping_file and os.path.exists(self.mapping_file) else None
+        }
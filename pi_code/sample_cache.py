@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Sample Cache for Raspberry Pi Audio Server
+Keeps decoded audio samples in memory so triggers start without disk access.
+Identical files share one decoded sample, whatever their name or device.
+"""
+
+import os
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+from config import *
+
+logger = logging.getLogger(__name__)
+
+class ContentBlob:
+    """One decoded sample shared by every path with the same content"""
+
+    def __init__(self, key, sound):
+        self.key = key
+        self.sound = sound
+        self.size_bytes = getattr(sound, 'size_bytes', None)
+        if self.size_bytes is None:
+            self.size_bytes = int(sound.get_length() * SAMPLE_RATE * CHANNELS * 2)
+        self.refs = 0
+
+class ContentIndex:
+    """Maps file content to decoded samples, shared by all scene caches
+
+    Samples are keyed by a hash of the file bytes when SAMPLE_DEDUP is set,
+    otherwise by path and mtime. Hashes are remembered per (path, mtime, size)
+    so unchanged files are read only once.
+    """
+
+    def __init__(self, dedup=SAMPLE_DEDUP):
+        self.dedup = dedup
+        self.blobs = {}
+        self.hashes = {}
+        self.lock = threading.Lock()
+        self.hash_seconds = 0.0
+        self.decodes = 0
+        self.shared_loads = 0
+
+    def key(self, path, stat):
+        if not self.dedup:
+            return f"{path}@{stat.st_mtime}"
+        file_state = (path, stat.st_mtime, stat.st_size)
+        digest = self.hashes.get(file_state)
+        if digest is None:
+            start = time.perf_counter()
+            hasher = hashlib.blake2b(digest_size=16)
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    hasher.update(block)
+            digest = hasher.hexdigest()
+            with self.lock:
+                self.hash_seconds += time.perf_counter() - start
+                self.hashes[file_state] = digest
+        return digest
+
+    def acquire(self, key, decode):
+        """Take a reference to the blob for key, decoding it if nobody holds it yet"""
+        with self.lock:
+            blob = self.blobs.get(key)
+            if blob:
+                blob.refs += 1
+                self.shared_loads += 1
+                return blob
+        sound = decode()
+        with self.lock:
+            blob = self.blobs.get(key)
+            if blob is None:
+                blob = self.blobs[key] = ContentBlob(key, sound)
+                self.decodes += 1
+                sound = None
+            else:
+                # Another thread decoded the same content first
+                self.shared_loads += 1
+            blob.refs += 1
+        if sound is not None:
+            self.free(sound)
+        return blob
+
+    def release(self, blob):
+        """Drop a reference; the sample is freed with the last one"""
+        with self.lock:
+            blob.refs -= 1
+            if blob.refs > 0 or self.blobs.get(blob.key) is not blob:
+                return
+            del self.blobs[blob.key]
+        self.free(blob.sound)
+
+    def free(self, sound):
+        """Free a sample held outside this process (engine process handles)"""
+        release = getattr(sound, 'release', None)
+        if release:
+            release()
+
+    def get_status(self):
+        with self.lock:
+            blobs = list(self.blobs.values())
+            refs = sum(blob.refs for blob in blobs)
+            unique_bytes = sum(blob.size_bytes for blob in blobs)
+            return {
+                'enabled': self.dedup,
+                'unique_samples': len(blobs),
+                'references': refs,
+                'dedup_ratio': round(refs / len(blobs), 2) if blobs else None,
+                'unique_bytes': unique_bytes,
+                'bytes_saved': sum(blob.size_bytes * (blob.refs - 1) for blob in blobs),
+                'decodes': self.decodes,
+                'shared_loads': self.shared_loads,
+                'hash_ms_total': round(self.hash_seconds * 1000, 1)
+            }
+
+class CachedSample:
+    """A path's reference to a shared decoded sample and the file state it was loaded from"""
+
+    def __init__(self, path, blob, mtime, load_ms):
+        self.path = path
+        self.blob = blob
+        self.sound = blob.sound
+        self.mtime = mtime
+        self.load_ms = load_ms
+        self.size_bytes = blob.size_bytes
+        self.loaded_at = time.time()
+
+class SampleCache:
+    def __init__(self, loader, max_bytes=SAMPLE_CACHE_MAX_MB * 1024 * 1024, content=None):
+        """loader decodes a path into a playable sample; max_bytes of 0 disables eviction
+
+        Caches that pass the same content index share decoded samples.
+        """
+        self.loader = loader
+        self.content = content or ContentIndex()
+        self.executor = None
+        self.samples = OrderedDict()
+        self.pinned = set()
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.memory_bytes = 0
+        self.blob_refs = {}  # Paths in this cache using each blob
+        self.loads = 0
+        self.load_errors = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path):
+        """Get the preloaded sound for a path, or None if it is not cached"""
+        entry = self.samples.get(path)
+        return entry.sound if entry else None
+
+    def lookup(self, path):
+        """Get a sound for playback, counting the hit or miss and refreshing its LRU position"""
+        with self.lock:
+            entry = self.samples.get(path)
+            if entry:
+                self.samples.move_to_end(path)
+                self.hits += 1
+                return entry.sound
+            self.misses += 1
+            return None
+
+    def is_current(self, path):
+        """Check if a path is cached and unchanged on disk"""
+        entry = self.samples.get(path)
+        if not entry:
+            return False
+        try:
+            return os.stat(path).st_mtime == entry.mtime
+        except OSError:
+            return False
+
+    def load(self, path):
+        """Decode a file into the cache and return its sound"""
+        try:
+            stat = os.stat(path)
+            start = time.perf_counter()
+            blob = self.content.acquire(self.content.key(path, stat), lambda: self.loader(path))
+            load_ms = (time.perf_counter() - start) * 1000
+            entry = CachedSample(path, blob, stat.st_mtime, load_ms)
+            with self.lock:
+                previous = self.samples.pop(path, None)
+                dropped = [previous] if previous else []
+                if previous:
+                    self.drop(previous)
+                self.samples[path] = entry
+                count = self.blob_refs.get(blob, 0)
+                if count == 0:
+                    self.memory_bytes += blob.size_bytes
+                self.blob_refs[blob] = count + 1
+                self.loads += 1
+                dropped += self.evict(keep=path)
+            self.release(dropped)
+            logger.debug(f"Cached sample {path} in {load_ms:.1f}ms")
+            return entry.sound
+        except Exception as e:
+            with self.lock:
+                self.load_errors += 1
+            logger.error(f"Failed to load sample {path}: {e}")
+            return None
+
+    def pin(self, paths):
+        """Mark paths as preloaded so eviction never drops them"""
+        with self.lock:
+            self.pinned = set(paths)
+
+    def evict(self, keep=None):
+        """Drop least recently used unpinned samples until the cache fits its budget
+
+        Must be called with the lock held. Returns the evicted entries, to be
+        passed to release() once the lock is released.
+        """
+        evicted = []
+        if not self.max_bytes or self.memory_bytes <= self.max_bytes:
+            return evicted
+        for path in list(self.samples):
+            if self.memory_bytes <= self.max_bytes:
+                break
+            if path == keep or path in self.pinned:
+                continue
+            entry = self.samples.pop(path)
+            self.drop(entry)
+            evicted.append(entry)
+            self.evictions += 1
+            logger.debug(f"Evicted sample {path}")
+        return evicted
+
+    def drop(self, entry):
+        """Remove an entry from this cache's memory accounting
+
+        Must be called with the lock held.
+        """
+        count = self.blob_refs.pop(entry.blob) - 1
+        if count:
+            self.blob_refs[entry.blob] = count
+        else:
+            self.memory_bytes -= entry.blob.size_bytes
+
+    def release(self, entries):
+        """Drop entries' references to their shared samples
+
+        Must be called without the lock: freeing an engine-process sample
+        waits on the engine, which would stall every lookup.
+        """
+        for entry in entries:
+            self.content.release(entry.blob)
+
+    def preload(self, paths, on_complete=None):
+        """Load paths in the background, then call on_complete
+
+        Runs on self.executor when one is set (asyncio runtime), otherwise on
+        a dedicated thread. Returns a Future that completes after on_complete.
+        """
+        def preload_job():
+            start = time.perf_counter()
+            for path in paths:
+                self.load(path)
+            if paths:
+                logger.info(f"Preloaded {len(paths)} samples in {(time.perf_counter() - start) * 1000:.0f}ms")
+            if on_complete:
+                on_complete()
+
+        if self.executor:
+            return self.executor.submit(preload_job)
+
+        future = Future()
+        def preload_thread():
+            try:
+                preload_job()
+                future.set_result(None)
+            except Exception as e:
+                logger.error(f"Preload failed: {e}")
+                future.set_exception(e)
+
+        threading.Thread(target=preload_thread, daemon=True).start()
+        return future
+
+    def unload(self, path):
+        """Drop a sample from the cache"""
+        with self.lock:
+            entry = self.samples.pop(path, None)
+            if entry:
+                self.drop(entry)
+        if entry:
+            self.release([entry])
+            logger.debug(f"Unloaded sample {path}")
+
+    def retain(self, paths):
+        """Drop every cached sample that is not in paths"""
+        keep = set(paths)
+        for path in [path for path in list(self.samples) if path not in keep]:
+            self.unload(path)
+
+    def get_status(self):
+        """Get sample cache statistics"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'samples': len(self.samples),
+                'unique_samples': len(self.blob_refs),
+                'pinned': len(self.pinned),
+                'memory_bytes': self.memory_bytes,
+                'max_bytes': self.max_bytes,
+                'loads': self.loads,
+                'load_errors': self.load_errors,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+                'dedup': self.content.get_status()
+            }
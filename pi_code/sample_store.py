@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Compressed Sample Store for Raspberry Pi Audio Server
+Keeps samples for the software mixer as IMA-ADPCM in RAM, with only a short
+head decoded up front; the rest is decoded chunk by chunk into pooled buffers
+while the voice plays
+"""
+
+import time
+import weakref
+import argparse
+import threading
+import logging
+import numpy as np
+from config import *
+
+logger = logging.getLogger(__name__)
+
+# IMA-ADPCM tables
+STEP_TABLE = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767
+], dtype=np.int32)
+INDEX_TABLE = np.array([-1, -1, -1, -1, 2, 4, 6, 8] * 2, dtype=np.int32)
+
+def magnitude_diff(step, magnitude):
+    """Predictor change the decoder applies for a 3-bit code magnitude"""
+    return (step >> 3) + np.where(magnitude & 4, step, 0) + np.where(magnitude & 2, step >> 1, 0) + \
+        np.where(magnitude & 1, step >> 2, 0)
+
+VPDIFF_TABLE = magnitude_diff(STEP_TABLE[:, None], np.arange(8)[None, :])
+
+def saturating_cumsum(deltas, start, low, high):
+    """Running x = clip(x + delta, low, high) along the last axis, without a Python loop
+
+    Each step is the function clip(x + a, lo, hi), and a chain of them is
+    again of that form, so the chain is combined with a log2(n)-step scan.
+    """
+    offset = deltas.astype(np.int32)
+    lo = np.full(offset.shape, low, dtype=np.int32)
+    hi = np.full(offset.shape, high, dtype=np.int32)
+    shift = 1
+    while shift < offset.shape[-1]:
+        later_offset, later_lo, later_hi = offset[..., shift:], lo[..., shift:], hi[..., shift:]
+        combined_lo = np.clip(lo[..., :-shift] + later_offset, later_lo, later_hi)
+        combined_hi = np.clip(hi[..., :-shift] + later_offset, later_lo, later_hi)
+        combined_offset = offset[..., :-shift] + later_offset
+        offset[..., shift:] = combined_offset
+        lo[..., shift:] = combined_lo
+        hi[..., shift:] = combined_hi
+        shift *= 2
+    return np.clip(np.asarray(start, dtype=np.int32)[..., None] + offset, lo, hi)
+
+def adpcm_encode(pcm):
+    """Encode int16 lanes of shape (lanes, frames) as IMA-ADPCM
+
+    Every lane starts from its own predictor and step index, so lanes (chunks
+    and channels) encode side by side and decode independently. Returns the
+    start predictors, start indices and codes packed two per byte.
+    """
+    pcm = pcm.astype(np.int32)
+    lanes, frames = pcm.shape
+    if not lanes:
+        empty = np.zeros(0, dtype=np.uint8)
+        return empty.astype(np.int16), empty, np.zeros((0, (frames + 1) // 2), dtype=np.uint8)
+    predictor = pcm[:, 0].copy()
+    # Start near the lane's initial slope so the coder doesn't spend samples adapting
+    slope = np.abs(np.diff(pcm[:, :9], axis=1)).mean(axis=1) if frames > 1 else np.zeros(lanes)
+    index = np.clip(np.searchsorted(STEP_TABLE, slope), 0, 88).astype(np.int32)
+    start_predictor, start_index = predictor.astype(np.int16), index.astype(np.uint8)
+    codes = np.empty((lanes, frames), dtype=np.uint8)
+    for frame in range(frames):
+        step = STEP_TABLE[index]
+        diff = pcm[:, frame] - predictor
+        negative = diff < 0
+        magnitude = np.minimum(np.abs(diff) * 4 // step, 7)
+        vpdiff = VPDIFF_TABLE[index, magnitude]
+        predictor = np.clip(predictor + np.where(negative, -vpdiff, vpdiff), -32768, 32767)
+        index = np.clip(index + INDEX_TABLE[magnitude], 0, 88)
+        codes[:, frame] = magnitude | (negative << 3)
+    if frames % 2:
+        codes = np.concatenate([codes, np.zeros((lanes, 1), dtype=np.uint8)], axis=1)
+    return start_predictor, start_index, (codes[:, 0::2] << 4) | codes[:, 1::2]
+
+def adpcm_decode(start_predictor, start_index, packed, frames):
+    """Decode lanes encoded by adpcm_encode into int32 samples of shape (lanes, frames)"""
+    codes = np.empty((packed.shape[0], packed.shape[1] * 2), dtype=np.int32)
+    codes[:, 0::2] = packed >> 4
+    codes[:, 1::2] = packed & 0x0F
+    codes = codes[:, :frames]
+    # The step index depends only on the codes, and each sample uses the index left by the one before
+    index = saturating_cumsum(INDEX_TABLE[codes], start_index, 0, 88)
+    step = STEP_TABLE[np.concatenate([np.asarray(start_index, dtype=np.int32)[:, None], index[:, :-1]], axis=1)]
+    vpdiff = magnitude_diff(step, codes & 7)
+    return saturating_cumsum(np.where(codes & 8, -vpdiff, vpdiff), start_predictor, -32768, 32767)
+
+class BufferPool:
+    """Reusable float32 chunk buffers, so playback does not allocate"""
+
+    def __init__(self, frames, channels=CHANNELS, size=SAMPLE_STORE_POOL_BUFFERS):
+        self.frames = frames
+        self.channels = channels
+        self.size = size
+        self.free = [np.zeros((frames, channels), dtype=np.float32) for _ in range(size)]
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.allocations = 0
+
+    def acquire(self):
+        with self.lock:
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            if self.free:
+                return self.free.pop()
+            self.allocations += 1
+        return np.zeros((self.frames, self.channels), dtype=np.float32)
+
+    def release(self, buffer):
+        with self.lock:
+            self.in_use -= 1
+            # Buffers allocated past the pool size are left to the garbage collector
+            if len(self.free) < self.size:
+                self.free.append(buffer)
+
+    def get_status(self):
+        with self.lock:
+            return {
+                'size': self.size,
+                'free': len(self.free),
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'allocations': self.allocations,
+                'bytes': (self.size + self.allocations) * self.frames * self.channels * 4
+            }
+
+class CompressedSample:
+    """A sample held as per-chunk, per-channel IMA-ADPCM plus a decoded head"""
+
+    def __init__(self, store, path, data):
+        self.store = store
+        self.path = path
+        self.frames = len(data)
+        self.channels = data.shape[1]
+        self.sample_rate = SAMPLE_RATE
+        self.chunk_frames = store.chunk_frames
+        self.head_frames = min(self.frames, store.head_frames)
+        self.head = data[:self.head_frames].copy()
+        pcm = (np.clip(data[self.head_frames:], -1.0, 1.0) * 32767).astype(np.int16)
+        chunks = -(-len(pcm) // self.chunk_frames)
+        # Pad the last chunk by holding its final value, then code every
+        # (chunk, channel) lane at once; each chunk decodes on its own
+        padded = np.pad(pcm, ((0, chunks * self.chunk_frames - len(pcm)), (0, 0)), mode='edge') if chunks else \
+            np.zeros((0, self.channels), dtype=np.int16)
+        lanes = padded.reshape(chunks, self.chunk_frames, self.channels).transpose(0, 2, 1)
+        predictors, indices, codes = adpcm_encode(lanes.reshape(chunks * self.channels, self.chunk_frames))
+        self.predictors = predictors.reshape(chunks, self.channels)
+        self.indices = indices.reshape(chunks, self.channels)
+        self.codes = codes.reshape(chunks, self.channels, self.chunk_frames // 2)
+        self.chunk_count = chunks
+        self.compressed_bytes = self.codes.nbytes + self.predictors.nbytes + self.indices.nbytes
+        self.size_bytes = self.compressed_bytes + self.head.nbytes
+
+    def get_length(self):
+        return self.frames / self.sample_rate
+
+    def decode_chunk(self, index, buffer):
+        """Decode one chunk into a pool buffer; returns the number of frames"""
+        start = time.perf_counter()
+        frames = min(self.chunk_frames, self.frames - self.head_frames - index * self.chunk_frames)
+        pcm = adpcm_decode(self.predictors[index], self.indices[index], self.codes[index], frames)
+        buffer[:frames] = pcm.T
+        buffer[:frames] *= 1 / 32768
+        self.store.record_decode(time.perf_counter() - start)
+        return frames
+
+    def make_voice(self, gain=1.0):
+        return CompressedVoice(self, gain)
+
+class CompressedVoice:
+    """Plays a CompressedSample, holding at most one decoded chunk at a time"""
+
+    def __init__(self, sample, gain=1.0):
+        self.sample = sample
+        self.frames = sample.frames
+        self.position = 0
+        self.gain = gain
+        self.fade_block = None
+        self.faded = False
+        self.chunk_index = None
+        self.buffer = None
+        self.chunk = None
+
+    @property
+    def done(self):
+        return self.faded or self.position >= self.frames
+
+    def segment(self):
+        """The decoded array holding the current position and the offset into it"""
+        sample = self.sample
+        if self.position < sample.head_frames:
+            return sample.head, self.position
+        index, offset = divmod(self.position - sample.head_frames, sample.chunk_frames)
+        if index != self.chunk_index:
+            if self.buffer is None:
+                self.buffer = sample.store.pool.acquire()
+            frames = sample.decode_chunk(index, self.buffer)
+            self.chunk = self.buffer[:frames]
+            self.chunk_index = index
+        return self.chunk, offset
+
+    def read(self, frames):
+        first = self.position == 0
+        start = time.perf_counter() if first else 0.0
+        parts = []
+        while frames > 0 and self.position < self.frames:
+            array, offset = self.segment()
+            part = array[offset:offset + frames]
+            self.position += len(part)
+            frames -= len(part)
+            if frames > 0 and self.position < self.frames:
+                part = part.copy()  # The buffer is about to be refilled with the next chunk
+            parts.append(part)
+        if first:
+            self.sample.store.record_first_read(time.perf_counter() - start)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else self.sample.head[:0]
+
+    def close(self):
+        """Return the chunk buffer to the pool"""
+        if self.buffer is not None:
+            self.sample.store.pool.release(self.buffer)
+            self.buffer = None
+            self.chunk_index = None
+
+class SampleStore:
+    """Encodes samples for the software mixer and reports the memory they save"""
+
+    def __init__(self, head_ms=SAMPLE_STORE_HEAD_MS, chunk_frames=SAMPLE_STORE_CHUNK_FRAMES,
+                 block_size=MIXER_BLOCK_SIZE):
+        # Whole mixer blocks per chunk and whole chunks in the head keep reads
+        # from straddling two buffers
+        self.chunk_frames = max(1, -(-chunk_frames // block_size)) * block_size
+        head_frames = int(SAMPLE_RATE * head_ms / 1000)
+        self.head_frames = -(-head_frames // self.chunk_frames) * self.chunk_frames
+        self.head_ms = head_ms
+        self.pool = BufferPool(self.chunk_frames)
+        self.samples = weakref.WeakSet()
+        self.lock = threading.Lock()
+        self.decodes = 0
+        self.decode_seconds = 0.0
+        self.decode_max = 0.0
+        self.first_reads = 0
+        self.first_read_seconds = 0.0
+        self.encode_seconds = 0.0
+
+    def encode(self, path, data):
+        """Compress a decoded float32 (frames, channels) array"""
+        start = time.perf_counter()
+        sample = CompressedSample(self, path, data)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.samples.add(sample)
+            self.encode_seconds += elapsed
+        logger.debug(f"Compressed {path}: {data.nbytes} -> {sample.size_bytes} bytes in {elapsed * 1000:.1f}ms")
+        return sample
+
+    def record_decode(self, seconds):
+        with self.lock:
+            self.decodes += 1
+            self.decode_seconds += seconds
+            self.decode_max = max(self.decode_max, seconds)
+
+    def record_first_read(self, seconds):
+        with self.lock:
+            self.first_reads += 1
+            self.first_read_seconds += seconds
+
+    def get_status(self):
+        with self.lock:
+            samples = list(self.samples)
+            compressed = sum(sample.compressed_bytes for sample in samples)
+            head = sum(sample.head.nbytes for sample in samples)
+            pcm = sum(sample.frames * sample.channels * 4 for sample in samples)
+            return {
+                'mode': 'adpcm',
+                'samples': len(samples),
+                'head_ms': self.head_ms,
+                'chunk_frames': self.chunk_frames,
+                'compressed_bytes': compressed,
+                'head_bytes': head,
+                'decoded_bytes_equivalent': pcm,
+                'compression_ratio': round(pcm / (compressed + head), 2) if compressed + head else None,
+                'encode_ms_total': round(self.encode_seconds * 1000, 1),
+                'decodes': self.decodes,
+                'decode_us_mean': round(self.decode_seconds / self.decodes * 1e6, 1) if self.decodes else 0.0,
+                'decode_us_max': round(self.decode_max * 1e6, 1),
+                'first_read_us_mean': round(self.first_read_seconds / self.first_reads * 1e6, 1) if self.first_reads else 0.0,
+                'pool': self.pool.get_status()
+            }
+
+def main():
+    """Compare memory and start cost of decoded and compressed samples"""
+    from mixer import decode_file
+
+    parser = argparse.ArgumentParser(description="Sample store memory/latency report")
+    parser.add_argument("files", nargs="+", help="audio files to encode")
+    parser.add_argument("--head-ms", type=float, nargs="+", default=[0, 50, 100, 250, 500])
+    args = parser.parse_args()
+
+    decoded = [(path, decode_file(path)) for path in args.files]
+    pcm_bytes = sum(data.nbytes for _, data in decoded)
+    print(f"decoded float32: {pcm_bytes} bytes")
+    for head_ms in args.head_ms:
+        store = SampleStore(head_ms=head_ms)
+        samples = [store.encode(path, data) for path, data in decoded]
+        for sample in samples:
+            voice = sample.make_voice()
+            while not voice.done:
+                voice.read(MIXER_BLOCK_SIZE)
+            voice.close()
+        status = store.get_status()
+        print(f"head {head_ms:g}ms: {status['compressed_bytes'] + status['head_bytes']} bytes "
+              f"(x{status['compression_ratio']}), first read {status['first_read_us_mean']}us, "
+              f"chunk decode {status['decode_us_mean']}us mean / {status['decode_us_max']}us max")
+
+if __name__ == "__main__":
+    main()
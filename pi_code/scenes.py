@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Scene Manager for Raspberry Pi Audio Server
+Preloads whole sound sets in the background and switches between them atomically
+"""
+
+import os
+import time
+import threading
+import logging
+from config import *
+from sample_cache import SampleCache
+from routing import Router
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCENE = "default"
+
+class Scene:
+    """A named mapping with its own sample cache and router"""
+
+    def __init__(self, name, path, router, sample_cache):
+        self.name = name
+        self.path = path
+        self.router = router
+        self.sample_cache = sample_cache
+        self.state = "idle"
+        self.prepare_ms = None
+        self.prepare_future = None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'state': self.state,
+            'prepare_ms': self.prepare_ms,
+            'routes': len(self.router.table.routes),
+            'memory_bytes': self.sample_cache.get_status()['memory_bytes']
+        }
+
+def get_available_memory():
+    """Get MemAvailable from /proc/meminfo in bytes, or None if unknown"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+class SceneManager:
+    def __init__(self, default_router, default_cache, usb_manager=None, active_sounds=None,
+                 event_callback=None, scenes_dir=SCENES_DIR):
+        """active_sounds is a callable returning the sounds currently playing"""
+        self.default_cache = default_cache
+        self.usb_manager = usb_manager
+        self.active_sounds = active_sounds or (lambda: set())
+        self.event_callback = event_callback
+        self.scenes_dir = scenes_dir
+        self.lock = threading.Lock()
+        self.scenes = {}
+        self.switches = 0
+        self.last_switch_us = None
+
+        default = Scene(DEFAULT_SCENE, AUDIO_DIR, default_router, default_cache)
+        default.state = "active"
+        self.scenes[DEFAULT_SCENE] = default
+        self.active = default
+
+    def list_scenes(self):
+        """List scene names available on disk plus the default scene"""
+        names = [DEFAULT_SCENE]
+        if os.path.isdir(self.scenes_dir):
+            for name in sorted(os.listdir(self.scenes_dir)):
+                if os.path.exists(os.path.join(self.scenes_dir, name, SCENE_MAPPING_FILE)):
+                    names.append(name)
+        return names
+
+    def get_scene(self, name):
+        """Get or create the Scene object for a name"""
+        with self.lock:
+            scene = self.scenes.get(name)
+            if scene:
+                return scene
+            if name not in self.list_scenes():
+                raise KeyError(f"Unknown scene: {name}")
+            path = os.path.join(self.scenes_dir, name)
+            sample_cache = SampleCache(self.default_cache.loader, content=self.default_cache.content)
+            sample_cache.executor = self.default_cache.executor
+            router = Router(
+                sample_cache,
+                self.usb_manager,
+                mapping_file=os.path.join(path, SCENE_MAPPING_FILE),
+                event_callback=self.event_callback,
+                audio_dirs=(path, AUDIO_DIR)
+            )
+            scene = Scene(name, path, router, sample_cache)
+            self.scenes[name] = scene
+            return scene
+
+    def estimate_scene_bytes(self, scene):
+        """Estimate decoded size of a scene from its file sizes"""
+        total = 0
+        for audio_file in scene.router.table.audio_files():
+            path = scene.router.locate(audio_file)
+            if path:
+                total += os.path.getsize(path)
+        return total
+
+    def make_room(self, needed_bytes):
+        """Unload idle prepared scenes if the next scene would not fit in memory"""
+        available = get_available_memory()
+        if available is None or available - needed_bytes >= SCENE_MIN_FREE_MB * 1024 * 1024:
+            return
+        for scene in list(self.scenes.values()):
+            if scene.state == "ready":
+                logger.warning(f"Low memory: unloading prepared scene {scene.name}")
+                self.unload(scene)
+
+    def prepare(self, name, wait=False):
+        """Decode and preload a scene in the background while the active scene keeps serving"""
+        scene = self.get_scene(name)
+        if scene.state in ("active", "ready", "preparing"):
+            if wait and scene.prepare_future:
+                scene.prepare_future.result()
+            return scene
+
+        try:
+            scene.router.table = scene.router.compile()
+        except Exception as e:
+            logger.error(f"Failed to load scene {name}: {e}")
+            raise
+
+        self.make_room(self.estimate_scene_bytes(scene))
+        scene.state = "preparing"
+        start = time.perf_counter()
+
+        def on_ready():
+            scene.prepare_ms = round((time.perf_counter() - start) * 1000, 1)
+            if scene.state == "preparing":
+                scene.state = "ready"
+            logger.info(f"Scene {name} prepared in {scene.prepare_ms}ms")
+            if self.event_callback:
+                self.event_callback("scene_prepared", scene=name, prepare_ms=scene.prepare_ms)
+
+        scene.prepare_future = scene.router.activate(scene.router.table, on_active=on_ready)
+        if wait:
+            scene.prepare_future.result()
+        return scene
+
+    def activate(self, name):
+        """Switch to a scene, preparing it first if needed
+
+        Returns the scene and the switch latency in microseconds. Only the
+        reference swap is timed; preloading happens before it.
+        """
+        scene = self.prepare(name, wait=True)
+        if scene.state not in ("ready", "active"):
+            raise RuntimeError(f"Scene {name} is not ready ({scene.state})")
+
+        with self.lock:
+            previous = self.active
+            start = time.perf_counter()
+            self.active = scene
+            switch_us = round((time.perf_counter() - start) * 1e6, 1)
+            scene.state = "active"
+            self.switches += 1
+            self.last_switch_us = switch_us
+
+        if previous is not scene:
+            previous.state = "retiring"
+            self.retire(previous)
+
+        logger.info(f"Switched to scene {name} in {switch_us}us")
+        if self.event_callback:
+            self.event_callback("scene_switched", scene=name, previous=previous.name, switch_us=switch_us)
+        return scene, switch_us
+
+    def retire(self, scene):
+        """Unload a scene's samples once none of them are still playing"""
+        def retire_thread():
+            sounds = {entry.sound for entry in list(scene.sample_cache.samples.values())}
+            while scene.state == "retiring" and sounds & self.active_sounds():
+                time.sleep(SCENE_RETIRE_CHECK_INTERVAL)
+            if scene.state == "retiring":
+                self.unload(scene)
+
+        threading.Thread(target=retire_thread, daemon=True).start()
+
+    def unload(self, scene):
+        """Free a scene's decoded samples"""
+        scene.sample_cache.pin([])
+        scene.sample_cache.retain([])
+        for route in scene.router.table.routes:
+            route.sample = None
+        scene.state = "idle"
+        logger.info(f"Unloaded scene {scene.name}")
+
+    def get_status(self):
+        """Get scene manager status"""
+        return {
+            'active': self.active.name,
+            'available': self.list_scenes(),
+            'loaded': {name: scene.to_dict() for name, scene in self.scenes.items()},
+            'switches': self.switches,
+            'last_switch_us': self.last_switch_us
+        }
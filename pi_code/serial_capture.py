@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Serial Capture and Replay for Raspberry Pi
+Records the raw XIAO receiver byte stream with timestamps and replays it into a
+pseudo-terminal so SerialReader can be tested against real traffic
+"""
+
+import os
+import sys
+import tty
+import time
+import struct
+import argparse
+import threading
+import logging
+from config import *
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"WRBCAP1\n"
+# Seconds since capture start, chunk length
+CHUNK = struct.Struct('<dI')
+
+class SerialCapture:
+    """Append raw serial chunks to a capture file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.stream = open(path, 'wb')
+        self.stream.write(MAGIC)
+        self.started = time.monotonic()
+        self.chunks = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+        logger.info(f"Capturing serial data to {path}")
+
+    def write(self, data):
+        """Record one chunk as received"""
+        if not data:
+            return
+        with self.lock:
+            if self.stream is None:
+                return
+            self.stream.write(CHUNK.pack(time.monotonic() - self.started, len(data)))
+            self.stream.write(data)
+            self.chunks += 1
+            self.bytes += len(data)
+
+    def close(self):
+        with self.lock:
+            if self.stream:
+                self.stream.close()
+                self.stream = None
+        logger.info(f"Serial capture closed: {self.chunks} chunks, {self.bytes} bytes")
+
+def read_capture(path):
+    """Yield (seconds, data) chunks from a capture file"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a serial capture")
+        while True:
+            header = f.read(CHUNK.size)
+            if len(header) < CHUNK.size:
+                return
+            offset, length = CHUNK.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield offset, data
+
+def open_pty():
+    """Create a raw pseudo-terminal; returns (master fd, slave fd, slave path)"""
+    master, slave = os.openpty()
+    # No echo or newline translation, so bytes arrive exactly as captured
+    tty.setraw(slave)
+    return master, slave, os.ttyname(slave)
+
+def replay(path, master, speed=1.0, loops=1):
+    """Write a capture into a pty master, keeping its timing scaled by speed
+
+    speed 0 replays as fast as possible.
+    """
+    chunks = 0
+    total = 0
+    for _ in range(loops):
+        start = time.monotonic()
+        for offset, data in read_capture(path):
+            if speed:
+                delay = start + offset / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            os.write(master, data)
+            chunks += 1
+            total += len(data)
+    return chunks, total
+
+def benchmark(path, speed=0.0, loops=1):
+    """Replay a capture into a SerialReader and report how it kept up"""
+    from serial_reader import SerialReader
+
+    master, slave, slave_path = open_pty()
+    triggers = []
+    reader = SerialReader(port=slave_path, trigger_callback=lambda button_id, is_hold: triggers.append(button_id))
+    lines_handled = [0]
+    handle_line = reader.handle_line
+
+    def counting_handle_line(line, received_at=None):
+        lines_handled[0] += 1
+        handle_line(line, received_at)
+
+    reader.handle_line = counting_handle_line
+    if not reader.start():
+        raise RuntimeError(f"SerialReader could not open {slave_path}")
+
+    expected = sum(data.count(b'\n') for _, data in read_capture(path)) * loops
+    start = time.perf_counter()
+    chunks, total = replay(path, master, speed, loops)
+    # Wait for the reader to drain the pty
+    deadline = time.monotonic() + 10
+    while lines_handled[0] < expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    reader.stop()
+    os.close(master)
+    os.close(slave)
+    return {
+        'chunks': chunks,
+        'bytes': total,
+        'lines': lines_handled[0],
+        'lines_expected': expected,
+        'triggers': len(triggers),
+        'seconds': round(elapsed, 3),
+        'lines_per_second': round(lines_handled[0] / elapsed) if elapsed else None
+    }
+
+def main():
+    """Replay or benchmark a serial capture"""
+    parser = argparse.ArgumentParser(description="Replay a serial capture recorded with SERIAL_CAPTURE_FILE")
+    parser.add_argument("capture", help="capture file")
+    parser.add_argument("--speed", type=float, default=1.0, help="time scale, 2 = twice as fast, 0 = no delays")
+    parser.add_argument("--loop", type=int, default=1, help="number of times to replay")
+    parser.add_argument("--bench", action="store_true", help="feed an in-process SerialReader and report throughput")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.bench:
+        for key, value in benchmark(args.capture, args.speed, args.loop).items():
+            print(f"{key}: {value}")
+        return
+
+    master, slave, slave_path = open_pty()
+    print(f"Replaying on {slave_path} - point SerialReader or the server at this port")
+    input("Press Enter to start...")
+    chunks, total = replay(args.capture, master, args.speed, args.loop)
+    print(f"Replayed {chunks} chunks ({total} bytes)")
+    os.close(master)
+    os.close(slave)
+
+if __name__ == "__main__":
+    main()
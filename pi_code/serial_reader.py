@@ -7,20 +7,41 @@ Reads commands from XIAO receiver via serial connection
 import serial
 import threading
 import time
+import uuid
 import logging
 import requests
 from config import *
+from peer_forwarder import PeerForwarder
+from serial_capture import SerialCapture
+from receiver_telemetry import ReceiverTelemetry
+from tracing import tracer
+from wakeups import wakeups
 
 logger = logging.getLogger(__name__)
 
 class SerialReader:
-    def __init__(self, port='/dev/ttyUSB0', baudrate=115200):
+    def __init__(self, port=SERIAL_PORT, baudrate=115200, event_callback=None, trigger_callback=None):
         self.port = port
         self.baudrate = baudrate
         self.serial_conn = None
         self.running = False
         self.reader_thread = None
         self.pi_server_url = f"http://localhost:{PI_PORT}"
+        self.session = requests.Session()  # Keep-alive connection to the local server
+        self.event_callback = event_callback
+        self.trigger_callback = trigger_callback
+        self.forwarder = PeerForwarder(FORWARD_PEERS, event_callback=event_callback) if FORWARD_PEERS else None
+        self.capture = SerialCapture(SERIAL_CAPTURE_FILE) if SERIAL_CAPTURE_FILE else None
+        self.telemetry = ReceiverTelemetry(event_callback)
+        self.lines_read = 0
+
+    def notify(self, event_type, **data):
+        """Forward a connection state change to the registered event callback"""
+        if self.event_callback:
+            try:
+                self.event_callback(event_type, **data)
+            except Exception as e:
+                logger.error(f"Serial event callback error: {e}")
         
     def connect(self):
         """Connect to serial port"""
@@ -32,11 +53,12 @@ class SerialReader:
                 self.serial_conn = serial.Serial(
                     port=port,
                     baudrate=self.baudrate,
-                    timeout=0.1,  # Match working code timeout
+                    timeout=SERIAL_READ_TIMEOUT,  # None: readline sleeps until a line arrives
                     write_timeout=1
                 )
                 logger.info(f"Connected to serial port: {port}")
                 self.port = port  # Update the port to the working one
+                self.notify("serial_connected", port=port)
                 return True
             except Exception as e:
                 logger.debug(f"Failed to connect to {port}: {e}")
@@ -51,18 +73,28 @@ class SerialReader:
             self.serial_conn.close()
             logger.info("Disconnected from serial port")
             
-    def send_to_pi_server(self, button_id, is_hold):
+    def build_payload(self, button_id, is_hold):
+        """Build the /trigger_audio request body for a button command
+
+        The event_id lets servers recognise a retried delivery of the same
+        press, so build one payload per press and reuse it for every send.
+        """
+        return {
+            "button_id": button_id,
+            "is_hold": is_hold,
+            "source": "xiao_receiver_serial",
+            "event_id": uuid.uuid4().hex
+        }
+        
+    def send_to_pi_server(self, button_id, is_hold, payload=None):
         """Send command to Pi audio server"""
         try:
             url = f"{self.pi_server_url}/trigger_audio"
-            payload = {
-                "button_id": button_id,
-                "is_hold": is_hold,
-                "source": "xiao_receiver_serial"
-            }
+            payload = payload or self.build_payload(button_id, is_hold)
             
-            response = requests.post(url, json=payload, timeout=2)
-            if response.status_code == 200:
+            response = self.session.post(url, json=payload, timeout=2, headers={'X-Trace-Id': tracer.header()})
+            # 202 means the trigger was queued (TRIGGER_FAST_ACK)
+            if response.ok:
                 logger.info(f"Successfully sent to Pi server: Button{button_id} {'HOLD' if is_hold else 'PRESS'}")
                 return True
             else:
@@ -98,13 +130,49 @@ class SerialReader:
                         is_hold = (action_part == "HOLD")
                         return button_id, is_hold
                         
-            logger.warning(f"Unknown command format: {command}")
+            # Not a command; noisy receivers print plenty of these, so only count them
+            logger.debug(f"Unknown command format: {command}")
+            self.telemetry.record_unknown()
             return None, None
             
         except Exception as e:
             logger.error(f"Error parsing command '{command}': {e}")
             return None, None
             
+    def handle_line(self, line, received_at=None):
+        """Parse one line from the receiver and forward any button command
+
+        Status and diagnostic lines are recorded as telemetry instead.
+        Commands go straight to trigger_callback when one is set (in-process
+        runtime), otherwise they are posted to the Pi server over HTTP. Peer
+        servers get a copy through the forwarder first, which never blocks.
+        received_at is the perf_counter time the line was read, for tracing.
+        """
+        line = line.strip()
+        if not line:
+            return
+        self.lines_read += 1
+        if self.telemetry.ingest(line):
+            logger.debug(f"Receiver telemetry: {line}")
+            return
+        with tracer.trace():
+            if received_at is not None:
+                tracer.add_span("serial_read", received_at, time.perf_counter(), line=line)
+            logger.info(f"Received from XIAO: {line}")
+            with tracer.span("parse"):
+                button_id, is_hold = self.parse_command(line)
+            if button_id is None:
+                return
+            payload = self.build_payload(button_id, is_hold)
+            if self.forwarder:
+                with tracer.span("peer_forward"):
+                    self.forwarder.send(payload)
+            if self.trigger_callback:
+                self.trigger_callback(button_id, is_hold)
+            else:
+                with tracer.span("http_post"):
+                    self.send_to_pi_server(button_id, is_hold, payload)
+            
     def reader_loop(self):
         """Main reading loop"""
         logger.info("Serial reader started")
@@ -113,15 +181,14 @@ class SerialReader:
             try:
                 if self.serial_conn and self.serial_conn.is_open:
                     # Read line from serial
-                    line = self.serial_conn.readline().decode('utf-8', errors='ignore')
+                    raw = self.serial_conn.readline()
+                    wakeups.record("serial")
                     
-                    if line:
-                        logger.info(f"Received from XIAO: {line.strip()}")
-                        
-                        # Parse and forward command
-                        button_id, is_hold = self.parse_command(line)
-                        if button_id is not None:
-                            self.send_to_pi_server(button_id, is_hold)
+                    if raw:
+                        received_at = time.perf_counter()
+                        if self.capture:
+                            self.capture.write(raw)
+                        self.handle_line(raw.decode('utf-8', errors='ignore'), received_at)
                 else:
                     # Try to reconnect
                     logger.warning("Serial connection lost, attempting to reconnect...")
@@ -130,6 +197,12 @@ class SerialReader:
                     else:
                         time.sleep(5)  # Wait before retry
                         
+            except serial.SerialException as e:
+                # Device unplugged or port failed - close it so the loop reconnects
+                logger.error(f"Serial connection lost: {e}")
+                self.disconnect()
+                self.notify("serial_lost", port=self.port, error=str(e))
+                time.sleep(1)
             except Exception as e:
                 logger.error(f"Error in serial reader loop: {e}")
                 time.sleep(1)
@@ -154,14 +227,22 @@ class SerialReader:
         
     def stop(self):
         """Stop serial reader"""
-        if not self.running:
-            return
+        if self.running:
+            self.running = False
             
-        self.running = False
-        
-        if self.reader_thread and self.reader_thread.is_alive():
-            self.reader_thread.join(timeout=5)
+            if self.serial_conn and self.serial_conn.is_open:
+                try:
+                    self.serial_conn.cancel_read()  # Release a readline blocked without timeout
+                except Exception as e:
+                    logger.debug(f"Could not cancel serial read: {e}")
+            if self.reader_thread and self.reader_thread.is_alive():
+                self.reader_thread.join(timeout=5)
             
+        # The asyncio runtime reads without the thread but shares these
+        if self.forwarder:
+            self.forwarder.stop()
+        if self.capture:
+            self.capture.close()
         self.disconnect()
         logger.info("Serial reader stopped")
 
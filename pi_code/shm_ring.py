@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Shared Memory Ring Buffer
+Lock-free single-producer/single-consumer message ring between processes
+"""
+
+import zlib
+import struct
+import logging
+from multiprocessing import shared_memory
+
+logger = logging.getLogger(__name__)
+
+# Head and tail sit on separate cache lines so producer and consumer never
+# write the same line. They are 32-bit so stores stay atomic on the Pi Zero's
+# 32-bit ARM core; indices wrap and are compared modulo 2**32.
+INDEX = struct.Struct('<I')
+HEAD_OFFSET = 0
+TAIL_OFFSET = 64
+HEADER_SIZE = 128
+INDEX_MASK = 0xFFFFFFFF
+
+# Each slot starts with one past the index it was written for (so a zeroed,
+# never-written slot can't match), a CRC of the payload and its length.
+# Python has no memory barriers and ARM may make the new head visible to the
+# other process before the slot contents, so the consumer only takes a slot
+# whose stamp and CRC match, re-reading it briefly before leaving it for the
+# next pop.
+SLOT = struct.Struct('<IIH')
+SLOT_RETRIES = 1000
+
+class SharedRing:
+    def __init__(self, shm, slots, slot_size, owner=False):
+        self.shm = shm
+        self.buf = shm.buf
+        self.slots = slots
+        self.slot_size = slot_size
+        self.owner = owner
+        self.max_payload = slot_size - SLOT.size
+
+    @classmethod
+    def create(cls, slots, slot_size):
+        """Create a new ring in a fresh shared memory block"""
+        shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + slots * slot_size)
+        shm.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+        return cls(shm, slots, slot_size, owner=True)
+
+    @classmethod
+    def attach(cls, name, slots, slot_size):
+        """Attach to a ring created by another process"""
+        shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, slots, slot_size)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def push(self, payload):
+        """Append a message; returns False if the ring is full (producer side only)"""
+        if len(payload) > self.max_payload:
+            raise ValueError(f"Message of {len(payload)} bytes exceeds slot size")
+        head = INDEX.unpack_from(self.buf, HEAD_OFFSET)[0]
+        tail = INDEX.unpack_from(self.buf, TAIL_OFFSET)[0]
+        if (head - tail) & INDEX_MASK >= self.slots:
+            return False
+        offset = HEADER_SIZE + (head % self.slots) * self.slot_size
+        self.buf[offset + SLOT.size:offset + SLOT.size + len(payload)] = payload
+        SLOT.pack_into(self.buf, offset, (head + 1) & INDEX_MASK, zlib.crc32(payload), len(payload))
+        # Publish the slot only after its contents are written
+        INDEX.pack_into(self.buf, HEAD_OFFSET, (head + 1) & INDEX_MASK)
+        return True
+
+    def pop(self):
+        """Remove and return the oldest message, or None if empty (consumer side only)"""
+        head = INDEX.unpack_from(self.buf, HEAD_OFFSET)[0]
+        tail = INDEX.unpack_from(self.buf, TAIL_OFFSET)[0]
+        if head == tail:
+            return None
+        offset = HEADER_SIZE + (tail % self.slots) * self.slot_size
+        for _ in range(SLOT_RETRIES):
+            stamp, crc, length = SLOT.unpack_from(self.buf, offset)
+            if stamp == (tail + 1) & INDEX_MASK and length <= self.max_payload:
+                payload = bytes(self.buf[offset + SLOT.size:offset + SLOT.size + length])
+                if zlib.crc32(payload) == crc:
+                    INDEX.pack_into(self.buf, TAIL_OFFSET, (tail + 1) & INDEX_MASK)
+                    return payload
+        logger.debug(f"Shared ring slot {tail} not yet visible")
+        return None
+
+    def depth(self):
+        """Number of messages waiting"""
+        head = INDEX.unpack_from(self.buf, HEAD_OFFSET)[0]
+        tail = INDEX.unpack_from(self.buf, TAIL_OFFSET)[0]
+        return (head - tail) & INDEX_MASK
+
+    def close(self):
+        """Detach from the ring, unlinking it if this process created it"""
+        self.buf = None
+        try:
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+        except Exception as e:
+            logger.debug(f"Error closing shared ring: {e}")
@@ -5,10 +5,10 @@ Handles system status LED indication
 """
 
 import time
-import threading
 import logging
 import RPi.GPIO as GPIO
 from config import *
+from wakeups import timers
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +18,7 @@ class StatusLED:
         self.ready_brightness = STATUS_LED_READY_BRIGHTNESS
         self.blink_duration = STATUS_LED_BLINK_DURATION
         self.is_ready = False
-        self.blink_thread = None
+        self.blink_timer = None
         self.blink_active = False
         
         # Setup GPIO
@@ -71,48 +71,36 @@ class StatusLED:
         except Exception as e:
             logger.error(f"Failed to blink LED: {e}")
             
-    def blink_thread_func(self, count, brightness=None, duration=None):
-        """Thread function for blinking"""
-        if brightness is None:
-            brightness = 100
-        if duration is None:
-            duration = self.blink_duration
-            
-        try:
-            for i in range(count):
-                if not self.blink_active:
-                    break
-                self.set_brightness(brightness)
-                time.sleep(duration)
-                self.set_brightness(0)
-                if i < count - 1:  # Don't sleep after last blink
-                    time.sleep(duration)
-        except Exception as e:
-            logger.error(f"Blink thread error: {e}")
-        finally:
+    def blink_step(self, remaining, brightness, duration):
+        """One edge of a blink sequence on the shared timer thread; odd counts turn the LED on"""
+        if not self.blink_active or remaining <= 0:
             self.blink_active = False
+            self.blink_timer = None
             # Return to ready state if system is ready
             if self.is_ready:
                 self.turn_on()
+            else:
+                self.turn_off()
+            return
+        self.set_brightness(brightness if remaining % 2 else 0)
+        self.blink_timer = timers.call_later(duration, self.blink_step, remaining - 1, brightness, duration)
                 
     def start_blink(self, count=1, brightness=None, duration=None):
-        """Start blinking in background thread"""
+        """Start blinking; each edge is a timer, so no thread sleeps between them"""
         if self.blink_active:
             return  # Already blinking
             
         self.blink_active = True
-        self.blink_thread = threading.Thread(
-            target=self.blink_thread_func,
-            args=(count, brightness, duration),
-            daemon=True
-        )
-        self.blink_thread.start()
+        self.blink_step(count * 2 - 1,
+                        100 if brightness is None else brightness,
+                        self.blink_duration if duration is None else duration)
         
     def stop_blink(self):
         """Stop current blinking"""
         self.blink_active = False
-        if self.blink_thread and self.blink_thread.is_alive():
-            self.blink_thread.join(timeout=1)
+        if self.blink_timer:
+            self.blink_timer.cancel()
+            self.blink_timer = None
             
     def set_ready_state(self, ready=True):
         """Set system ready state"""
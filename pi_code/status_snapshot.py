@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Status Snapshot for Raspberry Pi Audio Server
+Keeps a pre-serialized /status document that is only rebuilt when state changes
+"""
+
+import json
+import threading
+import zlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Snapshot:
+    """Immutable status document with its serialized body and ETag"""
+
+    def __init__(self, version, data):
+        self.version = version
+        self.data = data
+        self.body = json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        self.etag = f"{version}-{zlib.crc32(self.body):08x}"
+
+class StatusSnapshot:
+    def __init__(self, builder):
+        """builder is a callable returning the current status dict"""
+        self.builder = builder
+        self.lock = threading.Lock()
+        self.version = 0
+        self.rebuilds = 0
+        self.current = None
+        self.refresh()
+
+    def refresh(self):
+        """Rebuild the snapshot from live state and swap it in
+
+        Readers only ever dereference self.current, so the swap is atomic
+        from their point of view and polling never takes the lock.
+        """
+        with self.lock:
+            data = self.builder()
+            if self.current is not None and data == self.current.data:
+                return self.current
+            self.version += 1
+            self.rebuilds += 1
+            self.current = Snapshot(self.version, data)
+            logger.debug(f"Status snapshot rebuilt (version {self.version})")
+            return self.current
+
+    def get(self):
+        """Get the current snapshot without rebuilding"""
+        return self.current
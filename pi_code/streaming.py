@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Streaming Voices for Raspberry Pi Audio Server
+Plays long WAV files through the software mixer in fixed-size chunks, read
+ahead by a prefetch thread into two buffers per voice, so hold sounds and
+ambience beds cost the same memory whatever their length
+"""
+
+import time
+import wave
+import threading
+import logging
+from collections import deque
+import numpy as np
+from config import *
+from wakeups import wakeups
+
+logger = logging.getLogger(__name__)
+
+class StreamingSample:
+    """A long file kept on disk, with only its first chunk decoded in RAM"""
+
+    def __init__(self, streamer, path, frames, head):
+        self.streamer = streamer
+        self.path = path
+        self.frames = frames
+        self.head = head
+        self.sample_rate = SAMPLE_RATE
+        # What a playing voice holds: the head plus its two chunk buffers
+        self.size_bytes = head.nbytes * 3
+
+    def get_length(self):
+        return self.frames / self.sample_rate
+
+    def make_voice(self, gain=1.0):
+        return self.streamer.open_voice(self, gain)
+
+class StreamingVoice:
+    """Reads chunks that the prefetch thread filled; never touches the disk itself"""
+
+    def __init__(self, sample, streamer, gain=1.0):
+        self.sample = sample
+        self.streamer = streamer
+        self.frames = sample.frames
+        self.position = 0
+        self.gain = gain
+        self.fade_block = None
+        self.faded = False
+        self.closed = False
+        chunk_shape = (streamer.chunk_frames, sample.head.shape[1])
+        self.free = deque(np.zeros(chunk_shape, dtype=np.float32) for _ in range(2))
+        self.filled = deque()
+        self.current = sample.head
+        self.current_buffer = None
+        self.offset = 0
+        self.file_position = len(sample.head)  # Next frame the prefetcher reads
+        self.reader = None
+        self.underruns = 0
+
+    @property
+    def done(self):
+        return self.faded or self.position >= self.frames
+
+    def read(self, frames):
+        """Next frames from the prefetched chunks; short on an underrun"""
+        parts = []
+        while frames > 0 and self.position < self.frames:
+            if self.offset >= len(self.current):
+                if not self.filled:
+                    # The prefetcher fell behind: play silence rather than wait
+                    self.underruns += 1
+                    self.streamer.record_underrun()
+                    break
+                if self.current_buffer is not None:
+                    self.free.append(self.current_buffer)
+                self.current_buffer, self.current = self.filled.popleft()
+                self.offset = 0
+                self.streamer.wake()
+            part = self.current[self.offset:self.offset + frames]
+            self.offset += len(part)
+            self.position += len(part)
+            frames -= len(part)
+            if frames > 0:
+                part = part.copy()  # The buffer goes back to the prefetcher before this block is mixed
+            parts.append(part)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else self.sample.head[:0]
+
+    def close(self):
+        self.closed = True
+        self.streamer.wake()
+
+class Streamer:
+    """Opens streaming samples and runs the prefetch thread for their voices"""
+
+    def __init__(self, chunk_frames=STREAM_CHUNK_FRAMES, block_size=MIXER_BLOCK_SIZE):
+        # Whole mixer blocks per chunk keep reads from straddling two buffers
+        self.chunk_frames = max(1, -(-chunk_frames // block_size)) * block_size
+        self.voices = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+        self.streams_opened = 0
+        self.chunks_read = 0
+        self.read_seconds = 0.0
+        self.read_max = 0.0
+        self.underruns = 0
+
+    def open(self, path):
+        """Return a StreamingSample for a file worth streaming, otherwise None
+
+        Only WAV files at the mixer's sample rate are streamed; anything that
+        needs resampling is decoded whole.
+        """
+        from mixer import pcm_to_float, conform
+
+        if not path.lower().endswith('.wav'):
+            return None
+        with wave.open(path, 'rb') as f:
+            frames = f.getnframes()
+            if f.getframerate() != SAMPLE_RATE or frames < STREAM_MIN_SECONDS * SAMPLE_RATE:
+                return None
+            data = pcm_to_float(f.readframes(self.chunk_frames), f.getsampwidth(), f.getnchannels())
+        return StreamingSample(self, path, frames, conform(data, SAMPLE_RATE))
+
+    def open_voice(self, sample, gain):
+        voice = StreamingVoice(sample, self, gain)
+        with self.lock:
+            self.voices.append(voice)
+            self.streams_opened += 1
+        self.wake()
+        return voice
+
+    def wake(self):
+        self.wakeup.set()
+
+    def record_underrun(self):
+        self.underruns += 1
+
+    def fill(self, voice):
+        """Read chunks into a voice's free buffers"""
+        from mixer import pcm_to_float, conform
+
+        while voice.free and voice.file_position < voice.frames and not voice.closed:
+            start = time.perf_counter()
+            if voice.reader is None:
+                voice.reader = wave.open(voice.sample.path, 'rb')
+                voice.reader.setpos(voice.file_position)
+            raw = voice.reader.readframes(self.chunk_frames)
+            data = conform(pcm_to_float(raw, voice.reader.getsampwidth(), voice.reader.getnchannels()), SAMPLE_RATE)
+            if not len(data):
+                # File shorter than its header claimed
+                voice.frames = voice.file_position
+                break
+            buffer = voice.free.popleft()
+            buffer[:len(data)] = data
+            voice.filled.append((buffer, buffer[:len(data)]))
+            voice.file_position += len(data)
+            elapsed = time.perf_counter() - start
+            self.chunks_read += 1
+            self.read_seconds += elapsed
+            self.read_max = max(self.read_max, elapsed)
+
+    def prefetch_loop(self):
+        while self.running:
+            self.wakeup.wait()  # Voices wake the prefetcher as they consume chunks
+            self.wakeup.clear()
+            wakeups.record("stream_prefetch")
+            with self.lock:
+                voices = list(self.voices)
+            for voice in voices:
+                try:
+                    if not voice.closed and not voice.done:
+                        self.fill(voice)
+                except Exception as e:
+                    logger.error(f"Failed to read stream {voice.sample.path}: {e}")
+                    voice.frames = voice.position  # End the voice instead of underrunning forever
+                if voice.closed or voice.done:
+                    if voice.reader:
+                        voice.reader.close()
+                        voice.reader = None
+                    with self.lock:
+                        if voice in self.voices:
+                            self.voices.remove(voice)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.prefetch_loop, name="stream-prefetch", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake()
+        if self.thread:
+            self.thread.join(timeout=2)
+
+    def get_status(self):
+        with self.lock:
+            active = len(self.voices)
+        return {
+            'chunk_frames': self.chunk_frames,
+            'min_seconds': STREAM_MIN_SECONDS,
+            'active_streams': active,
+            'streams_opened': self.streams_opened,
+            'bytes_per_stream': self.chunk_frames * CHANNELS * 4 * 3,
+            'chunks_read': self.chunks_read,
+            'read_ms_mean': round(self.read_seconds / self.chunks_read * 1000, 2) if self.chunks_read else 0.0,
+            'read_ms_max': round(self.read_max * 1000, 2),
+            'underruns': self.underruns
+        }
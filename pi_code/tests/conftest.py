@@ -0,0 +1,9 @@
+"""
+Test setup for the Raspberry Pi Audio Server
+The server modules import each other as top-level modules from pi_code/
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
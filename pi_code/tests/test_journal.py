@@ -0,0 +1,57 @@
+"""Tests for the trigger journal's id parsing and record encoding"""
+
+import numpy as np
+import pytest
+from journal import RECORD, RECORD_DTYPE, EVENT_CODES, OTHER_NAME, parse_id, StringTable, TriggerJournal
+
+@pytest.mark.parametrize("value, expected", [
+    (7, 7), ("12", 12), (0xFFFF, 0xFFFF), (0x10000, 0), (-1, 0), ("abc", 0), (None, 0), (3.0, 3),
+])
+def test_parse_id(value, expected):
+    assert parse_id(value) == expected
+
+def test_record_struct_matches_dtype():
+    assert RECORD.size == RECORD_DTYPE.itemsize
+    packed = RECORD.pack(1700000000.5, 3, 0xFFFF, 2, 1, EVENT_CODES["hold"], 200, 1.25)
+    record = np.frombuffer(packed, dtype=RECORD_DTYPE)[0]
+    assert record['timestamp'] == 1700000000.5
+    assert record['file'] == 3
+    assert record['transmitter'] == 0xFFFF
+    assert record['button'] == 2
+    assert record['source'] == 1
+    assert record['event'] == EVENT_CODES["hold"]
+    assert record['status'] == 200
+    assert record['latency_ms'] == pytest.approx(1.25)
+
+def test_string_table_overflow_and_persistence(tmp_path):
+    path = tmp_path / "names.json"
+    names = StringTable(str(path), capacity=3)
+    assert names.intern("") == 0
+    assert names.intern("serial") == 1
+    assert names.intern("http") == 2
+    assert names.intern("cluster") == 3
+    assert names.overflows == 1
+    assert names.name(3) == OTHER_NAME
+    names.save(names.snapshot())
+    assert names.snapshot() is None
+    reloaded = StringTable(str(path), capacity=3)
+    assert reloaded.intern("http") == 2
+
+def test_records_round_trip(tmp_path):
+    journal = TriggerJournal(str(tmp_path))
+    journal.record("serial", 1, 2, "press", "a.wav", 200, 1.0)
+    journal.record("serial", "70000", 2, "hold", "b.wav", 200, 2.0)
+    journal.record("http", 1, 3, "press", None, 404, 0.5)
+    journal.flush()
+    records = journal.load_segment(journal.segments()[0])
+    assert records['transmitter'].tolist() == [1, 0, 1]
+    assert records['button'].tolist() == [2, 2, 3]
+    assert records['event'].tolist() == [EVENT_CODES["press"], EVENT_CODES["hold"], EVENT_CODES["press"]]
+    assert [journal.sources.name(i) for i in records['source']] == ["serial", "serial", "http"]
+    assert [journal.files.name(i) for i in records['file']] == ["a.wav", "b.wav", ""]
+    assert records['status'].tolist() == [200, 200, 404]
+    stats = journal.query(transmitter=1)
+    assert stats['total'] == 2
+    assert stats['by_button'] == {'tx1/btn2': {'press': 1, 'hold': 0, 'hold_ratio': 0.0}}
+    assert stats['by_status'] == {'200': 1, '404': 1}
+    journal.close()
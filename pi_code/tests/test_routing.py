@@ -0,0 +1,57 @@
+"""Tests for route parsing and wildcard precedence in routing"""
+
+import pytest
+import routing
+from routing import RoutingTable, parse_mappings, WILDCARD
+
+def table(*rules):
+    return RoutingTable(parse_mappings({'routes': list(rules)}))
+
+def test_most_specific_rule_wins():
+    routes = table(
+        {'file': 'any.wav'},
+        {'button': 2, 'file': 'button2.wav'},
+        {'transmitter': 3, 'file': 'tx3.wav'},
+        {'transmitter': 3, 'button': 2, 'file': 'tx3_button2.wav'},
+    )
+    assert routes.resolve(3, 2, "press").audio_file == 'tx3_button2.wav'
+    assert routes.resolve(3, 1, "press").audio_file == 'tx3.wav'
+    assert routes.resolve(4, 2, "press").audio_file == 'button2.wav'
+    assert routes.resolve(4, 1, "press").audio_file == 'any.wav'
+
+def test_transmitter_wildcard_beats_button_wildcard():
+    routes = table(
+        {'button': 1, 'file': 'button1.wav'},
+        {'transmitter': 2, 'file': 'tx2.wav'},
+    )
+    assert routes.resolve(2, 1, "press").audio_file == 'tx2.wav'
+
+def test_ids_outside_precompiled_range():
+    routes = table({'transmitter': 500, 'button': 'big', 'file': 'named.wav'}, {'file': 'any.wav'})
+    assert (500, 'big', 'press') not in routes.resolved
+    assert routes.resolve(500, 'big', "press").audio_file == 'named.wav'
+    assert routes.resolve("500", "big", "press").audio_file == 'named.wav'
+    assert routes.resolve(501, 1, "press").audio_file == 'any.wav'
+
+def test_hold_fallback(monkeypatch):
+    rules = ({'button': 1, 'file': 'press.wav'},)
+    monkeypatch.setattr(routing, "ROUTING_HOLD_FALLBACK", False)
+    assert table(*rules).resolve(1, 1, "hold") is None
+    monkeypatch.setattr(routing, "ROUTING_HOLD_FALLBACK", True)
+    assert table(*rules).resolve(1, 1, "hold").audio_file == 'press.wav'
+    # A real hold route still wins over the fallback
+    assert table(*rules, {'button': 1, 'event': 'hold', 'file': 'hold.wav'}).resolve(1, 1, "hold").audio_file == 'hold.wav'
+
+def test_legacy_mappings():
+    routes = parse_mappings({'button1': 'a.wav', 'hold2': 'b.wav', 'tx3_button1': 'c.wav'})
+    assert [(r.transmitter, r.button, r.event) for r in routes] == [
+        (WILDCARD, 1, "press"), (WILDCARD, 2, "hold"), (3, 1, "press")]
+    assert RoutingTable(routes).resolve(3, 1, "press").audio_file == 'c.wav'
+
+def test_invalid_rules():
+    with pytest.raises(ValueError):
+        parse_mappings({'routes': [{'event': 'double', 'file': 'a.wav'}]})
+    with pytest.raises(ValueError):
+        parse_mappings({'routes': [{'priority': 'urgent', 'file': 'a.wav'}]})
+    with pytest.raises(ValueError):
+        parse_mappings({'buttonX': 'a.wav'})
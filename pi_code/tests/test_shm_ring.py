@@ -0,0 +1,48 @@
+"""Tests for the shared-memory command ring"""
+
+import pytest
+from shm_ring import SharedRing, INDEX, HEAD_OFFSET, TAIL_OFFSET, INDEX_MASK
+
+@pytest.fixture
+def ring():
+    ring = SharedRing.create(slots=4, slot_size=64)
+    yield ring
+    ring.close()
+
+def test_fifo_and_full(ring):
+    for i in range(4):
+        assert ring.push(bytes([i]) * 3)
+    assert not ring.push(b"overflow")
+    assert ring.depth() == 4
+    assert [ring.pop() for _ in range(4)] == [bytes([i]) * 3 for i in range(4)]
+    assert ring.pop() is None
+
+def test_slot_wraparound(ring):
+    # Many more messages than slots, so every slot is reused
+    for i in range(50):
+        assert ring.push(f"msg{i}".encode())
+        assert ring.push(f"next{i}".encode())
+        assert ring.pop() == f"msg{i}".encode()
+        assert ring.pop() == f"next{i}".encode()
+    assert ring.depth() == 0
+
+def test_index_wraparound(ring):
+    # Start just below 2**32 so head and tail wrap while messages are in flight
+    start = INDEX_MASK - 1
+    INDEX.pack_into(ring.buf, HEAD_OFFSET, start)
+    INDEX.pack_into(ring.buf, TAIL_OFFSET, start)
+    for i in range(4):
+        assert ring.push(bytes([i]))
+    assert not ring.push(b"x")
+    assert ring.depth() == 4
+    assert [ring.pop() for _ in range(4)] == [bytes([i]) for i in range(4)]
+    assert INDEX.unpack_from(ring.buf, TAIL_OFFSET)[0] == 2
+
+def test_unpublished_slot_is_not_read(ring):
+    # Head moved but the slot was never written: the consumer must wait
+    INDEX.pack_into(ring.buf, HEAD_OFFSET, 1)
+    assert ring.pop() is None
+
+def test_oversized_message(ring):
+    with pytest.raises(ValueError):
+        ring.push(bytes(ring.max_payload + 1))
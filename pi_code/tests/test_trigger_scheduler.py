@@ -0,0 +1,55 @@
+"""Tests for trigger rate limiting in trigger_scheduler"""
+
+import trigger_scheduler
+from trigger_scheduler import TokenBucket, FloodDetector, TriggerScheduler, OTHER_SOURCE
+
+def test_token_bucket_burst_and_refill():
+    bucket = TokenBucket(rate=2.0, burst=3)
+    now = bucket.updated
+    assert all(bucket.take(now) for _ in range(3))
+    assert not bucket.take(now)
+    # Half a second at 2/s buys exactly one token
+    assert bucket.take(now + 0.5)
+    assert not bucket.take(now + 0.5)
+
+def test_token_bucket_caps_at_burst():
+    bucket = TokenBucket(rate=2.0, burst=3)
+    now = bucket.updated
+    bucket.take(now)
+    assert not bucket.is_full(now)
+    later = now + 60
+    assert bucket.is_full(later)
+    assert sum(bucket.take(later) for _ in range(10)) == 3
+
+def test_flood_detector_throttles_and_recovers(monkeypatch):
+    monkeypatch.setattr(trigger_scheduler, "SCHEDULER_FLOOD_THRESHOLD", 3)
+    monkeypatch.setattr(trigger_scheduler, "SCHEDULER_FLOOD_WINDOW", 1.0)
+    monkeypatch.setattr(trigger_scheduler, "SCHEDULER_FLOOD_PENALTY", 5.0)
+    flood = FloodDetector()
+    assert not any(flood.record(100.0 + i * 0.1) for i in range(3))
+    assert flood.record(100.3)
+    assert flood.is_throttled(104.0)
+    assert not flood.is_throttled(105.4)
+    assert flood.is_idle(106.0)
+
+def test_per_client_state_is_bounded(monkeypatch):
+    monkeypatch.setattr(trigger_scheduler, "SCHEDULER_MAX_TRACKED", 16)
+    scheduler = TriggerScheduler(lambda: False)
+    press = trigger_scheduler.SCHEDULER_PRIORITIES["press"]
+    for i in range(200):
+        scheduler.admit(f"source{i}", i, 1, press)
+    assert len(scheduler.source_buckets) <= 16
+    assert len(scheduler.button_buckets) <= 16
+    assert len(scheduler.floods) <= 16
+    assert scheduler.stats['pruned'] > 0
+    assert scheduler.stats['accepted'] == 200
+
+def test_throttled_sources_are_capped(monkeypatch):
+    monkeypatch.setattr(trigger_scheduler, "SCHEDULER_MAX_TRACKED", 2)
+    monkeypatch.setattr(trigger_scheduler, "SCHEDULER_SOURCE_BURST", 0)
+    scheduler = TriggerScheduler(lambda: False)
+    press = trigger_scheduler.SCHEDULER_PRIORITIES["press"]
+    for i in range(5):
+        assert scheduler.admit(f"source{i}", 1, 1, press) == "source"
+    assert set(scheduler.throttled_by_source) == {"source0", "source1", OTHER_SOURCE}
+    assert scheduler.throttled_by_source[OTHER_SOURCE] == 3
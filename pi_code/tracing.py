@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Trigger Tracing for Raspberry Pi Audio Server
+Records timed spans for sampled triggers (serial read, HTTP hop, routing,
+sample lookup, mixer start, LEDs) into a bounded buffer, exported as Chrome
+trace event JSON for chrome://tracing or Perfetto
+"""
+
+import os
+import time
+import random
+import threading
+import contextvars
+import logging
+from collections import deque
+from config import *
+
+logger = logging.getLogger(__name__)
+
+# Trace id of the trigger being handled; asyncio tasks inherit it, threads get it through bind()
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+class NullSpan:
+    """Shared no-op span for code running outside a sampled trace"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    def __init__(self, tracer, trace_id, name, args):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.name = name
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type:
+            self.args['error'] = exc_type.__name__
+        self.tracer.record(self.trace_id, self.name, self.start, time.perf_counter(), self.args)
+        return False
+
+    def set(self, **args):
+        """Attach results known only once the span's work has run"""
+        self.args.update(args)
+
+class TraceScope:
+    """Makes a trace current for a block, restoring the previous one afterwards"""
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.token = None
+
+    def __enter__(self):
+        self.token = current_trace.set(self.trace_id)
+        return self.trace_id
+
+    def __exit__(self, *exc):
+        current_trace.reset(self.token)
+        return False
+
+class Tracer:
+    def __init__(self, enabled=TRACE_ENABLED, sample_rate=TRACE_SAMPLE_RATE,
+                 max_per_second=TRACE_MAX_PER_SECOND, max_events=TRACE_BUFFER_EVENTS):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.max_per_second = max_per_second
+        self.events = deque(maxlen=max_events)
+        self.thread_names = {}
+        self.lock = threading.Lock()
+        self.window = 0
+        self.window_traces = 0
+        self.traces_started = 0
+        self.traces_skipped = 0
+        self.spans_recorded = 0
+
+    def sample(self, upstream=None):
+        """Decide whether to trace a new trigger; returns its id or None
+
+        upstream is the id another component sampled the trigger under; it is
+        joined instead of drawing again, but still subject to the rate cap.
+        """
+        if not self.enabled:
+            return None
+        if upstream is None and random.random() >= self.sample_rate:
+            return None
+        now = int(time.monotonic())
+        with self.lock:
+            if now != self.window:
+                self.window = now
+                self.window_traces = 0
+            if self.window_traces >= self.max_per_second:
+                # Cap tracing cost during trigger floods
+                self.traces_skipped += 1
+                return None
+            self.window_traces += 1
+            self.traces_started += 1
+        # Random ids, so traces started by separate processes never merge
+        return upstream or random.getrandbits(63) or 1
+
+    def trace(self, upstream=None):
+        """Scope for handling one trigger
+
+        upstream is a trace id received from another component ("0" means it
+        was not sampled there); without one, a new sampling decision is made.
+        """
+        if upstream is not None:
+            try:
+                upstream = int(upstream)
+            except (TypeError, ValueError):
+                upstream = 0
+            trace_id = self.sample(upstream) if 0 < upstream < 2 ** 63 else None
+        else:
+            trace_id = self.sample()
+        return TraceScope(trace_id)
+
+    def span(self, name, **args):
+        trace_id = current_trace.get()
+        if trace_id is None:
+            return NULL_SPAN
+        return Span(self, trace_id, name, args)
+
+    def add_span(self, name, start, end, **args):
+        """Record a span whose start was measured before the trace existed"""
+        trace_id = current_trace.get()
+        if trace_id is not None:
+            self.record(trace_id, name, start, end, args)
+
+    def bind(self, callback, wait_span=None):
+        """Wrap a callback so it runs in the current trace on whatever thread calls it
+
+        With wait_span, the time until the call is recorded as a span of that name.
+        """
+        trace_id = current_trace.get()
+        if trace_id is None:
+            return callback
+        queued_at = time.perf_counter()
+
+        def traced(*args, **kwargs):
+            token = current_trace.set(trace_id)
+            try:
+                if wait_span:
+                    self.record(trace_id, wait_span, queued_at, time.perf_counter(), {})
+                return callback(*args, **kwargs)
+            finally:
+                current_trace.reset(token)
+        return traced
+
+    def header(self):
+        """Value to pass downstream so the next hop joins (or skips) this trace"""
+        return str(current_trace.get() or 0)
+
+    def record(self, trace_id, name, start, end, args):
+        thread_id = threading.get_native_id()
+        if thread_id not in self.thread_names:
+            self.thread_names[thread_id] = threading.current_thread().name
+        self.events.append((trace_id, name, start, end, thread_id, args))
+        self.spans_recorded += 1
+
+    def export(self, trace_id=None, last=None):
+        """Chrome trace event JSON for buffered spans, optionally one trace or the last N traces"""
+        events = list(self.events)
+        if trace_id is not None:
+            events = [event for event in events if event[0] == trace_id]
+        elif last:
+            keep = set(list(dict.fromkeys(event[0] for event in events))[-last:])
+            events = [event for event in events if event[0] in keep]
+        pid = os.getpid()
+        thread_ids = {event[4] for event in events}
+        trace_events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id, 'args': {'name': name}}
+            for thread_id, name in list(self.thread_names.items()) if thread_id in thread_ids
+        ]
+        for event_trace, name, start, end, thread_id, args in events:
+            trace_events.append({
+                'name': name,
+                'cat': 'trigger',
+                'ph': 'X',
+                'ts': round(start * 1e6, 1),
+                'dur': round((end - start) * 1e6, 1),
+                'pid': pid,
+                'tid': thread_id,
+                'args': dict(args, trace_id=str(event_trace))
+            })
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def configure(self, enabled=None, sample_rate=None, max_per_second=None):
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if sample_rate is not None:
+            self.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+        if max_per_second is not None:
+            self.max_per_second = max(0, int(max_per_second))
+        logger.info(f"Tracing {'enabled' if self.enabled else 'disabled'}, sample rate {self.sample_rate}, "
+                    f"max {self.max_per_second}/s")
+
+    def clear(self):
+        self.events.clear()
+        self.thread_names.clear()
+
+    def get_status(self):
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'max_per_second': self.max_per_second,
+            'traces_started': self.traces_started,
+            'traces_skipped': self.traces_skipped,
+            'spans_recorded': self.spans_recorded,
+            'buffered_spans': len(self.events),
+            'buffer_size': self.events.maxlen
+        }
+
+tracer = Tracer()
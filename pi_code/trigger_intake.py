@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Trigger Intake for Raspberry Pi Audio Server
+Deduplicates retried triggers by client event ID and, in fast-ack mode, queues
+triggers so the HTTP reply does not wait for routing and playback
+"""
+
+import time
+import queue
+import threading
+import logging
+from collections import OrderedDict
+from config import *
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+MAX_NAME_LENGTH = 64
+
+def parse_trigger_id(value, field):
+    """Normalize a client transmitter or button id
+
+    Numbers (or numeric strings) must fit a u16 like the journal stores;
+    short names are kept as strings for named routes. Raises ValueError.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid {field}")
+    if isinstance(value, str) and not value.strip().lstrip('-').isdigit():
+        if not value or len(value) > MAX_NAME_LENGTH:
+            raise ValueError(f"Invalid {field}")
+        return value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if not isinstance(value, (int, str)):
+        raise ValueError(f"Invalid {field}")
+    value = int(value)
+    if not 0 <= value <= 0xFFFF:
+        raise ValueError(f"Invalid {field}")
+    return value
+
+def parse_trigger(data, default_source='direct'):
+    """Build a validated trigger dict from a request body; raises ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    if not data.get('button_id'):
+        raise ValueError("Missing button_id")
+    source = data.get('source', default_source)
+    if not isinstance(source, str) or not source or len(source) > MAX_NAME_LENGTH:
+        raise ValueError("Invalid source")
+    event_id = data.get('event_id')
+    if event_id is not None and (not isinstance(event_id, (str, int)) or isinstance(event_id, bool)
+                                 or len(str(event_id)) > MAX_NAME_LENGTH):
+        raise ValueError("Invalid event_id")
+    return {
+        'button_id': parse_trigger_id(data.get('button_id'), 'button_id'),
+        'is_hold': bool(data.get('is_hold', False)),
+        'source': source,
+        'transmitter_id': parse_trigger_id(data.get('transmitter_id', TRANSMITTER_ID), 'transmitter_id')
+    }
+
+class RecentEventIds:
+    """Bounded, time-windowed LRU of event IDs and the response each one got"""
+
+    def __init__(self, max_ids=DEDUP_MAX_IDS, ttl=DEDUP_TTL):
+        self.max_ids = max_ids
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.duplicates = 0
+
+    def claim(self, key):
+        """Reserve an event ID
+
+        Returns None if the ID is new (the caller must then complete() it),
+        otherwise the (body, status) recorded for the first delivery.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.expire(now)
+            entry = self.entries.get(key)
+            if entry:
+                self.duplicates += 1
+                return entry[1]
+            self.entries[key] = (now, ({'status': 'accepted'}, 202))
+            while len(self.entries) > self.max_ids:
+                self.entries.popitem(last=False)
+            return None
+
+    def complete(self, key, body, status_code):
+        """Record the response for a claimed event ID"""
+        with self.lock:
+            if key in self.entries:
+                self.entries[key] = (self.entries[key][0], (body, status_code))
+
+    def release(self, key):
+        """Forget a claimed event ID that could not be processed"""
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def expire(self, now):
+        """Drop IDs older than the dedup window
+
+        Must be called with the lock held.
+        """
+        while self.entries:
+            key, (seen_at, _) = next(iter(self.entries.items()))
+            if now - seen_at <= self.ttl:
+                break
+            del self.entries[key]
+
+    def get_status(self):
+        with self.lock:
+            return {'tracked': len(self.entries), 'duplicates': self.duplicates}
+
+class TriggerIntake:
+    def __init__(self, handle_trigger):
+        """handle_trigger(button_id, is_hold, source, transmitter_id) -> (body, status)"""
+        self.handle_trigger = handle_trigger
+        self.event_ids = RecentEventIds()
+        self.queue = queue.Queue(maxsize=TRIGGER_INTAKE_QUEUE_SIZE)
+        self.worker_thread = None
+        self.accepted = 0
+        self.rejected = 0
+
+    def start(self):
+        """Start the worker that processes fast-acked triggers"""
+        if self.worker_thread and self.worker_thread.is_alive():
+            return
+        self.worker_thread = threading.Thread(target=self.worker_loop, daemon=True)
+        self.worker_thread.start()
+
+    def submit(self, trigger, event_id=None, fast_ack=TRIGGER_FAST_ACK):
+        """Accept a trigger dict and return the (body, status) to reply with"""
+        key = None
+        if event_id is not None:
+            # Controllers number their own events, so scope IDs per transmitter
+            key = f"{trigger['transmitter_id']}:{event_id}"
+            previous = self.event_ids.claim(key)
+            if previous:
+                body, status_code = previous
+                return dict(body, duplicate=True), status_code
+
+        if fast_ack:
+            try:
+                self.queue.put_nowait((trigger, tracer.bind(self.process, "intake_queue")))
+            except queue.Full:
+                self.rejected += 1
+                if key:
+                    self.event_ids.release(key)
+                return {'error': 'Trigger queue full'}, 503
+            self.accepted += 1
+            body, status_code = {'status': 'accepted', 'event_id': event_id}, 202
+        else:
+            try:
+                body, status_code = self.process(trigger)
+            except Exception:
+                # Let a retry of this event try again
+                if key:
+                    self.event_ids.release(key)
+                raise
+            if event_id is not None:
+                body = dict(body, event_id=event_id)
+
+        if key:
+            self.event_ids.complete(key, body, status_code)
+        return body, status_code
+
+    def process(self, trigger):
+        return self.handle_trigger(trigger['button_id'], trigger['is_hold'],
+                                   trigger['source'], trigger['transmitter_id'])
+
+    def worker_loop(self):
+        while True:
+            trigger, process = self.queue.get()
+            try:
+                body, status_code = process(trigger)
+                if status_code >= 400:
+                    logger.warning(f"Queued trigger failed: {body}")
+            except Exception as e:
+                logger.error(f"Error processing queued trigger: {e}")
+
+    def get_status(self):
+        return {
+            'queued': self.queue.qsize(),
+            'fast_acked': self.accepted,
+            'rejected': self.rejected,
+            'event_ids': self.event_ids.get_status()
+        }
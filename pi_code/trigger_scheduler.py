@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Trigger Scheduler for Raspberry Pi Audio Server
+Rate limits triggers per source and button, throttles flooding transmitters and
+dispatches accepted triggers in priority order
+"""
+
+import time
+import heapq
+import threading
+import logging
+from collections import deque
+from config import *
+from wakeups import wakeups
+
+logger = logging.getLogger(__name__)
+
+OTHER_SOURCE = "(other)"
+
+class TokenBucket:
+    """Allow `rate` events per second with bursts of up to `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """Spend a token if one is available"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def is_full(self, now):
+        """Refilled to its burst, so dropping it loses nothing"""
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+class FloodDetector:
+    """Track one transmitter's recent trigger rate and its throttle state"""
+
+    def __init__(self):
+        self.times = deque()
+        self.throttled_until = 0.0
+        self.floods = 0
+
+    def record(self, now):
+        """Record a trigger; returns True if this trigger starts a flood"""
+        self.times.append(now)
+        while self.times and now - self.times[0] > SCHEDULER_FLOOD_WINDOW:
+            self.times.popleft()
+        if len(self.times) > SCHEDULER_FLOOD_THRESHOLD:
+            self.times.clear()
+            self.throttled_until = now + SCHEDULER_FLOOD_PENALTY
+            self.floods += 1
+            return True
+        return False
+
+    def is_throttled(self, now):
+        return now < self.throttled_until
+
+    def is_idle(self, now):
+        """No recent triggers and not throttled"""
+        return not self.is_throttled(now) and (not self.times or now - self.times[-1] > SCHEDULER_FLOOD_WINDOW)
+
+def priority_for(route, event):
+    """Priority class for a trigger: the route's own class, else its event type"""
+    name = getattr(route, 'priority', None) or event
+    return SCHEDULER_PRIORITIES.get(name, SCHEDULER_PRIORITIES["press"])
+
+class TriggerScheduler:
+    def __init__(self, is_playing, event_callback=None):
+        """is_playing reports whether the current sound is still playing"""
+        self.is_playing = is_playing
+        self.event_callback = event_callback
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.heap = []
+        self.sequence = 0
+        self.source_buckets = {}
+        self.button_buckets = {}
+        self.floods = {}
+        self.playing_priority = None
+        self.worker_thread = None
+        self.stats = {
+            'accepted': 0,
+            'dispatched': 0,
+            'throttled_source': 0,
+            'throttled_button': 0,
+            'throttled_flood': 0,
+            'dropped_queue_full': 0,
+            'rejected_priority': 0,
+            'dropped_priority': 0,
+            'pruned': 0
+        }
+        self.throttled_by_source = {}
+
+    def notify(self, event_type, **data):
+        """Send a scheduler event to the event callback if one is set"""
+        if self.event_callback:
+            try:
+                self.event_callback(event_type, **data)
+            except Exception as e:
+                logger.error(f"Error sending scheduler event: {e}")
+
+    def start(self):
+        """Start the dispatcher thread"""
+        if self.worker_thread and self.worker_thread.is_alive():
+            return
+        self.worker_thread = threading.Thread(target=self.dispatch_loop, daemon=True)
+        self.worker_thread.start()
+
+    def admit(self, source, transmitter, button, priority):
+        """Apply flood detection and rate limits to a trigger
+
+        Returns None if the trigger may proceed, otherwise the reason it was
+        throttled. Emergency triggers are never throttled.
+        """
+        now = time.monotonic()
+        with self.lock:
+            flood = self.floods.setdefault(transmitter, FloodDetector())
+            started_flood = flood.record(now)
+            if priority <= SCHEDULER_PRIORITIES["emergency"]:
+                reason = None
+            elif flood.is_throttled(now):
+                reason = "flood"
+            else:
+                source_bucket = self.source_buckets.get(source)
+                if source_bucket is None:
+                    source_bucket = TokenBucket(SCHEDULER_SOURCE_RATE, SCHEDULER_SOURCE_BURST)
+                    self.source_buckets[source] = source_bucket
+                button_bucket = self.button_buckets.get((transmitter, button))
+                if button_bucket is None:
+                    button_bucket = TokenBucket(SCHEDULER_BUTTON_RATE, SCHEDULER_BUTTON_BURST)
+                    self.button_buckets[(transmitter, button)] = button_bucket
+                if not source_bucket.take(now):
+                    reason = "source"
+                elif not button_bucket.take(now):
+                    reason = "button"
+                else:
+                    reason = None
+
+            if reason:
+                self.stats[f'throttled_{reason}'] += 1
+                if source not in self.throttled_by_source and len(self.throttled_by_source) >= SCHEDULER_MAX_TRACKED:
+                    source = OTHER_SOURCE
+                self.throttled_by_source[source] = self.throttled_by_source.get(source, 0) + 1
+            else:
+                self.stats['accepted'] += 1
+            if max(len(self.source_buckets), len(self.button_buckets), len(self.floods)) > SCHEDULER_MAX_TRACKED:
+                self.prune(now)
+
+        if started_flood:
+            logger.warning(f"Transmitter {transmitter} is flooding, throttling for {SCHEDULER_FLOOD_PENALTY}s")
+            self.notify("transmitter_throttled", transmitter_id=transmitter,
+                        source=source, seconds=SCHEDULER_FLOOD_PENALTY)
+        if reason:
+            logger.debug(f"Throttled trigger from {source} tx{transmitter} btn{button} ({reason})")
+        return reason
+
+    def prune(self, now):
+        """Bound the per-client state, which senders can grow by cycling ids
+
+        Entries that are back to their initial state are dropped first, then
+        the oldest, down to three quarters of SCHEDULER_MAX_TRACKED so the
+        sweep is not repeated on every trigger. Must be called with the lock held.
+        """
+        target = SCHEDULER_MAX_TRACKED * 3 // 4
+        for table, is_idle in ((self.source_buckets, lambda bucket: bucket.is_full(now)),
+                               (self.button_buckets, lambda bucket: bucket.is_full(now)),
+                               (self.floods, lambda flood: flood.is_idle(now) and not flood.floods)):
+            if len(table) <= target:
+                continue
+            for key in [key for key, entry in table.items() if is_idle(entry)]:
+                del table[key]
+            for key in list(table)[:max(0, len(table) - target)]:
+                del table[key]
+        self.stats['pruned'] += 1
+
+    def outranked(self, priority):
+        """Whether a higher class is still playing, so this one may not cut it off
+
+        Must be called with the lock held.
+        """
+        return (SCHEDULER_PROTECT_PRIORITY and self.playing_priority is not None
+                and priority > self.playing_priority and self.is_playing())
+
+    def submit(self, priority, callback, *args):
+        """Queue an accepted trigger for dispatch in priority order
+
+        Returns None once queued, otherwise why it was not: "priority" while a
+        higher class is playing, or "queue_full".
+        """
+        with self.lock:
+            if self.outranked(priority):
+                self.stats['rejected_priority'] += 1
+                return "priority"
+            self.sequence += 1
+            item = (priority, self.sequence, callback, args)
+            if len(self.heap) >= SCHEDULER_QUEUE_SIZE:
+                # Make room by dropping the lowest priority, newest trigger
+                worst = max(self.heap)
+                if item > worst:
+                    self.stats['dropped_queue_full'] += 1
+                    return "queue_full"
+                self.heap.remove(worst)
+                heapq.heapify(self.heap)
+                self.stats['dropped_queue_full'] += 1
+            heapq.heappush(self.heap, item)
+            self.ready.notify()
+        return None
+
+    def dispatch_loop(self):
+        """Run queued triggers, highest priority first"""
+        while True:
+            with self.lock:
+                while not self.heap:
+                    self.ready.wait()
+                wakeups.record("scheduler")
+                priority, _, callback, args = heapq.heappop(self.heap)
+                # A lower class never cuts off a higher class that is still playing;
+                # one queued before the higher class started is dropped here
+                dropped = self.outranked(priority)
+                if dropped:
+                    self.stats['dropped_priority'] += 1
+                    playing_priority = self.playing_priority
+                else:
+                    self.playing_priority = priority
+                    self.stats['dispatched'] += 1
+            if dropped:
+                logger.info(f"Dropped queued trigger of priority {priority} behind priority {playing_priority}")
+                self.notify("trigger_dropped", priority=priority, playing_priority=playing_priority,
+                            reason="priority")
+                continue
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Error dispatching trigger: {e}")
+
+    def get_status(self):
+        """Get scheduler counters"""
+        now = time.monotonic()
+        with self.lock:
+            return {
+                'queued': len(self.heap),
+                'stats': dict(self.stats),
+                'throttled_by_source': dict(self.throttled_by_source),
+                'throttled_transmitters': [
+                    transmitter for transmitter, flood in self.floods.items() if flood.is_throttled(now)
+                ],
+                'floods': {str(transmitter): flood.floods for transmitter, flood in self.floods.items() if flood.floods}
+            }
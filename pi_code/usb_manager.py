@@ -6,23 +6,58 @@ Handles USB drive detection, mounting, and LED status indication
 
 import os
 import time
+import select
+import socket
 import subprocess
 import logging
 import threading
 import RPi.GPIO as GPIO
 from pathlib import Path
 from config import *
+from wakeups import wakeups, timers
 
 logger = logging.getLogger(__name__)
 
+NETLINK_KOBJECT_UEVENT = 15  # Linux netlink family for kernel device events
+
+def open_uevent_socket():
+    """Netlink socket receiving kernel device events, or None to fall back to polling"""
+    if not USB_UEVENTS:
+        return None
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_KOBJECT_UEVENT)
+        sock.bind((0, 1))  # Group 1: events straight from the kernel, as udevd receives them
+        return sock
+    except (OSError, AttributeError) as e:
+        logger.warning(f"Kernel device events unavailable, polling every {USB_CHECK_INTERVAL}s: {e}")
+        return None
+
+def parse_uevent(data):
+    """Fields of one kernel uevent ("add@/devices/...\0ACTION=add\0...") as a dict"""
+    fields = {}
+    for part in data.split(b'\0')[1:]:
+        key, sep, value = part.partition(b'=')
+        if sep:
+            fields[key.decode('ascii', errors='replace')] = value.decode('utf-8', errors='replace')
+    return fields
+
+def is_usb_disk_event(fields):
+    """A USB stick appearing, changing or disappearing (the sd* devices lsblk is filtered to)"""
+    return fields.get('SUBSYSTEM') == 'block' and fields.get('DEVNAME', '').startswith('sd')
+
 class USBManager:
-    def __init__(self):
+    def __init__(self, event_callback=None):
         self.mounted_devices = {}
+        self.usb_audio_files = {}
+        self.audio_dir_mtimes = {}  # Audio directory mtime per mount when last indexed
+        self.event_callback = event_callback
         self.usb_led_pin = USB_LED_PIN
         self.mount_point = USB_MOUNT_POINT
         self.audio_dir = USB_AUDIO_DIR
         self.running = False
-        self.led_thread = None
+        self.led_timer = None
+        self.uevent_socket = None
+        self.stop_pipe = None
         
         # Setup GPIO for LED
         self.setup_gpio()
@@ -47,6 +82,14 @@ class USBManager:
             logger.info(f"Mount point ready: {self.mount_point}")
         except Exception as e:
             logger.error(f"Failed to create mount point: {e}")
+
+    def notify(self, event_type, **data):
+        """Forward a device state change to the registered event callback"""
+        if self.event_callback:
+            try:
+                self.event_callback(event_type, **data)
+            except Exception as e:
+                logger.error(f"USB event callback error: {e}")
             
     def get_usb_devices(self):
         """Get list of connected USB storage devices"""
@@ -108,6 +151,8 @@ class USBManager:
                     'label': label,
                     'mounted_at': time.time()
                 }
+                self.refresh_audio_files()
+                self.notify("usb_mounted", device=device, mount_path=mount_path, label=label)
                 return True
             else:
                 logger.error(f"Failed to mount {device}: {result.stderr}")
@@ -132,6 +177,8 @@ class USBManager:
                 if result.returncode == 0:
                     logger.info(f"Successfully unmounted {device}")
                     del self.mounted_devices[device]
+                    self.refresh_audio_files()
+                    self.notify("usb_removed", device=device, mount_path=mount_path)
                     
                     # Remove empty mount directory
                     try:
@@ -148,11 +195,11 @@ class USBManager:
             logger.error(f"Error unmounting {device}: {e}")
             return False
             
-    def get_audio_files_from_usb(self):
-        """Get audio files from all mounted USB devices"""
+    def scan_audio_files(self):
+        """Scan all mounted USB devices for audio files"""
         audio_files = {}
         
-        for device, info in self.mounted_devices.items():
+        for device, info in list(self.mounted_devices.items()):
             mount_path = info['mount_path']
             audio_path = os.path.join(mount_path, self.audio_dir)
             
@@ -163,31 +210,68 @@ class USBManager:
                             # Use device label as prefix to avoid conflicts
                             key = f"{info['label']}_{file}" if info['label'] else file
                             audio_files[key] = os.path.join(audio_path, file)
-                            logger.info(f"Found USB audio file: {key}")
+                            logger.debug(f"Found USB audio file: {key}")
                 except Exception as e:
                     logger.error(f"Error reading audio files from {audio_path}: {e}")
                     
         return audio_files
         
+    def audio_dir_state(self):
+        """mtime of each mounted device's audio directory, None where it is missing"""
+        mtimes = {}
+        for device, info in list(self.mounted_devices.items()):
+            try:
+                mtimes[device] = os.stat(os.path.join(info['mount_path'], self.audio_dir)).st_mtime
+            except OSError:
+                mtimes[device] = None
+        return mtimes
+
+    def refresh_audio_files(self):
+        """Rescan USB audio files and swap in the new index"""
+        mtimes = self.audio_dir_state()
+        self.usb_audio_files = self.scan_audio_files()
+        self.audio_dir_mtimes = mtimes
+        logger.info(f"Indexed {len(self.usb_audio_files)} USB audio files")
+        return self.usb_audio_files
+        
+    def get_audio_files_from_usb(self):
+        """Get audio files from all mounted USB devices
+
+        Served from the index built at mount/unmount time. Adding or deleting
+        a file changes its directory's mtime, so one stat per mounted device
+        catches files changed on a stick that stays mounted.
+        """
+        if self.mounted_devices and self.audio_dir_state() != self.audio_dir_mtimes:
+            self.refresh_audio_files()
+        return self.usb_audio_files
+        
     def led_blink_pattern(self, pattern_name):
-        """Blink LED in specified pattern"""
+        """Blink LED in specified pattern on the shared timer thread; returns immediately"""
         if pattern_name not in LED_PATTERNS:
             logger.error(f"Unknown LED pattern: {pattern_name}")
             return
             
         blinks, interval = LED_PATTERNS[pattern_name]
+        self.cancel_led_pattern()
+        self.led_step(int(blinks) * 2, interval)
         
+    def led_step(self, remaining, interval):
+        """One edge of an LED pattern; even counts turn the LED on"""
         try:
-            for i in range(int(blinks)):
-                GPIO.output(self.usb_led_pin, GPIO.HIGH)
-                time.sleep(interval)
-                GPIO.output(self.usb_led_pin, GPIO.LOW)
-                time.sleep(interval)
+            GPIO.output(self.usb_led_pin, GPIO.HIGH if remaining % 2 == 0 else GPIO.LOW)
         except Exception as e:
             logger.error(f"LED pattern error: {e}")
+            return
+        self.led_timer = timers.call_later(interval, self.led_step, remaining - 1, interval) if remaining > 1 else None
+        
+    def cancel_led_pattern(self):
+        if self.led_timer:
+            self.led_timer.cancel()
+            self.led_timer = None
             
     def led_on(self):
         """Turn LED on"""
+        self.cancel_led_pattern()
         try:
             GPIO.output(self.usb_led_pin, GPIO.HIGH)
         except Exception as e:
@@ -195,6 +279,7 @@ class USBManager:
             
     def led_off(self):
         """Turn LED off"""
+        self.cancel_led_pattern()
         try:
             GPIO.output(self.usb_led_pin, GPIO.LOW)
         except Exception as e:
@@ -225,13 +310,46 @@ class USBManager:
                 logger.info(f"USB device removed: {device}")
                 self.unmount_device(device)
                 
+    def read_uevents(self):
+        """Drain queued kernel events; True if any concerned a USB disk"""
+        relevant = False
+        while True:
+            try:
+                data = self.uevent_socket.recv(65536, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                return relevant
+            relevant = relevant or is_usb_disk_event(parse_uevent(data))
+            
+    def wait_for_device_change(self):
+        """Sleep until a USB disk event, then until its burst of events settles
+
+        Returns False when monitoring is being stopped.
+        """
+        watched = [self.uevent_socket, self.stop_pipe[0]]
+        changed = False
+        while self.running:
+            ready, _, _ = select.select(watched, [], [], USB_UEVENT_SETTLE if changed else None)
+            wakeups.record("usb")
+            if self.stop_pipe[0] in ready:
+                return False
+            if not ready:
+                return True  # Quiet for USB_UEVENT_SETTLE since the last event
+            changed = self.read_uevents() or changed
+        return False
+        
     def start_monitoring(self):
-        """Start USB monitoring in background thread"""
+        """Start USB monitoring in background thread
+
+        Rescans run when the kernel reports a block device event; without
+        netlink access the devices are polled every USB_CHECK_INTERVAL.
+        """
         if not USB_MOUNT_ENABLED:
             logger.info("USB monitoring disabled")
             return
             
         self.running = True
+        self.uevent_socket = open_uevent_socket()
+        self.stop_pipe = os.pipe()
         
         def monitor_loop():
             logger.info("Starting USB monitoring...")
@@ -240,11 +358,15 @@ class USBManager:
             while self.running:
                 try:
                     self.check_usb_devices()
-                    time.sleep(USB_CHECK_INTERVAL)
                 except Exception as e:
                     logger.error(f"USB monitoring error: {e}")
                     self.led_blink_pattern("system_error")
-                    time.sleep(USB_CHECK_INTERVAL)
+                if self.uevent_socket:
+                    if not self.wait_for_device_change():
+                        break
+                else:
+                    select.select([self.stop_pipe[0]], [], [], USB_CHECK_INTERVAL)
+                    wakeups.record("usb")
                     
         self.monitor_thread = threading.Thread(target=monitor_loop, daemon=True)
         self.monitor_thread.start()
@@ -252,8 +374,17 @@ class USBManager:
     def stop_monitoring(self):
         """Stop USB monitoring"""
         self.running = False
+        if self.stop_pipe:
+            os.write(self.stop_pipe[1], b'\x01')
         if hasattr(self, 'monitor_thread'):
             self.monitor_thread.join(timeout=5)
+        if self.uevent_socket:
+            self.uevent_socket.close()
+            self.uevent_socket = None
+        if self.stop_pipe:
+            for fd in self.stop_pipe:
+                os.close(fd)
+            self.stop_pipe = None
             
         # Unmount all devices
         for device in list(self.mounted_devices.keys()):
@@ -266,9 +397,10 @@ class USBManager:
         """Get USB manager status"""
         return {
             'enabled': USB_MOUNT_ENABLED,
+            'device_events': self.uevent_socket is not None,
             'mounted_devices': len(self.mounted_devices),
             'devices': list(self.mounted_devices.keys()),
-            'audio_files': len(self.get_audio_files_from_usb())
+            'audio_files': len(self.usb_audio_files)
         }
         
     def cleanup(self):
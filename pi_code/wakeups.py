@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Wakeup Accounting for Raspberry Pi Audio Server
+Counts how often each subsystem's thread wakes up, and provides the shared
+timer thread and end-of-playback signal that let subsystems block on real
+events instead of polling
+"""
+
+import time
+import heapq
+import itertools
+import asyncio
+import threading
+import logging
+from collections import Counter, deque
+from config import *
+
+logger = logging.getLogger(__name__)
+
+class WakeupCounter:
+    """Per-subsystem wakeup totals with rates over the last WAKEUP_WINDOW seconds"""
+
+    def __init__(self, window=WAKEUP_WINDOW):
+        self.window = window
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.snapshots = deque([(self.started, {})])
+
+    def record(self, subsystem, count=1):
+        with self.lock:
+            self.counts[subsystem] += count
+
+    def total(self):
+        with self.lock:
+            return sum(self.counts.values())
+
+    def get_status(self):
+        """Totals and wakeups per second, measured from the oldest snapshot in the window"""
+        now = time.monotonic()
+        with self.lock:
+            totals = dict(self.counts)
+            self.snapshots.append((now, totals))
+            while len(self.snapshots) > 2 and now - self.snapshots[1][0] >= self.window:
+                self.snapshots.popleft()
+            since, base = self.snapshots[0]
+        elapsed = max(now - since, 1e-6)
+        subsystems = {
+            name: {
+                'total': total,
+                'per_second': round((total - base.get(name, 0)) / elapsed, 3)
+            }
+            for name, total in sorted(totals.items())
+        }
+        return {
+            'window_s': round(elapsed, 1),
+            'per_second': round(sum(entry['per_second'] for entry in subsystems.values()), 3),
+            'subsystems': subsystems
+        }
+
+wakeups = WakeupCounter()
+
+class Timer:
+    def __init__(self, deadline, sequence, callback, args):
+        self.deadline = deadline
+        self.sequence = sequence
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __lt__(self, other):
+        # Timers coalesced onto one deadline fire in the order they were set
+        return (self.deadline, self.sequence) < (other.deadline, other.sequence)
+
+class TimerThread:
+    """One thread for every short timer in the server
+
+    Deadlines are rounded up to TIMER_SLACK, so timers that are due close
+    together fire on a single wakeup. Callbacks run on this thread and must
+    not block.
+    """
+
+    def __init__(self, slack=TIMER_SLACK):
+        self.slack = slack
+        self.heap = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.fired = 0
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) after delay seconds; returns a handle with cancel()"""
+        deadline = time.monotonic() + max(0.0, delay)
+        if self.slack:
+            deadline = -(-deadline // self.slack) * self.slack
+        with self.condition:
+            timer = Timer(deadline, next(self.sequence), callback, args)
+            heapq.heappush(self.heap, timer)
+            if self.heap[0] is timer:
+                self.condition.notify()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="timers", daemon=True)
+                self.thread.start()
+        return timer
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.heap or self.heap[0].deadline > time.monotonic():
+                    self.condition.wait(self.heap[0].deadline - time.monotonic() if self.heap else None)
+                now = time.monotonic()
+                due = []
+                while self.heap and self.heap[0].deadline <= now:
+                    due.append(heapq.heappop(self.heap))
+            wakeups.record("timers")
+            for timer in due:
+                if timer.cancelled:
+                    continue
+                self.fired += 1
+                try:
+                    timer.callback(*timer.args)
+                except Exception as e:
+                    logger.error(f"Timer callback failed: {e}")
+
+    def get_status(self):
+        with self.condition:
+            pending = sum(1 for timer in self.heap if not timer.cancelled)
+        return {'pending': pending, 'fired': self.fired, 'slack_ms': self.slack * 1000}
+
+timers = TimerThread()
+
+class Signal:
+    """Generation-counted notification that threads and coroutines can wait on
+
+    Waiters pass the generation they last saw, so a notify between checking
+    state and starting to wait is never lost.
+    """
+
+    def __init__(self):
+        self.generation = 0
+        self.condition = threading.Condition()
+        self.futures = []
+
+    def notify(self):
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
+            futures, self.futures = self.futures, []
+        for loop, future in futures:
+            loop.call_soon_threadsafe(lambda future=future: future.done() or future.set_result(None))
+
+    def wait(self, generation, timeout=None):
+        """Block until the generation moves past the one given; returns the current one"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.generation != generation, timeout)
+            return self.generation
+
+    async def wait_async(self, generation, timeout=None):
+        """Coroutine version of wait for the asyncio runtime"""
+        loop = asyncio.get_running_loop()
+        with self.condition:
+            if self.generation != generation:
+                return self.generation
+            future = loop.create_future()
+            self.futures.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            with self.condition:
+                if (loop, future) in self.futures:
+                    self.futures.remove((loop, future))
+        return self.generation